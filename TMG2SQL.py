@@ -20,53 +20,63 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 #
-# External Dependency: dbfread2
+# Optional Dependency: dbfread2, for DBF files the built-in reader doesn't handle
 # install with:
 # python -m pip install -r requirements.txt
 
 """Make an SQLite file from a TMG database set"""
 
+import argparse
+from array import array
+from collections import namedtuple
+import calendar
 import configparser
+from contextlib import contextmanager
+from contextlib import ExitStack
+import copy
 import datetime
-from dbfread import DBF
+from decimal import Decimal
+import hashlib
+import importlib.util
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
 from fnmatch import fnmatch
 import logging
+import mmap
+import multiprocessing
 import os
 from pathlib import Path
+from pathlib import PurePosixPath
 from pprint import pformat
+import queue
+import re
+import shutil
 import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zipfile
 
-import tkinter as tk
-from tkinter import ttk
-from tkinter import Tk
-from tkinter import IntVar
-from tkinter import StringVar
-from tkinter.filedialog import askopenfilenames
-from tkinter.filedialog import askdirectory
-from tkinter.ttk import Checkbutton
-from tkinter.ttk import Entry
-from tkinter.ttk import Frame
-from tkinter.ttk import Button
-from tkinter.ttk import Label
-from tkinter.ttk import Radiobutton
+try:
+    from dbfread import DBF     # Fallback reader for DBF files that DbfReader doesn't handle
+except ImportError:
+    DBF = None
+
+try:
+    import resource     # For the peak memory use, not on Windows
+except ImportError:
+    resource = None
 
 LOG = logging.getLogger(__name__)
 
 ERROR_CHAR = '�'
-# Globals for options
-#Progress = None
-#file = None
-
-Version = "0.2.1"
-
-root = Tk()
-pattern = StringVar(value="*")
-recursive = IntVar(value=1)
-project = StringVar(value="Project")
-progress_file = StringVar()
-progress = StringVar()
-log_level = IntVar(value=logging.WARNING)
 
+Version = "0.3.0"
 
 
 def _(x):
@@ -87,14 +97,138 @@ typemap = {
     '0': 'INTEGER',
 }
 
+# Number of records sent to executemany at a time when bulk loading
+BATCH_SIZE = 5000
+
+# PRAGMA settings used while bulk loading a new database.
+# journal_mode is MEMORY, not OFF, so a failed chunk can still be rolled back.
+BULK_PRAGMAS = {
+    'journal_mode': 'MEMORY',
+    'synchronous':  'OFF',
+    'cache_size':   -256000,        # Negative is in KiB, so 250 MiB
+    'temp_store':   'MEMORY',
+    'locking_mode': 'EXCLUSIVE',
+}
+
+# PRAGMA settings used while updating a database in place (see update_database).
+# The journal is kept on disk, so an update cut short is rolled back the next time the database is opened.
+UPDATE_PRAGMAS = dict(BULK_PRAGMAS, journal_mode='DELETE', synchronous='NORMAL')
+
+# PRAGMA settings restored when the load is done (the SQLite defaults)
+SAFE_PRAGMAS = {
+    'locking_mode': 'NORMAL',
+    'journal_mode': 'DELETE',
+    'synchronous':  'FULL',
+    'cache_size':   -2000,
+    'temp_store':   'DEFAULT',
+}
+
+
+# A staged database (see stage_database) estimated to be larger than this is built in a
+# temporary file rather than in memory
+STAGE_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# Pages copied by each step of the backup that publishes a staged database
+BACKUP_PAGES = 4096
+
+
+class Options:
+    """The settings for a conversion, from the command line or the GUI
+
+    Attributes:
+    batch_size -- chunk size for bulk loading, 0 to insert a record at a time
+    defer_indexes -- build the indexes after loading each table, and ANALYZE at the end
+    workers -- number of processes to decode the tables (or convert the projects) with
+    incremental -- only copy the tables whose files have changed
+    content_hash -- fingerprint the files by their contents as well
+    dbfread -- read the DBF files with dbfread rather than the built-in DbfReader
+    pattern -- file name pattern of the projects to find in a directory
+    recursive -- also search the subdirectories of a directory
+    output -- database file (for a single project) or directory to write to, None for next to the project
+    log_level -- level for the log file, None to leave it as it is
+    stats_json -- also write the conversion statistics to a _stats.json file next to the database
+    merge -- add the projects to the one output database, each with its own project_id (see tmg2db)
+    stage -- build a new database in memory (or a temporary file), then copy it to the output (see tmg2sqlite),
+             not with incremental or merge
+    vacuum -- with stage, write the output with VACUUM INTO, so it is compacted
+    validate -- run the integrity rules over the database when it is written (see validate_database)
+    lineage -- add the _lineage table of every ancestor of every person (see build_lineage)
+    fts -- add full-text indexes of the names, places, memos and citations (see build_search)
+    views -- add the read view tables of the joins reports make most (see build_views)
+    format -- what to write, from OUTPUT_FORMATS: a SQLite database, a SQL or PostgreSQL script,
+              or a directory of Parquet files (see tmg2script)
+    progress -- callback(kind, value) for progress reports, see report()
+    cancel -- threading.Event that stops the conversion between chunks when set, see report()
+
+    Everything but progress and cancel is a plain value, so Options can be sent to
+    worker processes.
+    """
+
+    def __init__(self, **kwargs):
+        self.batch_size = BATCH_SIZE
+        self.defer_indexes = True
+        self.workers = 1
+        self.incremental = False
+        self.content_hash = False
+        self.dbfread = False
+        self.pattern = '*.PJC'
+        self.recursive = True
+        self.output = None
+        self.log_level = None
+        self.stats_json = False
+        self.merge = False
+        self.format = 'sqlite'
+        self.stage = False
+        self.vacuum = False
+        self.validate = False
+        self.lineage = False
+        self.fts = False
+        self.views = False
+        self.progress = None
+        self.cancel = None
+        for key, value in kwargs.items():
+            if not hasattr(self, key):
+                raise TypeError(f'Unknown option: {key}')
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return f'Options({", ".join(f"{key}={value!r}" for key, value in vars(self).items())})'
+
+
+class ConversionCancelled(Exception):
+    """The conversion was stopped by setting the cancel event of its Options"""
+
+
+def report(options, kind, value=None):
+    """Send a progress report to the options progress callback, if there is one
+
+    kind is one of:
+    'project' -- starting the project at path value
+    'rows' -- value is (table key, records copied, records in the file), after each chunk
+    'publish' -- value is (pages copied, pages in the database), copying a staged database
+    'rule' -- finished running the integrity rule named value
+    'error' -- value is the message of an error that stopped a step, such as validating
+    'table' -- finished copying the table with key value
+    'wait' -- still waiting on worker processes (value is None)
+
+    Reports are made between chunks, so if the options cancel event is set,
+    ConversionCancelled is raised here, to stop the conversion.
+    """
+    if options.progress is not None:
+        options.progress(kind, value)
+    if options.cancel is not None and options.cancel.is_set():
+        raise ConversionCancelled()
+
+
 # Common Links for info Table
 TABLE_NAME = 'Name'             # Key for the name of the table (not actually used)
 PRIMARY = 'Primary'             # Key to specify the Primary Key, Name of Column, or tuple of Columns
 FOREIGN = 'Foreign'             # Key for dictionary of Foreign Keys. Key of dict is Column. (Will make the index)
 INDEX = 'Index'                 # Key for set of Columns to Index
 UNIQUE = 'Unique'               # Key for set of Columns to Define a Unique index
-DATE = 'Date'                   # Marks fields with TMG Date (May want to create a translated version of the date)
+DATE = 'Date'                   # Marks fields with TMG Date, which get decoded columns (see DATE_COLUMNS)
 OPTIONAL = 'Optional'           # Key to make a table as optional
+SEARCH = 'Search'               # Key for the text columns given a full-text index (see build_search)
 
 PERSON = ('$', 'PER_NO')        # Link to a Person
 DSID = ('D', 'DSID')            # Link to a Dataset
@@ -108,6 +242,8 @@ NAME = ('N', 'RECNO')           # Link to a Name
 #   Key:Foreign     Foreign Key References, Defined but no enforced
 #       Key:        Column referencing other columns
 #       Value:      Tuple of Table Key, Column Name
+#                   or Table Key, Dictionary of Column Name: constant, with None for the
+#                   referenced column, for a key into a composite key (see reference)
 #   Key:Index       Index Definitions
 #       Key:        Name For index
 #       Value:      Column, or Tuple of Columns to build an index on
@@ -148,8 +284,9 @@ table_info = {
                 'DSID':     DSID,
                 'SPOULAST': PERSON,
             },
-            # Check FATHER is Primary Father
-            # CHECK MOTHER is Primary Mother
+            # FATHER is the Primary Father (rule person_father)
+            # MOTHER is the Primary Mother (rule person_mother)
+            # One Primary Name (rule person_primary_name)
             # SPOULAST is a spouse
             # PBIRTH is the Primary Birth Date
             # PDEATH is the Primary Death Date
@@ -248,8 +385,9 @@ table_info = {
             PRIMARY:    'UID',
             INDEX:      {
                 'VALUE',
-                'SDX',
+                'SDX',          # Soundex code of VALUE (see search)
             },
+            SEARCH:     ('VALUE',),
         },
 
     'PPT':      # Needs: D
@@ -300,10 +438,11 @@ table_info = {
                 'CHILD': PERSON,
                 'PARENT': PERSON,
                 'DSID': DSID,
-                'PTYPE': ETYPE,         # ETYPE -> ADMIN should be 2, 3, or 12 (non-primary only)
+                'PTYPE': ETYPE,         # ETYPE -> ADMIN should be 2, 3, or 12 (non-primary only) (rule relationship_type)
             },
-            # TEST_UNIQUE (CHILD, PARENT)
-            # TEST_PRIMARY CHILD matches FATHER/MOTHER (based on ETYPE->ADMIN being 2 or 3
+            # Unique (CHILD, PARENT, PTYPE) (rule relationship_unique)
+            # One PRIMARY of each ADMIN for a CHILD (rule relationship_primary),
+            # which matches FATHER/MOTHER (rules person_father, person_mother)
         },
 
     'ND':       # Needs none
@@ -312,8 +451,9 @@ table_info = {
             PRIMARY:    'UID',
             INDEX:  {
                 'VALUE',
-                'SDX',
+                'SDX',          # Soundex code of VALUE (see search)
             },
+            SEARCH:     ('VALUE',),
         },
 
     'N':        # Needs D, $, ST, T, ND
@@ -322,6 +462,7 @@ table_info = {
             PRIMARY:    'RECNO',
             INDEX:      'SRTDATE',
             DATE:       ('NDATE', 'SRTDATE'),
+            SEARCH:     ('SRNAMEDISP', 'SRNAMESORT', 'GVNAMESORT', 'SENTENCE', 'NNOTE'),
             FOREIGN: {
                 'NPER':     PERSON,
                 'ALTYPE':   ETYPE,
@@ -330,7 +471,7 @@ table_info = {
                 'SURID':    ('ND', 'UID'),
                 'GIVID':    ('ND', 'UID'),
             },
-            # CHECK Unique NPER for PRIMARY names, and matches Person Primary Name
+            # Unique NPER for PRIMARY names (rule person_primary_name)
         },
 
     'NPV':      # Needs N, ND
@@ -350,6 +491,7 @@ table_info = {
             TABLE_NAME: 'Event',
             PRIMARY:    'RECNO',
             DATE:       ('EDATE', 'SRTDATE'),
+            SEARCH:     ('EFOOT', 'SENTENCE'),
             FOREIGN:    {
                 'ETYPE':    ETYPE,
                 'DSID':     DSID,
@@ -368,7 +510,9 @@ table_info = {
                 'DSID': DSID,
                 'NAMEREC': NAME,
             },
-            # Check PRIMARY, only PER1 or PER2, only one of that type, check PBIRTH, PDEATH
+            # PRIMARY only for PER1 or PER2 (rule witness_primary_principal),
+            # only one of the Birth and of the Death group (rule witness_primary_unique), check PBIRTH, PDEATH
+            # PER1 and PER2 are witnesses (rule event_principals)
         },
 
     # Source
@@ -380,8 +524,8 @@ table_info = {
             INDEX:      'NAME',
             FOREIGN:    {
                 'DSID': DSID,
-                'TRANS_TO': ( 'A', {'RULESET': '1', 'SOURTYPE': None}),
-                'SAMEAS':   ( 'A', {'RULESET': '1', 'SOURTYPE': None}),
+                'TRANS_TO': ( 'A', {'RULESET': 1, 'SOURTYPE': None}),
+                'SAMEAS':   ( 'A', {'RULESET': 1, 'SOURTYPE': None}),
             },
             # RULESET: 1, 2. 3
             # ONLY ONE PRIMARY (per DATASET?)
@@ -416,8 +560,8 @@ table_info = {
                 'EDITORID':     PERSON,
                 'SPERNO2':      PERSON,
                 'DSID':         DSID,
-                'TYPE':         ('A', {'RULESET': 1, 'SOURCETYPE': None }),
-                'CUSTTYPE':     ('A', {'RULESET': 3, 'SOURCETYPE': None }),
+                'TYPE':         ('A', {'RULESET': 1, 'SOURTYPE': None }),
+                'CUSTTYPE':     ('A', {'RULESET': 3, 'SOURTYPE': None }),
             }
         },
 
@@ -445,13 +589,14 @@ table_info = {
                 'RNUMBER': ('R', 'RECNO'),
                 'DSID': DSID,
             },
-            # Check PRIMARY is unique
+            # PRIMARY is unique (rule repository_primary)
         },
 
     'S':
         {
             TABLE_NAME: 'Citation',
             PRIMARY:    'RECNO',
+            SEARCH:     ('SUBSOURCE', 'CITMEMO', 'CITREF'),
             FOREIGN:    {
                 'MAJSOURCE': ('M', 'MAJNUM'),
                 'DSID': DSID,
@@ -515,6 +660,419 @@ table_info = {
 
 table_map = {}
 
+MISSING_REFS = '_missing_refs'    # Table listing Foreign Keys that don't reference a record
+REJECTED = '_rejected_rows'       # Table of the records that couldn't be added (see RejectedRows)
+VIOLATIONS = '_violations'        # Table of the records that break an integrity rule (see validate_database)
+LINEAGE = '_lineage'              # Table of every ancestor of every person (see build_lineage)
+SEARCH_PREFIX = '_search_'        # Start of the names of the full-text indexes, followed by the table_info key
+VIEW_PREFIX = '_view_'            # Start of the names of the read view tables, followed by the view name (see READ_VIEWS)
+FINGERPRINTS = '_fingerprints'    # Table recording the state of the files each table was copied from
+STATS = '_conversion_stats'       # Table of the times of each phase of each conversion (see ConversionStats)
+OUTPUT_FORMATS = {'sqlite': '.sqlite', 'sql': '.sql', 'postgres': '.pgsql', 'parquet': '.parquet'}  # Output format: file suffix
+PROJECTS = '_projects'            # Table of the projects loaded into a merged database (see register_project)
+MERGED_PREFIX = 'tmg_'            # Start of the table names in a merged database, followed by the table_info key
+
+
+# The files of a project
+#
+# A project is read from its directory, or from a TMG .SQZ backup, which is a
+# zip archive. Files in an archive are read straight from it, so the functions
+# below take the location of a file: a Path, or an ArchiveMember.
+
+# Archive members up to this size are read into memory, larger ones are spilled to a temporary file
+SPILL_SIZE = 64 * 1024 * 1024
+
+
+class ArchiveMember(namedtuple('ArchiveMember', 'archive name')):
+    """A file in a .SQZ archive: the Path of the archive, and the name of the member"""
+
+    @property
+    def stem(self):
+        return PurePosixPath(self.name).stem
+
+    def __str__(self):
+        return f'{self.archive}[{self.name}]'
+
+
+def is_archive(path):
+    """Check if a project path is a .SQZ archive rather than a .PJC file"""
+    return Path(path).suffix.upper() == '.SQZ'
+
+
+@contextmanager
+def open_stream(location):
+    """Open a file, or stream an archive member, for reading as binary"""
+    if isinstance(location, ArchiveMember):
+        with zipfile.ZipFile(location.archive) as archive, archive.open(location.name) as file:
+            yield file
+    else:
+        with open(location, 'rb') as file:
+            yield file
+
+
+@contextmanager
+def open_buffer(location):
+    """Map the contents of a file, or an archive member, as a read-only buffer
+
+    An archive member is read into memory, or if larger than SPILL_SIZE,
+    spilled to a temporary file that is then mapped.
+    """
+    if isinstance(location, ArchiveMember):
+        with zipfile.ZipFile(location.archive) as archive:
+            info = archive.getinfo(location.name)
+            if info.file_size <= SPILL_SIZE:
+                yield archive.read(info)
+                return
+            with tempfile.TemporaryFile() as spill:
+                with archive.open(info) as file:
+                    shutil.copyfileobj(file, spill, 1 << 20)
+                spill.flush()
+                with mmap.mmap(spill.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    yield data
+    elif os.path.getsize(location) == 0:
+        yield b''       # An empty file can't be mapped
+    else:
+        with open(location, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            yield data
+
+
+def file_stat(location):
+    """Return (size, modification time in ns) of a file or archive member"""
+    if isinstance(location, ArchiveMember):
+        with zipfile.ZipFile(location.archive) as archive:
+            info = archive.getinfo(location.name)
+        return info.file_size, int(time.mktime(info.date_time + (0, 0, -1))) * 1000000000
+    stat = os.stat(location)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def project_files(projname):
+    """Find the files of a TMG project, in its directory or in its .SQZ archive
+
+    Returns (pjc, files), the location of the .pjc file, and a dictionary of
+    the upper case name of each file of the project to its location.
+    """
+    if not is_archive(projname):
+        path = projname.parent
+        return projname, {fname.upper(): path.joinpath(fname) for fname in os.listdir(path)}
+    with zipfile.ZipFile(projname) as archive:
+        names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    pjcs = [name for name in names if name.upper().endswith('.PJC')]
+    if not pjcs:
+        raise FileNotFoundError(f'No .PJC file in {projname}')
+    folder = PurePosixPath(pjcs[0]).parent
+    files = {PurePosixPath(name).name.upper(): ArchiveMember(projname, name)
+             for name in names if PurePosixPath(name).parent == folder}
+    return ArchiveMember(projname, pjcs[0]), files
+
+
+# The dBase/FoxPro reader
+#
+# DbfReader reads the Visual FoxPro tables TMG uses, memory mapping the .dbf
+# and unpacking each record with a struct layout built from the header.
+# Records come out as tuples in field order, with the same values dbfread gives.
+
+# Language driver byte of the header to the character encoding
+CODE_PAGES = {
+    0x00: 'ascii',
+    0x01: 'cp437',
+    0x02: 'cp850',
+    0x03: 'cp1252',
+    0x04: 'mac_roman',
+    0x57: 'cp1252',
+    0x58: 'cp1252',
+    0x59: 'cp1252',
+    0x64: 'cp852',
+    0x65: 'cp866',
+    0x66: 'cp865',
+    0x67: 'cp861',
+    0x7d: 'cp1255',
+    0x7e: 'cp1256',
+    0xc8: 'cp1250',
+    0xc9: 'cp1251',
+    0xca: 'cp1254',
+    0xcb: 'cp1253',
+}
+
+FOXPRO_VERSIONS = {0x30, 0x31, 0x32}     # Visual FoxPro tables, with .fpt memo files
+
+DbfHeader = namedtuple('DbfHeader', 'dbversion year month day numrecords headerlen recordlen language_driver')
+DbfField = namedtuple('DbfField', 'name type length decimal_count')
+
+
+class DbfError(ValueError):
+    """Something in a DBF file the built-in reader doesn't handle"""
+
+
+def parse_number(data):
+    """Parse an N or F field: int, float or None if empty"""
+    data = data.strip().strip(b'*')
+    try:
+        return int(data)
+    except ValueError:
+        if not data.strip():
+            return None
+        return float(data.replace(b',', b'.'))
+
+
+def parse_date(data):
+    """Parse a D field: datetime.date or None if empty"""
+    try:
+        return datetime.date(int(data[:4]), int(data[4:6]), int(data[6:8]))
+    except ValueError:
+        if data.strip(b' 0') == b'':
+            return None
+        raise ValueError(f'invalid date {data!r}')
+
+
+def parse_datetime(data):
+    """Parse a T field, days from the Julian epoch and milliseconds: datetime.datetime or None"""
+    day, msec = struct.unpack('<LL', data)
+    if not data.strip() or not day:
+        return None
+    return datetime.datetime.fromordinal(day - 1721425) + datetime.timedelta(seconds=msec / 1000)
+
+
+LOGICALS = {b'T': True, b't': True, b'Y': True, b'y': True,
+            b'F': False, b'f': False, b'N': False, b'n': False,
+            b'?': None, b' ': None}
+
+
+def parse_logical(data):
+    """Parse an L field: True, False or None"""
+    try:
+        return LOGICALS[data]
+    except KeyError:
+        raise ValueError(f'Illegal value for logical field: {data!r}') from None
+
+
+def text_decoder(encoding):
+    """Make the function that decodes the text of a table
+
+    Plain ASCII text, which is most of it, takes the fast path of the ascii
+    codec, so only the rest goes through the code page's codec.
+    """
+    def decode(data):
+        if data.isascii():
+            return data.decode('ascii')
+        return data.decode(encoding, errors='replace')
+    return decode
+
+
+class FptMemos:
+    """The Visual FoxPro .fpt memo file of a table, from its mapped contents (see open_buffer)
+
+    The block size is read once from the header, and a memo is found directly
+    from its block pointer. A text memo is decoded straight from the map, and
+    other memos are returned as bytes without decoding.
+    """
+
+    def __init__(self, filename, data, encoding):
+        self.filename = filename
+        self.data = data
+        self.decode = text_decoder(encoding)
+        self.blocksize = struct.unpack_from('>H', self.data, 6)[0]
+
+    def get(self, index):
+        """Return the memo at block index: text, bytes if not a text memo, or None"""
+        if index <= 0:
+            return None
+        start = index * self.blocksize + 8
+        memo_type, length = struct.unpack_from('>LL', self.data, start - 8)
+        if start + length > len(self.data):
+            raise IOError(f'EOF reached while reading memo {index} of {self.filename}')
+        if memo_type == 1:
+            return self.decode(self.data[start:start + length])
+        return self.data[start:start + length]
+
+
+def find_memo_file(filename):
+    """Find the .fpt file of a table, whatever the case of its name"""
+    if isinstance(filename, ArchiveMember):
+        name = str(PurePosixPath(filename.name).with_suffix('.fpt')).upper()
+        with zipfile.ZipFile(filename.archive) as archive:
+            for member in archive.namelist():
+                if member.upper() == name:
+                    return ArchiveMember(filename.archive, member)
+        return None
+    path = Path(filename)
+    for name in (path.stem + '.fpt', path.stem + '.FPT'):
+        if (path.parent / name).exists():
+            return str(path.parent / name)
+    for name in os.listdir(path.parent):
+        if name.lower() == path.stem.lower() + '.fpt':
+            return str(path.parent / name)
+    return None
+
+
+class DbfReader:
+    """Read the records of a Visual FoxPro DBF file as tuples
+
+    Has the attributes of a dbfread DBF that the conversion uses: name,
+    filename, memofilename, header, dbversion, date, encoding, fields and
+    field_names. Raises DbfError for a file it doesn't handle, which
+    dbfread can be used for instead (see open_dbf).
+
+    filename can also be an ArchiveMember, to read the file from a .SQZ.
+    """
+
+    def __init__(self, filename):
+        if not isinstance(filename, ArchiveMember):
+            filename = Path(filename)
+        self.location = filename
+        self.filename = str(filename)
+        self.name = filename.stem.lower()
+        with open_stream(filename) as file:
+            data = file.read(32)
+            if len(data) < 32:
+                raise DbfError(f'{filename} is too short for a DBF header')
+            values = struct.unpack('<BBBBLHH17xB2x', data)
+            self.header = DbfHeader(*values)
+            self.encoding = CODE_PAGES.get(self.header.language_driver)
+            if self.encoding is None:
+                raise DbfError(f'Unknown language driver {self.header.language_driver:#04x}')
+            if self.header.dbversion not in FOXPRO_VERSIONS:
+                raise DbfError(f'DBF version {self.header.dbversion:#04x} is not Visual FoxPro')
+            self.fields = []
+            while True:
+                data = file.read(32)
+                if data[:1] in (b'\r', b'\n', b''):
+                    break
+                name, ftype, length, decimal_count = struct.unpack('<11sc4xBB14x', data)
+                ftype = ftype.decode('ascii')
+                if ftype == 'C':
+                    # The length of a long character field continues in decimal_count
+                    length |= decimal_count << 8
+                    decimal_count = 0
+                name = name.split(b'\0')[0].decode(self.encoding, errors='replace')
+                self.fields.append(DbfField(name, ftype, length, decimal_count))
+        self.field_names = [field.name for field in self.fields]
+        try:
+            year = self.header.year + (2000 if self.header.year < 80 else 1900)
+            self.date = datetime.date(year, self.header.month, self.header.day)
+        except ValueError:
+            self.date = None
+        self.memofilename = None
+        if any(field.type in 'MGP' for field in self.fields):
+            self.memofilename = find_memo_file(filename)
+            if self.memofilename is None:
+                raise DbfError(f'Missing memo file for {filename}')
+        self.layout, self.parsers = self._compile()
+
+    @property
+    def dbversion(self):
+        return f'Visual FoxPro ({self.header.dbversion:#04x})'
+
+    def _compile(self):
+        """Build the struct layout of a record and the parsers of the fields that need one
+
+        Returns (layout, parsers) where parsers is a list of (field number, parse function),
+        which take the raw value and memo file.
+        """
+        layout = '<c'       # The deleted flag
+        parsers = []
+        decode = text_decoder(self.encoding)
+
+        def text(data, _memos):
+            return decode(data.rstrip(b'\0 '))
+
+        def memo(index, memos):
+            return memos.get(index)
+
+        for num, field in enumerate(self.fields):
+            ftype = field.type
+            if ftype in 'I+' and field.length == 4:
+                layout += 'i'
+            elif ftype in 'MGP' and field.length == 4:
+                layout += 'I'
+                parsers.append((num, memo))
+            elif ftype == 'B' and field.length == 8:
+                layout += 'd'
+            elif ftype == 'O' and field.length == 8:
+                layout += 'd'
+            elif ftype == 'Y' and field.length == 8:
+                layout += 'q'
+                parsers.append((num, lambda value, _memos: Decimal(value) / 10000))
+            else:
+                layout += f'{field.length}s'
+                if ftype == 'C':
+                    parsers.append((num, text))
+                elif ftype in 'NF':
+                    parsers.append((num, lambda data, _memos: parse_number(data)))
+                elif ftype == 'L' and field.length == 1:
+                    parsers.append((num, lambda data, _memos: parse_logical(data)))
+                elif ftype == 'D':
+                    parsers.append((num, lambda data, _memos: parse_date(data)))
+                elif ftype in 'T@' and field.length == 8:
+                    parsers.append((num, lambda data, _memos: parse_datetime(data)))
+                elif ftype != '0':      # _NullFlags are kept as bytes, like dbfread
+                    raise DbfError(f'Field {field.name} of type {ftype} and length {field.length}')
+        layout = struct.Struct(layout)
+        if layout.size > self.header.recordlen:
+            raise DbfError(f'Fields are longer than the record length {self.header.recordlen}')
+        if layout.size < self.header.recordlen:
+            layout = struct.Struct(layout.format + f'{self.header.recordlen - layout.size}x')
+        return layout, parsers
+
+    def _iter_records(self, record_type=b' '):
+        """Yield the records with the deleted flag record_type as tuples"""
+        with ExitStack() as stack:
+            data = stack.enter_context(open_buffer(self.location))
+            count = max(len(data) - self.header.headerlen, 0) // self.layout.size
+            if count == 0:
+                return
+            memos = None
+            if self.memofilename is not None:
+                memos = FptMemos(self.memofilename, stack.enter_context(open_buffer(self.memofilename)),
+                                 self.encoding)
+            parsers = self.parsers
+            view = memoryview(data)[self.header.headerlen:self.header.headerlen + count * self.layout.size]
+            try:
+                for values in self.layout.iter_unpack(view):
+                    flag = values[0]
+                    if flag != record_type:
+                        if flag == b'\x1a':
+                            break       # End of file marker
+                        continue
+                    rec = list(values[1:])
+                    for num, parse in parsers:
+                        rec[num] = parse(rec[num], memos)
+                    yield tuple(rec)
+            finally:
+                view.release()
+
+    def __iter__(self):
+        return self._iter_records()
+
+    def __len__(self):
+        return sum(1 for _rec in self._iter_records())
+
+    @property
+    def deleted(self):
+        """The deleted records"""
+        return list(self._iter_records(b'*'))
+
+
+def record_tuple(items):
+    """dbfread record factory, making the same tuples as DbfReader"""
+    return tuple(value for _name, value in items)
+
+
+def open_dbf(filename, use_dbfread=False):
+    """Open a DBF file to read its records as tuples in field order
+
+    Uses DbfReader, unless use_dbfread is set or it can't read the file,
+    when dbfread is used instead. dbfread can't read from a .SQZ archive.
+    """
+    if not use_dbfread or DBF is None or isinstance(filename, ArchiveMember):
+        try:
+            return DbfReader(filename)
+        except DbfError as err:
+            if DBF is None or isinstance(filename, ArchiveMember):
+                raise
+            LOG.info(f'Reading {filename} with dbfread: {err}')
+    return DBF(filename, char_decode_errors='replace', recfactory=record_tuple)
+
 
 def do_sql(cursor, statement, parms=None):
     """Execute an SQL command"""
@@ -528,6 +1086,183 @@ def do_sql(cursor, statement, parms=None):
         cursor.execute(statement, parms)
 
 
+def set_pragmas(conn, pragmas):
+    """Apply a set of PRAGMA settings to the database connection"""
+    conn.commit()   # journal_mode can't be changed inside a transaction
+    cursor = conn.cursor()
+    for pragma, value in pragmas.items():
+        do_sql(cursor, f'PRAGMA {pragma} = {value}')
+    # Leaving EXCLUSIVE locking mode only drops the lock on the next access
+    do_sql(cursor, 'SELECT count(*) FROM sqlite_master')
+
+
+def insert_row(cursor, sql, rec, field_names=None, reject=None):
+    """Insert a single record, reporting any error (by field name, if field_names are given)
+
+    With reject, a record in error is passed to reject(rec, err, 0) rather than printed.
+    """
+    try:
+        cursor.execute(sql, rec)
+    except sqlite3.Error as err:
+        if reject is not None:
+            reject(rec, err, 0)
+            return
+        if field_names is not None:
+            rec = dict(zip(field_names, rec))
+        print('')
+        print("Error: ", err, "Rec= ", rec, "\n", sql)
+        LOG.error(f"{err}: {rec}")
+
+
+def insert_rows(cursor, sql, rows, field_names=None, reject=None):
+    """Insert a chunk of records with executemany
+
+    If the chunk fails, it is rolled back and reinserted a record at a time,
+    so the records in error are reported just like a normal load. With reject,
+    they are passed to reject(rec, err, num), num being their position in rows.
+    """
+    if not cursor.connection.in_transaction:
+        do_sql(cursor, 'BEGIN')
+    do_sql(cursor, 'SAVEPOINT bulk_chunk')
+    try:
+        cursor.executemany(sql, rows)
+    except sqlite3.Error as err:
+        LOG.info(f'Chunk failed ({err}), retrying a record at a time')
+        do_sql(cursor, 'ROLLBACK TO bulk_chunk')
+        for num, rec in enumerate(rows):
+            insert_row(cursor, sql, rec, field_names, None if reject is None else
+                       lambda rec, err, _num, num=num: reject(rec, err, num))
+    do_sql(cursor, 'RELEASE bulk_chunk')
+
+
+def build_indexes(cursor, tablename, indexes):
+    """Create the indexes for a table, logging how long each one takes
+
+    indexes is a list of (index name, tuple of columns, unique). Only the read
+    views (see build_views) have unique indexes; the keys of a converted table
+    are constraints of the table (see table_ddl).
+    """
+    for index_name, columns, unique in indexes:
+        do_sql(cursor, f'DROP INDEX IF EXISTS "{index_name}"')
+        cols = ', '.join(f'"{col}"' for col in columns)
+        sql = f'CREATE {"UNIQUE " if unique else ""}INDEX "{index_name}" ON "{tablename}"({cols})'
+        start = time.perf_counter()
+        do_sql(cursor, sql)
+        LOG.info(f'Index {index_name}: {time.perf_counter() - start:.3f} sec')
+
+
+class ErrorCount(logging.Handler):
+    """Logging Handler that counts the errors logged"""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class ConversionStats:
+    """Times, record counts and bytes read for each table and phase of a conversion
+
+    The phases of a table are open (opening the file and creating the table),
+    decode (reading and converting the records), insert, index and verify
+    (the Foreign Key checks). Times add up over the calls for a phase.
+    Steps after the load, like lineage, are phases of no table, except for
+    the full-text index of a table, its search phase, and the view phase of
+    each read view table. The peak memory use is sampled at the end of each
+    phase, so a row gives the peak reached by the time its phase was done.
+    """
+
+    def __init__(self, project):
+        self.project = str(project)
+        self.started = datetime.datetime.now().isoformat(timespec='seconds')
+        self.start = time.perf_counter()
+        self.phases = {}    # (table, phase): [seconds, rows, bytes read, peak RSS in KiB]
+
+    def add(self, table, phase, seconds, rows=None, bytes_read=None):
+        """Add the time, and any records or bytes, for a phase of a table"""
+        entry = self.phases.setdefault((table, phase), [0.0, None, None, None])
+        entry[0] += seconds
+        if rows is not None:
+            entry[1] = (entry[1] or 0) + rows
+        if bytes_read is not None:
+            entry[2] = (entry[2] or 0) + bytes_read
+        entry[3] = self.peak_rss()
+
+    @contextmanager
+    def timer(self, table, phase, rows=None):
+        """Time the block as a phase of a table"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(table, phase, time.perf_counter() - start, rows)
+
+    @staticmethod
+    def peak_rss():
+        """Peak resident memory in KiB of this process or a worker, None if unknown"""
+        if resource is None:
+            return None
+        peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                   resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+        return peak // 1024 if sys.platform == 'darwin' else peak     # macOS gives bytes
+
+    def records(self):
+        """Return the statistics as a list of dictionaries, ending with the total for the run"""
+        records = []
+        for (table, phase), (seconds, rows, bytes_read, peak_rss_kb) in self.phases.items():
+            records.append({
+                'started': self.started,
+                'project': self.project,
+                'tbl': table,
+                'phase': phase,
+                'seconds': round(seconds, 6),
+                'rows': rows,
+                'rows_per_sec': round(rows / seconds, 1) if rows and seconds > 0 else None,
+                'bytes_read': bytes_read,
+                'peak_rss_kb': peak_rss_kb,
+                'version': Version,
+            })
+        seconds = time.perf_counter() - self.start
+        rows = sum(rows or 0 for (_table, phase), (_s, rows, _b, _p) in self.phases.items() if phase == 'decode')
+        records.append({
+            'started': self.started,
+            'project': self.project,
+            'tbl': None,
+            'phase': 'total',
+            'seconds': round(seconds, 6),
+            'rows': rows,
+            'rows_per_sec': round(rows / seconds, 1) if seconds > 0 else None,
+            'bytes_read': sum(b or 0 for _s, _r, b, _p in self.phases.values()),
+            'peak_rss_kb': self.peak_rss(),
+            'version': Version,
+        })
+        return records
+
+    def save(self, cursor):
+        """Add the statistics of this run to the _conversion_stats table"""
+        do_sql(cursor, f'''CREATE TABLE IF NOT EXISTS "{STATS}" (
+    "started" TEXT,
+    "project" TEXT,
+    "tbl" TEXT,
+    "phase" TEXT,
+    "seconds" REAL,
+    "rows" INTEGER,
+    "rows_per_sec" REAL,
+    "bytes_read" INTEGER,
+    "peak_rss_kb" INTEGER,
+    "version" TEXT
+)''')
+        cursor.executemany(f'''INSERT INTO "{STATS}" VALUES (:started, :project, :tbl, :phase,
+    :seconds, :rows, :rows_per_sec, :bytes_read, :peak_rss_kb, :version)''', self.records())
+
+    def write_json(self, filename):
+        """Write the statistics of this run to a JSON file"""
+        with open(filename, 'w') as file:
+            json.dump(self.records(), file, indent=1)
+
+
 def show(*words):
     """Print a line of test from parameters"""
     LOG.debug('  ' + ' '.join(str(word) for word in words))
@@ -552,340 +1287,3198 @@ def show_table(dbf):
         show_field(field)
 
 
-def copy_dbf(filename, tbl: str, conn, info=None):
-    """Copy a DBF file into the Database"""
-    if info is None:
-        info = {}
-    print(filename, '', end='')
-    LOG.info(f"\n{filename}")
-    LOG.debug(pformat(info))
-    dbf = DBF(filename, char_decode_errors='replace')
-    cursor = conn.cursor()
-    tablename = dbf.name    # Name the tables in the SQL after the name of the DBF
-    table_map[tbl] = tablename
+def make_missing_refs(cursor, merged=False):
+    """Create the table used to record broken Foreign Key references
 
-    if log_level.get() == logging.DEBUG:
-        show_table(dbf)
-    do_sql(cursor, 'drop table if exists %s' % tablename)
-    field_types = {}
-    for field in dbf.fields:
-        field_types[field.name] = typemap.get(field.type, 'TEXT')
-    #
-    # Create the table
-    #
+    In a merged database, the table also has the project_id of each reference.
+    """
+    project = ',\n    "project_id" INTEGER' if merged else ''
+    sql = f'''CREATE TABLE IF NOT EXISTS "{MISSING_REFS}" (
+    "table_name" TEXT,
+    "column_name" TEXT,
+    "ref_table" TEXT,
+    "ref_column" TEXT,
+    "value",
+    "row_id" INTEGER{project}
+)'''
+    do_sql(cursor, sql)
 
-    table_prop = ""
 
-    pkey = info.get(PRIMARY, None)
-    if isinstance(pkey, str):
-        field_types[pkey] += ' PRIMARY KEY'    # Add PRIMARY KEY to the Primary Key
-    elif isinstance(pkey, tuple):
-        table_prop += ",\n    PRIMARY KEY (" + (', '.join(pkey)) + ")"
-    elif pkey is not None:
-        LOG.error(f'TODO Primary: {pkey}')
+def make_rejected_rows(cursor, merged=False):
+    """Create the table used to record the records that couldn't be added (see RejectedRows)
 
-    unique = info.get(UNIQUE, None)
-    if isinstance(unique, str):
-        # Single Unique field in the table
-        field_types[unique] += " UNIQUE"
-    elif isinstance(unique, set):
-        # A Tuple of Unique Fields in the table
-        for col in unique:
-            if isinstance(col, str):
-                field_types[col] += " UNIQUE"
-            elif isinstance(col, tuple):
-                table_prop += ',\n   UNIQUE(' + (', '.join(table_prop)) + ')'
-            else:
-                LOG.error(f'TODO Unique {unique} : {col}')
-    elif unique is not None:
-        LOG.error(f'TODO Unique: {unique}')
+    In a merged database, the table also has the project_id of each record.
+    """
+    project = ',\n    "project_id" INTEGER' if merged else ''
+    sql = f'''CREATE TABLE IF NOT EXISTS "{REJECTED}" (
+    "table_name" TEXT,
+    "recno" INTEGER,
+    "error_class" TEXT,
+    "error" TEXT,
+    "record" TEXT{project}
+)'''
+    do_sql(cursor, sql)
 
-    fkeys = info.get(FOREIGN, None)
-    if fkeys is not None:
-        index = info.get(INDEX, None)
-        # Make index entry if needed
-        if index is None:
-            info[INDEX] = set()
-        elif isinstance(index, str):
-            # Convert single entry index to a set
-            info[INDEX] = {index}
 
-        for key, value in fkeys.items():
-            if isinstance(key, str):
-                # Single Key Foreign Constraint
-                if isinstance(value[1], str):
-                    # Single to Dictionary with constant Foreign Keys do not translate
-                    info[INDEX].add(key)
-                    field_types[key] += f' REFERENCES "{table_map[value[0]]}"("{value[1]}")'
-            else:
-                # When we handle multi-key foreign keys, need to also change to Copy loop
-                LOG.error(f'TODO Foreign {key}: {value}')
+class RejectedRows:
+    """The records that couldn't be added to their tables, kept for the _rejected_rows table
 
-    col_defs = ',\n    '.join(['"%s" %s' % (f, field_types[f])
-                               for f in dbf.field_names])
+    Rather than each record being printed and logged, they are saved in bulk
+    to the table, with the number of the record in the DBF file (counting
+    the records that aren't deleted, as they are read), the class and message
+    of the error, and the record's values as a JSON object. The console and
+    log only get the number of records of each table rejected for each error.
+    """
 
-    sql = f'CREATE TABLE "{tablename}" (\n    {col_defs}{table_prop}\n)'
+    def __init__(self):
+        self.rows = []
+        self.counts = {}
 
-    do_sql(cursor, sql)
+    def add(self, tablename, recno, err, rec, field_names=None, project_id=None):
+        """Add a rejected record, by field name if field_names are given"""
+        if field_names is not None:
+            rec = dict(zip(field_names, rec))
+        LOG.debug(f'Rejected {tablename} {recno}: {err}: {rec}')
+        error_class = type(err).__name__
+        self.rows.append((tablename, recno, error_class, str(err), json.dumps(rec, default=str), project_id))
+        key = (tablename, error_class, str(err))
+        self.counts[key] = self.counts.get(key, 0) + 1
 
-    # Add any requested Indexes
-    index = info.get(INDEX, None)
-    if index is not None:
-        if isinstance(index, str):
-            # Single index specified
-            index_name = tablename + '_' + index
-            sql = f'DROP INDEX IF EXIST "{index_name}"'
-            do_sql(cursor, sql)
-            sql = f'CREATE INDEX "{index_name}" ON "{tablename}"("{index}")'
-            do_sql(cursor, sql)
-        elif isinstance(index, set):
-            # tuple of indexes specific
-            for col in index:
-                if isinstance(col, str):
-                    # Single index specified
-                    index_name = tablename + '_' + col
-                    sql = f'DROP INDEX IF EXISTS "{index_name}"'
-                    do_sql(cursor, sql)
-                    sql = f'CREATE INDEX "{index_name}" ON "{tablename}"("{col}")'
-                    do_sql(cursor, sql)
-                elif isinstance(col, tuple):
-                    index_name = tablename + '_' + ('_'.join(col))
-                    sql = f'DROP INDEX IF EXISTS "{index_name}"'
-                    do_sql(cursor, sql)
-                    sql = f'CREATE INDEX "{index_name}" ON "{tablename}"(' + (', '.join(col)) + ')'
-                    do_sql(cursor, sql)
-                else:
-                    LOG.error(f'TODO Index: {index} : {col}')
+    def save(self, cursor):
+        """Save the rejected records to the _rejected_rows table, and report how many there were"""
+        if not self.rows:
+            return
+        merged = self.rows[0][-1] is not None
+        make_rejected_rows(cursor, merged)
+        columns = '"table_name", "recno", "error_class", "error", "record"'
+        if merged:
+            cursor.executemany(f'INSERT INTO "{REJECTED}" ({columns}, "project_id") VALUES (?, ?, ?, ?, ?, ?)',
+                               self.rows)
         else:
-            LOG.error(f'TODO Index: {index}')
-
-    LOG.debug(pformat(info))
+            cursor.executemany(f'INSERT INTO "{REJECTED}" ({columns}) VALUES (?, ?, ?, ?, ?)',
+                               (row[:-1] for row in self.rows))
+        for (tablename, error_class, error), count in self.counts.items():
+            print(f'Rejected {count} records of {tablename}: {error_class}: {error}')
+            LOG.error(f'Rejected {count} records of {tablename}: {error_class}: {error}')
+        self.rows = []
+        self.counts = {}
 
-    # Create data rows
-    refs = ', '.join([':' + f for f in dbf.field_names])
-    sql = 'insert into "%s" values (%s)' % (tablename, refs)
-    LOG.debug(sql)
-    recno = 0
-    progress_interval = 1000
-    for rec in dbf:
-        # Convert Foreign Keys 0 to NULL
-        if fkeys is not None:
-            # LOG.info(pformat(rec))
-            for col, reference in fkeys.items():
-                if isinstance(col, str):
-                    if rec[col] == 0:
-                        rec[col] = None
-        flag = True
-        for col in rec.keys():
-            if flag and isinstance(rec[col], str):
-                if ERROR_CHAR in rec[col]:
-                    LOG.warning(f"Character Error: {pformat(rec)}")
-                    flag = False    # Print only once per record, even if multiple fields
-            if isinstance(rec[col], datetime.date):
-                rec[col] = rec[col].strftime('%Y-%m-%d')
-            elif isinstance(rec[col], datetime.datetime):
-                rec[col] = rec[col].strftime('%Y-%m-%d %H:%M:%S')
 
+def reference(value):
+    """Split a Foreign Key reference from table_info into (table key, referenced column, conditions)
 
-        LOG.debug(rec)
-        # TODO Should add validation of Foreign Keys (and maybe add a more advanced validata operation.
-        try:
-            cursor.execute(sql, rec)
-        except sqlite3.Error as err:
-            print('')
-            print("Error: ", err, "Rec= ", rec, "\n", sql)
-            LOG.error(f"{err}: {rec}")
+    A reference is (table key, column), or to part of a composite key,
+    (table key, {column: constant, ...}), where the column that is None is
+    the one the Foreign Key matches, and the others are fixed to their
+    constants, like M.TYPE being the SOURTYPE of an A record of RULESET 1.
+    conditions is a tuple of (column, constant), empty for a plain reference.
+    """
+    tbl, ref = value
+    if isinstance(ref, str):
+        return tbl, ref, ()
+    matched = [col for col, constant in ref.items() if constant is None]
+    if len(matched) != 1:
+        raise ValueError(f'A reference needs one column of None: {value}')
+    return tbl, matched[0], tuple((col, constant) for col, constant in ref.items() if constant is not None)
 
-        recno += 1
-        if (recno % progress_interval) == 0:
-            num = recno // progress_interval
-            if num % 10 == 0:
-                print('', num, '', end='')
-            else:
-                print(num % 10, end='')
-    conn.commit()
-    LOG.info(f'Records: {recno}')
-    print('')  # Add a return
 
-    if fkeys is not None:
-        # Check if any references are broken
-        todo = False
-        ckey = {}
-        sql = f'SELECT * from {tablename}'
-        res = cursor.execute(sql)
-        for row in res:
-            for key, value in fkeys.items():
-                if row[key] is not None:
-                    ref_table = table_map[value[0]]
-                    ref_col = value[1]
-                    if isinstance(ref_col, str):
-                        parms = {'Value': row[key]}
-                        sql = f'SELECT "{ref_col}" FROM "{ref_table}" WHERE "{ref_col}" == :Value'
-                        res = cursor.execute(sql, parms)
-                        res = res.fetchall()
-                        if len(res) < 1:
-                            print(f'Missing Reference: {key} in \n{pformat(dict(row))}')
-                            LOG.error(f'Missing Reference: {key} in \n{pformat(dict(row))}\n{sql}')
-                    else:
-                        todo = True
-                        ckey[key] = ( ref_table, ref_col)
-        if todo:
-            LOG.info(f'TODO Complex Foreign Keys: \n{pformat(ckey)}')
+def check_references(cursor, tablename, fkeys, columns=None, project_id=None):
+    """Check the Foreign Keys of a table for broken references
 
-def tmg2db(projname, conn):
-    """ Convert a TMG Project to a SQL Database
+    Each Foreign Key is checked with a single anti-join against the referenced
+    table, and the broken references are saved in the _missing_refs table.
+    A reference to part of a composite key (see reference) has its constants
+    in the join, so it uses the referenced table's key index the same way.
+    If columns is given, only the Foreign Keys of those columns are checked.
+    In a merged database, only the records of project_id are checked, against
+    the records of the same project.
 
-    Parameters:
-    projname -- path/name of the TMG .pjc file
-    conn -- Database connection to use to write the database
+    Returns a dictionary of column: count of missing references
     """
+    make_missing_refs(cursor, project_id is not None)
+    # In a merged database, each condition is also limited to the project
+    project = '' if project_id is None else ' AND "project_id" = :project_id'
+    if columns is None:
+        do_sql(cursor, f'DELETE FROM "{MISSING_REFS}" WHERE "table_name" = :table{project}',
+               {'table': tablename, 'project_id': project_id})
+    counts = {}
+    for key, value in fkeys.items():
+        if columns is not None:
+            if key not in columns:
+                continue
+            do_sql(cursor, f'''DELETE FROM "{MISSING_REFS}"
+    WHERE "table_name" = :table AND "column_name" = :column{project}''',
+                   {'table': tablename, 'column': key, 'project_id': project_id})
+        ref_tbl, ref_col, conditions = reference(value)
+        ref_table = table_map[ref_tbl]
+        parms = {'table': tablename, 'column': key, 'ref_table': ref_table, 'ref_column': ref_col,
+                 'project_id': project_id}
+        fixed = ''
+        for num, (col, constant) in enumerate(conditions):
+            fixed += f' AND r."{col}" = :constant{num}'
+            parms[f'constant{num}'] = constant
+        if project_id is None:
+            sql = f'''INSERT INTO "{MISSING_REFS}"
+    SELECT :table, :column, :ref_table, :ref_column, t."{key}", t.rowid FROM "{tablename}" AS t
+    WHERE t."{key}" IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM "{ref_table}" AS r WHERE r."{ref_col}" = t."{key}"{fixed})'''
+        else:
+            sql = f'''INSERT INTO "{MISSING_REFS}"
+    SELECT :table, :column, :ref_table, :ref_column, t."{key}", t.rowid, t."project_id" FROM "{tablename}" AS t
+    WHERE t."project_id" = :project_id AND t."{key}" IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM "{ref_table}" AS r
+                    WHERE r."project_id" = t."project_id" AND r."{ref_col}" = t."{key}"{fixed})'''
+        do_sql(cursor, sql, parms)
+        counts[key] = cursor.rowcount
+        if cursor.rowcount > 0:
+            target = ', '.join([f'{col}={constant}' for col, constant in conditions] + [ref_col])
+            print(f'Missing References: {tablename}.{key} -> {ref_table}.{target}: {cursor.rowcount}')
+            LOG.error(f'Missing References: {tablename}.{key} -> {ref_table}.{target}: {cursor.rowcount}')
+    return counts
 
-    table_map.clear()
 
-    config = configparser.ConfigParser()
-    LOG.debug(config.read(projname))
-    tablename = projname.stem + 'pjc'
-    cursor = conn.cursor()
-    conn.row_factory = sqlite3.Row
-    do_sql(cursor, 'DROP TABLE IF EXISTS %s' % tablename)
-    sql = '''CREATE TABLE "%s" ("section" 'TEXT', "key" 'TEXT', "value" 'TEXT')''' % (tablename,)
-    do_sql(cursor, sql)
-    sql = '''INSERT INTO "%s" VALUES (:section, :key, :value)''' % (tablename,)
-# TODO Read the pjc file and put it into a table in the database of Group / key / value
-    for section in config.sections():
-        for key in config[section]:
-            do_sql(cursor, sql, {"section": section, "key": key, "value": str(config[section][key])})
-    conn.commit()
+# Integrity rules
+#
+# The checks noted in table_info that a Foreign Key can't express. Each rule
+# is one SELECT over the whole of its tables, giving the rowid and a JSON
+# detail of each record of the table (a table_info key) that breaks it. The
+# tables are written as {key}, and filled in from table_map (see run_rule).
+# Flags and parents of 0 are the same as NULL in TMG.
+Rule = namedtuple('Rule', 'name table needs description sql')
 
-    length = len(projname.stem)-1
-    path = projname.parent
-    base = projname.stem[:-1]
-    pat = (base + '*.dbf').upper()
-    for tbl in table_info.keys():
-        file = path.joinpath(base + tbl + ".dbf")
-        progress_file.set(progress_file.get() + tbl + " ")
-        root.update()
-        if file.exists():
-            copy_dbf(file, tbl, conn, table_info[tbl])
-        else:
-            if not (table_info[tbl].get(OPTIONAL, False)):
-                print("Missing:", file)
-                LOG.error("Missing File {file}")
+INTEGRITY_RULES = (
+    Rule('person_father', '$', ('$', 'F', 'T'), 'FATHER is not the Primary Father in F', """
+SELECT p.rowid, json_object('PER_NO', p."PER_NO", 'FATHER', p."FATHER", 'primary', f."PARENT")
+FROM {$} AS p
+LEFT JOIN (SELECT f."CHILD", min(f."PARENT") AS "PARENT" FROM {F} AS f JOIN {T} AS t ON t."ETYPENUM" = f."PTYPE"
+           WHERE f."PRIMARY" AND t."ADMIN" = 2 GROUP BY f."CHILD") AS f ON f."CHILD" = p."PER_NO"
+WHERE coalesce(p."FATHER", 0) <> coalesce(f."PARENT", 0)"""),
 
-    # Process any unknown file type
-    for fname in os.listdir(projname.parent):
-        if fnmatch(fname.upper(), pat):
-            dbf = path.joinpath(fname)
-            tbl = dbf.stem[length:].upper()
-            info = table_info.get(tbl, None)
-            if info is None:
-                print("Unknown: fname")
-                LOG.warning(f"\n{tbl}  {info}")
-                copy_dbf(path.joinpath(fname), tbl, conn, info)
+    Rule('person_mother', '$', ('$', 'F', 'T'), 'MOTHER is not the Primary Mother in F', """
+SELECT p.rowid, json_object('PER_NO', p."PER_NO", 'MOTHER', p."MOTHER", 'primary', f."PARENT")
+FROM {$} AS p
+LEFT JOIN (SELECT f."CHILD", min(f."PARENT") AS "PARENT" FROM {F} AS f JOIN {T} AS t ON t."ETYPENUM" = f."PTYPE"
+           WHERE f."PRIMARY" AND t."ADMIN" = 3 GROUP BY f."CHILD") AS f ON f."CHILD" = p."PER_NO"
+WHERE coalesce(p."MOTHER", 0) <> coalesce(f."PARENT", 0)"""),
 
+    Rule('person_primary_name', '$', ('$', 'N'), 'Not exactly one Primary Name in N', """
+SELECT p.rowid, json_object('PER_NO', p."PER_NO", 'primary_names', count(n."NPER"))
+FROM {$} AS p
+LEFT JOIN {N} AS n ON n."NPER" = p."PER_NO" AND n."PRIMARY"
+GROUP BY p.rowid
+HAVING count(n."NPER") <> 1"""),
 
-def tmg2sqlite(projname):
-    """Convert a TMG Project to Sqlite.
+    Rule('relationship_unique', 'F', ('F',), 'More than one relationship of CHILD to PARENT of the PTYPE', """
+SELECT f.rowid, json_object('CHILD', f."CHILD", 'PARENT', f."PARENT", 'PTYPE', f."PTYPE")
+FROM {F} AS f
+WHERE EXISTS (SELECT 1 FROM {F} AS o
+              WHERE o."CHILD" = f."CHILD" AND o."PARENT" = f."PARENT" AND o."PTYPE" = f."PTYPE"
+              AND o.rowid < f.rowid)"""),
 
-    Parameters:
-    projname -- path to the TMG project .pjc file
+    Rule('relationship_type', 'F', ('F', 'T'), 'PTYPE is not a parent type (ADMIN 2, 3, or 12 if not PRIMARY)', """
+SELECT f.rowid, json_object('CHILD', f."CHILD", 'PTYPE', f."PTYPE", 'ADMIN', t."ADMIN", 'PRIMARY', f."PRIMARY")
+FROM {F} AS f
+JOIN {T} AS t ON t."ETYPENUM" = f."PTYPE"
+WHERE t."ADMIN" NOT IN (2, 3, 12) OR (t."ADMIN" = 12 AND f."PRIMARY")"""),
 
-    Creates a Sqlite database by the same name as the project with a '.Sqlite' extension
-    Tables within the database have names matching the names of the .dbf files
-    uses: https://github.com/olemb/dbfread/
-    """
+    Rule('relationship_primary', 'F', ('F', 'T'), 'More than one PRIMARY parent of the type of a CHILD', """
+SELECT f.rowid, json_object('CHILD', f."CHILD", 'PARENT', f."PARENT", 'ADMIN', t."ADMIN")
+FROM {F} AS f
+JOIN {T} AS t ON t."ETYPENUM" = f."PTYPE"
+WHERE f."PRIMARY" AND EXISTS (SELECT 1 FROM {F} AS o JOIN {T} AS u ON u."ETYPENUM" = o."PTYPE"
+                              WHERE o."CHILD" = f."CHILD" AND o."PRIMARY" AND u."ADMIN" = t."ADMIN"
+                              AND o.rowid <> f.rowid)"""),
 
-    project.set(projname)
-    progress_file.set("")
-    root.update()
-    path = Path(projname)
-    path.resolve()
-    print(projname)
-    if not path.exists():
-        print("File "+projname+" Doesn't Exist")
-        return
-    sdb = path.with_suffix('.sqlite')
-    logfile = path.with_suffix('.log')
-    print(logfile)
-    handler = logging.FileHandler(filename=logfile, mode='w')
-    LOG.addHandler(handler)
-    # Allow options of other types of output
-    # TMG Seems to only use N fields for integers, and Sqlite will still store floats as floats
-    typemap["N"] = "INTEGER"
-    conn = sqlite3.connect(str(sdb))
-    cursor = conn.cursor()
-    do_sql(cursor, 'PRAGMA foreign_keys = OFF')     # While we are processing ignore Foreign Key Errors
-    tmg2db(path, conn)
+    Rule('repository_primary', 'W', ('W',), 'More than one PRIMARY repository of a source', """
+SELECT w.rowid, json_object('MNUMBER', w."MNUMBER", 'RNUMBER', w."RNUMBER")
+FROM {W} AS w
+WHERE w."PRIMARY" AND EXISTS (SELECT 1 FROM {W} AS o
+                              WHERE o."MNUMBER" = w."MNUMBER" AND o."PRIMARY" AND o.rowid <> w.rowid)"""),
 
-    LOG.removeHandler(handler)
+    Rule('witness_primary_principal', 'E', ('E', 'G'), 'PRIMARY witness is not PER1 or PER2 of the event', """
+SELECT e.rowid, json_object('GNUM', e."GNUM", 'EPER', e."EPER", 'PER1', g."PER1", 'PER2', g."PER2")
+FROM {E} AS e
+JOIN {G} AS g ON g."RECNO" = e."GNUM"
+WHERE e."PRIMARY" AND e."EPER" NOT IN (coalesce(g."PER1", 0), coalesce(g."PER2", 0))"""),
 
+    # Only the Birth and Death groups: a person can have a PRIMARY event of each marriage, say
+    Rule('witness_primary_unique', 'E', ('E', 'G', 'T'), 'More than one PRIMARY Birth or Death event for a person', """
+SELECT e.rowid, json_object('GNUM', e."GNUM", 'EPER', e."EPER", 'ETYPE', g."ETYPE", 'ADMIN', t."ADMIN")
+FROM {E} AS e
+JOIN {G} AS g ON g."RECNO" = e."GNUM"
+JOIN {T} AS t ON t."ETYPENUM" = g."ETYPE"
+WHERE e."PRIMARY" AND t."ADMIN" IN (4, 5)
+  AND EXISTS (SELECT 1 FROM {E} AS o
+              JOIN {G} AS h ON h."RECNO" = o."GNUM"
+              JOIN {T} AS u ON u."ETYPENUM" = h."ETYPE"
+              WHERE o."EPER" = e."EPER" AND o."PRIMARY" AND u."ADMIN" = t."ADMIN" AND o.rowid <> e.rowid)"""),
 
-def find_file(path: Path, pat: str):
-    """Search Path for all files that match pat and then process"""
-    print("Processing:", path, pat)
-    for filename in os.listdir(path):
-        fullname = (path / filename).resolve()
-        if filename[0] == '.':
-            # Ignore files and directories beginning with .
-            pass
-        elif os.path.isdir(fullname):
-            print("\nDir: ", filename)
-            LOG.info(f"Dir {filename}")
-            if recursive.get() > 0:
-                find_file(fullname, pat)
-        elif fnmatch(filename.upper(), pat):
-            print('File: ', filename)
-            LOG.warning(f"\nFile {filename}")
-            tmg2sqlite(path.joinpath(filename))
+    Rule('event_principals', 'G', ('G', 'E'), 'PER1 or PER2 is not a witness of the event in E', """
+SELECT g.rowid, json_object('RECNO', g."RECNO", 'PER1', g."PER1", 'PER2', g."PER2")
+FROM {G} AS g
+WHERE (coalesce(g."PER1", 0) <> 0
+       AND NOT EXISTS (SELECT 1 FROM {E} AS e WHERE e."GNUM" = g."RECNO" AND e."EPER" = g."PER1"))
+   OR (coalesce(g."PER2", 0) <> 0
+       AND NOT EXISTS (SELECT 1 FROM {E} AS e WHERE e."GNUM" = g."RECNO" AND e."EPER" = g."PER2"))"""),
+)
 
-def open_directory():
-    directory = askdirectory()
-    if directory:
-        level = log_level.get()
-        if level > 0:
-            LOG.setLevel(level)
-        directory = Path(directory)
-        # TODO only add if not added by user. What to do for other extensions?
-        pat = pattern.get() + ".PJC"
-        find_file(directory, pat)
-
-def open_file():
-    patterns = [
-        ("Project Files", "*.pjc"),
-    ]
-    level = log_level.get()
-    if level > 0:
-        LOG.setLevel(level)
-    paths = askopenfilenames(filetypes=patterns)
-
-    for path in paths:
-        tmg2sqlite(Path(path))
-
-def main():
-    frm = Frame(root, padding = 10)
-    frm.grid()
-    Button(frm, text="Open Directory", command=open_directory).grid(sticky="W", column=0, row=0)
-    Label(frm, text="Pattern:").grid(sticky="E", column=1, row=0)
-    Entry(frm, textvariable=pattern, width=12).grid(column=2, row=0)
 
-    Button(frm, text="Open File", command=open_file).grid(sticky="W", column=0, row=1)
-    Checkbutton(frm, text="Recursive", variable=recursive).grid(column=2, row=1)
-    Button(frm, text="Quit", command=root.destroy).grid(sticky="W", column=0, row=9)
-    Label(frm, text="Version: "+Version).grid(sticky="W", column=1, row=9)
+def make_violations(cursor, merged=False):
+    """Create the table used to record the records that break the integrity rules (see validate_database)
 
-    Label(frm, textvariable=project, width=100).grid(column=0, columnspan=10, row=10)
-    Label(frm, textvariable=progress_file, width=100).grid(column=0, columnspan=10, row=11)
+    In a merged database, the table also has the project_id of each record.
+    """
+    project = ',\n    "project_id" INTEGER' if merged else ''
+    sql = f'''CREATE TABLE IF NOT EXISTS "{VIOLATIONS}" (
+    "rule" TEXT,
+    "table_name" TEXT,
+    "row_id" INTEGER,
+    "detail" TEXT{project}
+)'''
+    do_sql(cursor, sql)
 
-    Label(frm, text="Logging:").grid(sticky="E", column=4, row=0)
+
+def run_rule(database, rule, project_id=None):
+    """Run an integrity rule on its own read-only connection to the database
+
+    The {key} tables of the rule are those of table_map. In a merged database,
+    they are shadowed by temporary views of the records of project_id, with
+    the rowid of the table, so the rule is written the same way for both.
+
+    Returns (list of (row_id, detail), seconds), or None if the rule failed
+    """
+    start = time.perf_counter()
+    conn = sqlite3.connect(f'{Path(database).resolve().as_uri()}?mode=ro', uri=True)
+    try:
+        if project_id is not None:
+            for key in rule.needs:
+                conn.execute(f'''CREATE TEMP VIEW "{table_map[key]}" AS
+    SELECT rowid AS rowid, * FROM main."{table_map[key]}" WHERE "project_id" = {int(project_id)}''')
+        sql = rule.sql.format_map({key: f'"{table_map[key]}"' for key in rule.needs})
+        violations = conn.execute(sql).fetchall()
+    except sqlite3.Error as err:
+        print(f'Integrity rule {rule.name} failed: {err}')
+        LOG.error(f'Integrity rule {rule.name} failed: {err}')
+        return None
+    finally:
+        conn.close()
+    return violations, time.perf_counter() - start
+
+
+def validate_database(database, options=None, stats=None, project=None, rules=INTEGRITY_RULES):
+    """Run the integrity rules over a converted database, saving the records that break them
+
+    Parameters:
+    database -- path of the database, which mustn't have a connection writing to it
+    options -- Options of the conversion, for its progress reports and cancel event
+    stats -- ConversionStats that gets a validate phase for the table of each rule
+    project -- in a merged database, the path of the project whose records are checked
+    rules -- the Rules to run, defaults to INTEGRITY_RULES
+
+    Each rule is one query (see INTEGRITY_RULES), so no record goes through
+    Python. The rules don't depend on each other, so they all run at once,
+    each with its own read-only connection on a thread (sqlite3 lets go of
+    the GIL while a query runs). Rules needing a table that isn't in table_map
+    are skipped. The violations then replace those of any earlier check in
+    the _violations table: the rule, the table name, the rowid of the record
+    and the JSON detail from the rule.
+
+    Returns a dictionary of rule name: number of violations, which is empty if
+    project isn't in the database, which is reported as an 'error' (see report).
+    """
+    if options is None:
+        options = Options()
+    rules = [rule for rule in rules if all(key in table_map for key in rule.needs)]
+    start = time.perf_counter()
+    conn = sqlite3.connect(str(database))
+    try:
+        cursor = conn.cursor()
+        project_id = None
+        if project is not None:
+            do_sql(cursor, f'SELECT "project_id" FROM "{PROJECTS}" WHERE "project" = :project',
+                   {'project': str(Path(project).resolve())})
+            row = cursor.fetchone()
+            if row is None:
+                message = f"Can't validate {project}: it isn't in the {PROJECTS} table of {database}"
+                print(message)
+                LOG.error(message)
+                report(options, 'error', message)
+                return {}
+            project_id = row[0]
+        conn.commit()
+
+        results = {}
+        with ThreadPoolExecutor(max(1, min(len(rules), os.cpu_count() or 1))) as pool:
+            futures = {pool.submit(run_rule, database, rule, project_id): rule for rule in rules}
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=0.5)
+                for future in finished:
+                    results[futures[future]] = future.result()
+                    report(options, 'rule', futures[future].name)
+                if pending:
+                    try:
+                        report(options, 'wait')
+                    except ConversionCancelled:
+                        # The rules that are running finish, but no more are started
+                        for future in pending:
+                            future.cancel()
+                        raise
+
+        make_violations(cursor, project_id is not None)
+        if project_id is None:
+            do_sql(cursor, f'DELETE FROM "{VIOLATIONS}"')
+            sql = f'INSERT INTO "{VIOLATIONS}" VALUES (?, ?, ?, ?)'
+        else:
+            do_sql(cursor, f'DELETE FROM "{VIOLATIONS}" WHERE "project_id" = :project_id',
+                   {'project_id': project_id})
+            sql = f'INSERT INTO "{VIOLATIONS}" VALUES (?, ?, ?, ?, {int(project_id)})'
+        counts = {}
+        for rule in rules:
+            if results[rule] is None:
+                continue
+            violations, seconds = results[rule]
+            tablename = table_map[rule.table]
+            cursor.executemany(sql, ((rule.name, tablename, row_id, detail) for row_id, detail in violations))
+            counts[rule.name] = len(violations)
+            if stats is not None:
+                stats.add(rule.table, 'validate', seconds, len(violations))
+            if violations:
+                print(f'Violations: {tablename} {rule.name}: {rule.description}: {len(violations)}')
+                LOG.warning(f'Violations: {tablename} {rule.name}: {rule.description}: {len(violations)}')
+        conn.commit()
+    finally:
+        conn.close()
+    LOG.info(f'Validated {len(counts)} rules: {time.perf_counter() - start:.3f} sec')
+    return counts
+
+
+# The parts of a table that the writers make their DDL from (see table_schema)
+TableSchema = namedtuple('TableSchema', 'name columns primary unique foreign conditional indexes')
+
+
+def table_schema(dbf, tablename, info):
+    """Collect the columns, keys and indexes of a table from its DBF file and table_info entry
+
+    Returns a TableSchema of:
+    name -- the name of the table
+    columns -- dictionary of column name: type from typemap, including the decoded DATE columns
+    primary -- tuple of the Primary Key columns, or None
+    unique -- list of tuples of columns that are Unique
+    foreign -- list of (column, referenced table, referenced column) of the Foreign Keys
+    conditional -- list of (column, referenced table, referenced column, conditions) of the Foreign
+                   Keys to part of a composite key (see reference), which the DDL can't declare,
+                   so are only checked (see check_references)
+    indexes -- list of (index name, tuple of columns) of the other indexes, which include the Foreign Keys
+    """
+    columns = {}
+    for field in dbf.fields:
+        columns[field.name] = typemap.get(field.type, 'TEXT')
+
+    primary = info.get(PRIMARY, None)
+    if isinstance(primary, str):
+        primary = (primary,)
+    elif primary is not None and not isinstance(primary, tuple):
+        LOG.error(f'TODO Primary: {primary}')
+        primary = None
+
+    unique = []
+    cols = info.get(UNIQUE, None)
+    if isinstance(cols, str):
+        # Single Unique field in the table
+        unique.append((cols,))
+    elif isinstance(cols, set):
+        # A Tuple of Unique Fields in the table
+        for col in cols:
+            if isinstance(col, str):
+                unique.append((col,))
+            elif isinstance(col, tuple):
+                unique.append(col)
+            else:
+                LOG.error(f'TODO Unique {cols} : {col}')
+    elif cols is not None:
+        LOG.error(f'TODO Unique: {cols}')
+
+    index = info.get(INDEX, None)
+    if index is None:
+        index = set()
+    elif isinstance(index, str):
+        # Convert single entry index to a set
+        index = {index}
+    elif not isinstance(index, set):
+        LOG.error(f'TODO Index: {index}')
+        index = set()
+
+    foreign = []
+    conditional = []
+    fkeys = info.get(FOREIGN, None)
+    if fkeys is not None:
+        index = set(index)
+        for key, value in fkeys.items():
+            if isinstance(key, str):
+                # Single Key Foreign Constraint, indexed for the checks and joins
+                index.add(key)
+                ref_tbl, ref_col, conditions = reference(value)
+                if conditions:
+                    conditional.append((key, table_map[ref_tbl], ref_col, conditions))
+                else:
+                    foreign.append((key, table_map[ref_tbl], ref_col))
+            else:
+                # When we handle multi-key foreign keys, need to also change to Copy loop
+                LOG.error(f'TODO Foreign {key}: {value}')
+
+    # Add the decoded columns of the DATE fields, with indexes for range queries
+    indexes = []
+    for num in date_fields(info, dbf.field_names):
+        field = dbf.field_names[num]
+        for suffix, sql_type in DATE_COLUMNS:
+            columns[field + suffix] = sql_type
+        for suffix in ('_DAYNUM', '_YEAR'):
+            indexes.append((tablename + '_' + field + suffix, (field + suffix,)))
+
+    # Add any requested Indexes
+    for col in index:
+        if isinstance(col, str):
+            # Single index specified
+            indexes.append((tablename + '_' + col, (col,)))
+        elif isinstance(col, tuple):
+            indexes.append((tablename + '_' + ('_'.join(col)), col))
+        else:
+            LOG.error(f'TODO Index: {index} : {col}')
+
+    return TableSchema(tablename, columns, primary, unique, foreign, conditional, indexes)
+
+
+def table_ddl(schema, merged=False):
+    """Make the SQLite CREATE TABLE statement for a TableSchema
+
+    The Primary Key and Unique columns are constraints of the table; the other
+    indexes are returned, to be built before or after the load (see
+    create_table). In a merged database, the table starts
+    with a project_id column, which also starts every key (see create_table).
+
+    Returns (CREATE TABLE statement, indexes), where indexes are
+    (index name, tuple of columns, unique).
+    """
+    tablename = schema.name
+    field_types = dict(schema.columns)
+    table_prop = ""
+    # Indexes as (name, columns, unique), built before or after the load
+    indexes = []
+
+    pkey = schema.primary
+    if pkey is None:
+        pass
+    elif merged:
+        table_prop += ",\n    PRIMARY KEY (project_id, " + (', '.join(pkey)) + ")"
+    elif len(pkey) == 1:
+        field_types[pkey[0]] += ' PRIMARY KEY'    # Add PRIMARY KEY to the Primary Key
+    else:
+        table_prop += ",\n    PRIMARY KEY (" + (', '.join(pkey)) + ")"
+
+    for col in schema.unique:
+        if merged:
+            table_prop += ',\n    UNIQUE (project_id, ' + (', '.join(col)) + ')'
+        elif len(col) == 1:
+            field_types[col[0]] += " UNIQUE"
+        else:
+            table_prop += ',\n    UNIQUE (' + (', '.join(col)) + ')'
+
+    for key, ref_table, ref_col in schema.foreign:
+        if merged:
+            table_prop += (f',\n    FOREIGN KEY (project_id, "{key}") '
+                           f'REFERENCES "{ref_table}"(project_id, "{ref_col}")')
+        else:
+            field_types[key] += f' REFERENCES "{ref_table}"("{ref_col}")'
+
+    col_defs = ',\n    '.join(['"%s" %s' % (f, field_types[f])
+                               for f in field_types])
+    if merged:
+        col_defs = f'"project_id" INTEGER NOT NULL REFERENCES "{PROJECTS}"("project_id"),\n    ' + col_defs
+    sql = f'CREATE TABLE "{tablename}" (\n    {col_defs}{table_prop}\n)'
+
+    indexes += [(index_name, columns, False) for index_name, columns in schema.indexes]
+    return sql, indexes
+
+
+def create_table(dbf, tbl: str, cursor, info, defer_indexes=False, project_id=None):
+    """Create the table (and indexes) for a DBF file
+
+    Parameters:
+    dbf -- the opened DBF file
+    tbl -- table_info key for the file
+    cursor -- Database cursor to create the table with
+    info -- table_info entry for the table
+    defer_indexes -- leave the indexes to be built after the data is loaded
+    project_id -- the project being added to a merged database, None for a database of one project
+
+    In a merged database, the table is named after the table_info key (see MERGED_PREFIX),
+    and is shared by all the projects. It starts with a project_id column, which
+    also starts the Primary Key, the Unique constraints, the Foreign Keys and the
+    indexes. If the table already exists, it is kept, adding any columns this
+    project has that it doesn't. Since each project gets a higher project_id, its
+    records are added at the end of every index, so the indexes are always kept
+    up to date, rather than deferred.
+
+    Returns (tablename, fkeys, indexes), where indexes are those still to be built
+    """
+    merged = project_id is not None
+    if merged:
+        tablename = MERGED_PREFIX + tbl
+        defer_indexes = False
+    else:
+        tablename = dbf.name    # Name the tables in the SQL after the name of the DBF
+    table_map[tbl] = tablename
+
+    if LOG.isEnabledFor(logging.DEBUG):
+        show_table(dbf)
+    if not merged:
+        do_sql(cursor, 'drop table if exists %s' % tablename)
+    schema = table_schema(dbf, tablename, info)
+    sql, indexes = table_ddl(schema, merged)
+
+    if merged and table_exists(cursor, tablename):
+        # Add the columns that are new in this project
+        do_sql(cursor, f'PRAGMA table_info("{tablename}")')
+        columns = {row[1] for row in cursor.fetchall()}
+        for field, sql_type in schema.columns.items():
+            if field not in columns:
+                LOG.warning(f'New column {tablename}.{field}')
+                do_sql(cursor, f'ALTER TABLE "{tablename}" ADD COLUMN "{field}" {sql_type}')
+    else:
+        do_sql(cursor, sql)
+
+    if merged:
+        # Lead every index with the project, and only build the indexes the table doesn't have yet
+        do_sql(cursor, "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :table",
+               {'table': tablename})
+        existing = {row[0] for row in cursor.fetchall()}
+        indexes = [(index_name, ('project_id',) + columns, unique) for index_name, columns, unique in indexes
+                   if index_name not in existing]
+
+    if not defer_indexes:
+        build_indexes(cursor, tablename, indexes)
+        indexes = []
+
+    LOG.debug(pformat(info))
+    return tablename, info.get(FOREIGN, None), indexes
+
+
+def insert_sql(tablename, field_names, project_id=None):
+    """Make the INSERT statement for a table, with a ? for each field in order
+
+    For a merged database, the columns are named, as the table may have more
+    than this project, and the project_id is given as a constant.
+    """
+    refs = ', '.join(['?'] * len(field_names))
+    if project_id is not None:
+        cols = ', '.join(f'"{name}"' for name in field_names)
+        return f'insert into "{tablename}" ("project_id", {cols}) values ({int(project_id)}, {refs})'
+    return 'insert into "%s" values (%s)' % (tablename, refs)
+
+
+def record_converter(fields, fkeys, date_cols=(), columns=False):
+    """Make the function that converts a DBF record to the values to store in the database
+
+    The function takes a record tuple and returns (values, char_error), where
+    Foreign Keys of 0 become NULL, and dates are formatted as text.
+    char_error is True if a text field had a character that couldn't be decoded.
+
+    With columns, for a columnar writer (see ParquetWriter), the function takes
+    a chunk of records and returns (columns, char_errors), where columns are a
+    list of the values of each column, followed by the decoded DATE columns of
+    date_cols (see date_column_lists), and char_errors are the positions of the
+    records with a character error. Dates are kept as dates.
+
+    The function is compiled for the table (see converter_source), so only the
+    columns that need converting are looked at, each with just its own steps.
+    """
+    source = converter_source(fields, fkeys, date_cols, columns)
+    LOG.debug(source)
+    namespace = {'ERROR_CHAR': ERROR_CHAR, 'dates': {}, 'date_column_lists': date_column_lists}
+    exec(compile(source, f'<record_converter {len(fields)} fields>', 'exec'), namespace)
+    return namespace['convert']
+
+
+def converter_source(fields, fkeys, date_cols=(), columns=False):
+    """Write the source of the record_converter function for the fields of a table
+
+    The conversion plan comes from the fields and the Foreign Keys: the Foreign
+    Key columns are set to None when 0, the D columns are formatted (each distinct
+    date once, kept in the dates dictionary), the T columns are formatted, and the
+    C, M and V columns are scanned for ERROR_CHAR. The other columns are passed
+    through untouched.
+
+    With columns, the function loops over a chunk of records, appending each
+    value to the list of its column, and leaves the D and T columns as they are.
+    """
+    names = [field.name for field in fields]
+    fkey_cols = [] if fkeys is None else [names.index(col) for col in fkeys
+                                           if isinstance(col, str) and col in names]
+    dbf_date_cols = [num for num, field in enumerate(fields) if field.type == 'D']
+    datetime_cols = [num for num, field in enumerate(fields) if field.type in 'T@']
+    text_cols = [num for num, field in enumerate(fields) if field.type in 'CMV']
+    if columns:
+        return column_converter_source(len(fields), fkey_cols, text_cols, date_cols)
+
+    lines = ['def convert(rec):',
+             '    values = list(rec)']
+    # Convert Foreign Keys 0 to NULL
+    for num in fkey_cols:
+        lines += [f'    if values[{num}] == 0:',
+                  f'        values[{num}] = None']
+    for num in dbf_date_cols:
+        lines += [f'    value = values[{num}]',
+                  '    if value is not None:',
+                  '        text = dates.get(value)',
+                  '        if text is None:',
+                  "            text = dates[value] = value.strftime('%Y-%m-%d')",
+                  f'        values[{num}] = text']
+    for num in datetime_cols:
+        lines += [f'    if values[{num}] is not None:',
+                  f"        values[{num}] = values[{num}].strftime('%Y-%m-%d %H:%M:%S')"]
+    # Report only once per record, even if multiple fields
+    checks = ' or '.join(f'(isinstance(values[{num}], str) and ERROR_CHAR in values[{num}])' for num in text_cols)
+    lines += [f'    return values, {checks or "False"}']
+    return '\n'.join(lines) + '\n'
+
+
+def column_converter_source(count, fkey_cols, text_cols, date_cols):
+    """Write the source of the record_converter function for columns (see converter_source)"""
+    values = ', '.join(f'v{num}' for num in range(count))
+    lines = ['def convert(recs):']
+    lines += [f'    c{num} = []' for num in range(count)]
+    lines += ['    char_errors = []',
+              f'    for pos, ({values},) in enumerate(recs):']
+    for num in fkey_cols:
+        lines += [f'        if v{num} == 0:',
+                  f'            v{num} = None']
+    lines += [f'        c{num}.append(v{num})' for num in range(count)]
+    checks = ' or '.join(f'(isinstance(v{num}, str) and ERROR_CHAR in v{num})' for num in text_cols)
+    if checks:
+        lines += [f'        if {checks}:',
+                  '            char_errors.append(pos)']
+    lines += [f"    columns = [{', '.join(f'c{num}' for num in range(count))}]"]
+    lines += [f'    columns += date_column_lists(c{num})' for num in date_cols]
+    lines += ['    return columns, char_errors']
+    return '\n'.join(lines) + '\n'
+
+
+# TMG date qualifiers, by the code in position 11 of a regular date
+DATE_QUALIFIERS = {
+    '0': 'before',
+    '1': 'say',
+    '2': 'circa',
+    '3': 'exact',
+    '4': 'after',
+    '5': 'between',
+    '6': 'or',
+    '7': 'from',
+}
+
+# Columns added for each DATE field, with the suffix added to the field's name
+DATE_COLUMNS = (
+    ('_DAYNUM', 'INTEGER'),     # Julian Day Number of the (first) date, so date(x_DAYNUM) works
+    ('_YEAR', 'INTEGER'),
+    ('_QUAL', 'TEXT'),          # DATE_QUALIFIERS value, with a ? added if questioned, or 'irregular'
+)
+
+
+def decode_tmg_date(value):
+    """Decode a TMG date field to (day number, year, qualifier)
+
+    A regular date is "1YYYYMMDD" followed by the old style flag, the
+    qualifier code, a second date for ranges, and the question mark flag.
+    An unknown month or day counts as the first for the day number, and
+    an irregular (text) date has only the qualifier 'irregular'.
+    An empty date is (None, None, None).
+    """
+    if not value:
+        return None, None, None
+    if value[0] == '0':
+        return None, None, 'irregular'
+    try:
+        year = int(value[1:5])
+        month = int(value[5:7])
+        day = int(value[7:9])
+    except ValueError:
+        return None, None, None
+    if value[0] != '1' or year == 0:
+        return None, None, None
+    qualifier = DATE_QUALIFIERS.get(value[10:11])
+    if qualifier is not None and value[20:21] == '1':
+        qualifier += '?'
+    month = min(max(month, 1), 12)
+    day = min(max(day, 1), calendar.monthrange(year, month)[1])
+    return datetime.date(year, month, day).toordinal() + 1721425, year, qualifier
+
+
+def date_fields(info, field_names):
+    """Return the positions of the DATE fields of a table that are in its file"""
+    dates = info.get(DATE, ()) if info else ()
+    if isinstance(dates, str):
+        dates = (dates,)
+    return [field_names.index(name) for name in dates if name in field_names]
+
+
+def table_columns(field_names, date_cols):
+    """Return the names of the columns of a table: its fields, then the decoded DATE columns"""
+    return list(field_names) + [field_names[num] + suffix for num in date_cols for suffix, _type in DATE_COLUMNS]
+
+
+def add_date_columns(rows, date_cols):
+    """Append the decoded DATE columns (see decode_tmg_date) to a chunk of records, in place
+
+    Dates repeat a lot, so each distinct value is decoded once per chunk.
+    """
+    if not date_cols:
+        return
+    decoded = {}
+    for rec in rows:
+        for num in date_cols:
+            value = rec[num]
+            columns = decoded.get(value)
+            if columns is None:
+                columns = decoded[value] = decode_tmg_date(value)
+            rec.extend(columns)
+
+
+def date_column_lists(values):
+    """Return the decoded DATE columns (see decode_tmg_date) for the values of a DATE field, as three lists
+
+    Dates repeat a lot, so each distinct value is decoded once.
+    """
+    decoded = {}
+    for value in values:
+        if value not in decoded:
+            decoded[value] = decode_tmg_date(value)
+    daynums, years, qualifiers = [], [], []
+    for value in values:
+        daynum, year, qualifier = decoded[value]
+        daynums.append(daynum)
+        years.append(year)
+        qualifiers.append(qualifier)
+    return [daynums, years, qualifiers]
+
+
+# Output writers
+#
+# copy_dbf and copy_tables send the tables to a writer: SqliteWriter for a
+# SQLite database, SqlScriptWriter for a SQL script of INSERT statements,
+# PostgresWriter for a PostgreSQL script that loads the data with COPY, or
+# ParquetWriter for Parquet files. The script writers write each chunk of
+# records as it comes, so they only hold one chunk in memory. A writer that is
+# columnar is sent each chunk as the lists of its columns (insert_columns),
+# rather than as records (see ParquetWriter).
+
+class SqliteWriter:
+    """Writes the tables into a SQLite database, through its connection"""
+
+    columnar = False
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.cursor = conn.cursor()
+        self.rejects = RejectedRows()
+        self.statements = {}    # The table name and project_id of each insert statement
+
+    def create_table(self, dbf, tbl, info, defer_indexes=False, project_id=None):
+        """Create the table for a DBF file, returning (tablename, fkeys, indexes still to build)
+
+        Any rejected records of an earlier conversion of the table are removed.
+        """
+        tablename, fkeys, indexes = create_table(dbf, tbl, self.cursor, info, defer_indexes, project_id)
+        if table_exists(self.cursor, REJECTED):
+            project = '' if project_id is None else f' AND "project_id" = {int(project_id)}'
+            do_sql(self.cursor, f'DELETE FROM "{REJECTED}" WHERE "table_name" = :table{project}',
+                   {'table': tablename})
+        return tablename, fkeys, indexes
+
+    def insert_sql(self, tablename, field_names, project_id=None):
+        """Return the statement to insert the records of a table with"""
+        sql = insert_sql(tablename, field_names, project_id)
+        self.statements[sql] = (tablename, project_id)
+        return sql
+
+    def insert_rows(self, sql, rows, field_names=None, first=None):
+        """Insert a chunk of records, first being the number of the first in its file"""
+        tablename, project_id = self.statements[sql]
+
+        def reject(rec, err, num):
+            self.rejects.add(tablename, None if first is None else first + num, err, rec, field_names, project_id)
+        insert_rows(self.cursor, sql, rows, field_names, reject)
+
+    def insert_row(self, sql, rec, field_names=None, first=None):
+        """Insert a single record, first being its number in its file"""
+        tablename, project_id = self.statements[sql]
+
+        def reject(rec, err, _num):
+            self.rejects.add(tablename, first, err, rec, field_names, project_id)
+        insert_row(self.cursor, sql, rec, field_names, reject)
+
+    def commit(self):
+        """Commit, after saving any rejected records"""
+        self.rejects.save(self.cursor)
+        self.conn.commit()
+
+    def build_indexes(self, tablename, indexes):
+        build_indexes(self.cursor, tablename, indexes)
+
+    def check_references(self, tablename, fkeys, columns=None, project_id=None):
+        return check_references(self.cursor, tablename, fkeys, columns, project_id)
+
+    def close(self):
+        self.conn.commit()
+
+
+def as_writer(conn):
+    """Return the writer for conn, which is a writer already, or a SQLite connection"""
+    if isinstance(conn, sqlite3.Connection):
+        return SqliteWriter(conn)
+    return conn
+
+
+# Records in each INSERT statement of a SQL script
+SCRIPT_ROWS = 500
+
+
+def sql_literal(value):
+    """Format a value as an SQL literal"""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if value != value or value in (float('inf'), float('-inf')):
+            return 'NULL'
+        return repr(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return "X'" + bytes(value).hex() + "'"
+    value = str(value)
+    if '\0' in value:
+        # A NUL would end the statement for some tools, so give the text as hex
+        return "CAST(X'" + value.encode('utf-8').hex() + "' AS TEXT)"
+    return "'" + value.replace("'", "''") + "'"
+
+
+class SqlScriptWriter:
+    """Writes the tables as a SQL script, to create a SQLite database with the sqlite3 shell
+
+    The tables are created with their Primary Key and Unique constraints, and
+    records that would break one are skipped (INSERT OR IGNORE), keeping the
+    first, as a load into a database does. The other indexes are made after
+    each table is loaded. The script is a single transaction.
+
+    Parameters:
+    file -- text file to write the script to
+    """
+
+    columnar = False
+
+    def __init__(self, file):
+        self.file = file
+        self.file.write(f'-- TMG2SQL {Version}\nPRAGMA foreign_keys = OFF;\nBEGIN TRANSACTION;\n')
+
+    def create_table(self, dbf, tbl, info, defer_indexes=False, project_id=None):
+        """Write the CREATE TABLE for a DBF file, returning (tablename, fkeys, indexes still to build)"""
+        if project_id is not None:
+            raise ValueError('Merged projects are only written to a SQLite database')
+        tablename = dbf.name
+        table_map[tbl] = tablename
+        sql, indexes = table_ddl(table_schema(dbf, tablename, info))
+        self.file.write(f'\nDROP TABLE IF EXISTS "{tablename}";\n{sql};\n')
+        return tablename, info.get(FOREIGN, None), indexes
+
+    def insert_sql(self, tablename, field_names, project_id=None):
+        return f'INSERT OR IGNORE INTO "{tablename}" VALUES\n'
+
+    def insert_rows(self, sql, rows, field_names=None, first=None):
+        for start in range(0, len(rows), SCRIPT_ROWS):
+            values = ',\n'.join('(' + ', '.join(map(sql_literal, rec)) + ')'
+                                for rec in rows[start:start + SCRIPT_ROWS])
+            self.file.write(f'{sql}{values};\n')
+
+    def insert_row(self, sql, rec, field_names=None, first=None):
+        self.insert_rows(sql, (rec,), field_names)
+
+    def commit(self):
+        pass
+
+    def build_indexes(self, tablename, indexes):
+        for index_name, columns, unique in indexes:
+            cols = ', '.join(f'"{col}"' for col in columns)
+            self.file.write(f'CREATE {"UNIQUE " if unique else ""}INDEX "{index_name}" ON "{tablename}"({cols});\n')
+
+    def check_references(self, tablename, fkeys, columns=None, project_id=None):
+        """The Foreign Keys are part of the tables, and can't be checked until the script is run"""
+        return {}
+
+    def write_settings(self, tablename, settings):
+        """Write the .pjc settings, as (section, key, value), to their own table"""
+        self.file.write(f'\nDROP TABLE IF EXISTS "{tablename}";\n'
+                        f'CREATE TABLE "{tablename}" ("section" TEXT, "key" TEXT, "value" TEXT);\n')
+        self.insert_rows(f'INSERT INTO "{tablename}" VALUES\n', list(settings))
+
+    def close(self):
+        self.file.write('\nCOMMIT;\nANALYZE;\n')
+
+
+# PostgreSQL types for the types in typemap and DATE_COLUMNS
+POSTGRES_TYPES = {
+    'INTEGER': 'bigint',
+    'REAL': 'double precision',
+    'FLOAT': 'double precision',
+    'BOOLEAN': 'boolean',
+    'TEXT': 'text',
+    'TEXT_DATE': 'date',
+    'TEXT_DATETIME': 'timestamp',
+}
+
+# Escapes for the text format of COPY; PostgreSQL text can't hold a NUL, so they are dropped
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': ''})
+
+
+def copy_text(value):
+    """Format a value for the text format of PostgreSQL COPY"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, int):
+        return str(value)
+    if isinstance(value, float):
+        if value != value:
+            return 'NaN'
+        if value in (float('inf'), float('-inf')):
+            return 'Infinity' if value > 0 else '-Infinity'
+        return repr(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\\\x' + bytes(value).hex()
+    return str(value).translate(COPY_ESCAPES)
+
+
+class PostgresWriter:
+    """Writes the tables as a PostgreSQL script, to run with psql
+
+    Each table is created without constraints, and its records are loaded with
+    COPY ... FROM stdin blocks. The Primary Keys, Unique columns and indexes
+    are then built, as indexes (the Primary Key as a unique index, as its
+    columns may hold NULLs), after removing any records that duplicate an
+    earlier key. The Foreign Keys are added at the end of the
+    script, as NOT VALID, so references to missing records don't stop the load.
+
+    Parameters:
+    file -- text file to write the script to
+    """
+
+    columnar = False
+
+    def __init__(self, file):
+        self.file = file
+        self.copying = None     # The COPY block being written
+        self.foreign = []       # ALTER TABLE statements for the Foreign Keys, written by close
+        self.file.write(f'-- TMG2SQL {Version}\nSET client_encoding = \'UTF8\';\nBEGIN;\n')
+
+    def create_table(self, dbf, tbl, info, defer_indexes=False, project_id=None):
+        """Write the CREATE TABLE for a DBF file, returning (tablename, fkeys, indexes still to build)"""
+        if project_id is not None:
+            raise ValueError('Merged projects are only written to a SQLite database')
+        self.end_copy()
+        tablename = dbf.name
+        table_map[tbl] = tablename
+        schema = table_schema(dbf, tablename, info)
+        raw = {field.name for field in dbf.fields if field.type == '0'}     # _NullFlags are bytes
+        col_defs = ',\n    '.join(f'"{col}" {"bytea" if col in raw else POSTGRES_TYPES.get(sql_type, "text")}'
+                                   for col, sql_type in schema.columns.items())
+        self.file.write(f'\nDROP TABLE IF EXISTS "{tablename}" CASCADE;\nCREATE TABLE "{tablename}" (\n    {col_defs}\n);\n')
+        indexes = []
+        if schema.primary is not None:
+            indexes.append((tablename + '_pkey', schema.primary, True))
+        indexes += [(tablename + '_' + ('_'.join(col)), col, True) for col in schema.unique]
+        indexes += [(index_name, columns, False) for index_name, columns in schema.indexes]
+        for key, ref_table, ref_col in schema.foreign:
+            self.foreign.append(f'ALTER TABLE "{tablename}" ADD FOREIGN KEY ("{key}") '
+                                f'REFERENCES "{ref_table}"("{ref_col}") NOT VALID;\n')
+        return tablename, info.get(FOREIGN, None), indexes
+
+    def insert_sql(self, tablename, field_names, project_id=None):
+        cols = ', '.join(f'"{name}"' for name in field_names)
+        return f'COPY "{tablename}" ({cols}) FROM stdin;\n'
+
+    def insert_rows(self, sql, rows, field_names=None, first=None):
+        if self.copying != sql:
+            self.end_copy()
+            self.file.write(sql)
+            self.copying = sql
+        self.file.write(''.join('\t'.join(map(copy_text, rec)) + '\n' for rec in rows))
+
+    def insert_row(self, sql, rec, field_names=None, first=None):
+        self.insert_rows(sql, (rec,), field_names)
+
+    def end_copy(self):
+        """End the COPY block being written, if there is one"""
+        if self.copying is not None:
+            self.file.write('\\.\n')
+            self.copying = None
+
+    def commit(self):
+        self.end_copy()
+
+    def build_indexes(self, tablename, indexes):
+        self.end_copy()
+        for index_name, columns, unique in indexes:
+            cols = ', '.join(f'"{col}"' for col in columns)
+            if unique:
+                # Remove the records that duplicate an earlier key, as a load into SQLite does
+                same = ' AND '.join(f'a."{col}" = b."{col}"' for col in columns)
+                self.file.write(f'DELETE FROM "{tablename}" a USING "{tablename}" b WHERE a.ctid > b.ctid AND {same};\n')
+            self.file.write(f'CREATE {"UNIQUE " if unique else ""}INDEX "{index_name}" ON "{tablename}"({cols});\n')
+
+    def check_references(self, tablename, fkeys, columns=None, project_id=None):
+        """The Foreign Keys are added at the end of the script, and checked with VALIDATE CONSTRAINT if wanted"""
+        return {}
+
+    def write_settings(self, tablename, settings):
+        """Write the .pjc settings, as (section, key, value), to their own table"""
+        self.end_copy()
+        self.file.write(f'\nDROP TABLE IF EXISTS "{tablename}";\n'
+                        f'CREATE TABLE "{tablename}" ("section" text, "key" text, "value" text);\n')
+        self.insert_rows(self.insert_sql(tablename, ('section', 'key', 'value')), list(settings))
+        self.end_copy()
+
+    def close(self):
+        self.end_copy()
+        self.file.write('\n' + ''.join(self.foreign) + 'COMMIT;\nANALYZE;\n')
+
+
+# Arrow types for the types in typemap and DATE_COLUMNS, by name in the pyarrow module
+ARROW_TYPES = {
+    'INTEGER': 'int64',
+    'REAL': 'float64',
+    'FLOAT': 'float64',
+    'BOOLEAN': 'bool_',
+    'TEXT': 'string',
+    'TEXT_DATE': 'date32',
+    'TEXT_DATETIME': 'timestamp',
+}
+
+# Bytes of records the Parquet writer holds, over all the tables, before writing them out
+PARQUET_BUFFER_BYTES = 64 * 1024 * 1024
+
+
+class ParquetWriter:
+    """Writes each table to a Parquet file in a directory, for columnar tools
+
+    The writer is columnar: each chunk of records comes as the lists of its
+    columns, with the dates as dates (see record_converter), and is turned into
+    a record batch, a column at a time, and held until the batches of all the tables reach buffer_bytes, when the
+    largest table is written out as a row group. The columns have the Arrow
+    types of their typemap types, except that N fields with decimals are
+    float64, and G and P memos and _NullFlags are binary. The Primary Key, Unique columns, Foreign Keys and indexes from
+    table_info are kept in the file metadata, under the key b'tmg2sql', as
+    JSON. They aren't enforced, so the records are those of the DBF file.
+
+    pyarrow is only imported when a ParquetWriter is made, so it is only
+    needed for this output.
+
+    Parameters:
+    directory -- directory to write the files to, made if it doesn't exist
+    buffer_bytes -- the most bytes of records to hold before writing
+    """
+
+    columnar = True
+
+    def __init__(self, directory, buffer_bytes=PARQUET_BUFFER_BYTES):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.buffer_bytes = buffer_bytes
+        self.buffered = 0
+        self.tables = {}    # By table name: the file writer, schema and batches held
+
+    def arrow_type(self, sql_type, field=None):
+        """Return the Arrow type for a column of a typemap type, and its DBF field if it has one"""
+        if field is not None and field.type in '0GP':
+            return self.pa.binary()     # _NullFlags, and general and picture memos, are bytes
+        if field is not None and field.type in 'NF' and field.decimal_count:
+            return self.pa.float64()
+        name = ARROW_TYPES.get(sql_type, 'string')
+        if name == 'timestamp':
+            return self.pa.timestamp('s')
+        return getattr(self.pa, name)()
+
+    def open_table(self, tablename, arrow_schema, metadata=None):
+        """Start the Parquet file of a table"""
+        if metadata is not None:
+            arrow_schema = arrow_schema.with_metadata({b'tmg2sql': json.dumps(metadata).encode()})
+        filename = self.directory / (tablename + '.parquet')
+        self.tables[tablename] = {
+            'writer': self.pq.ParquetWriter(filename, arrow_schema),
+            'schema': arrow_schema,
+            'batches': [],
+            'bytes': 0,
+        }
+
+    def create_table(self, dbf, tbl, info, defer_indexes=False, project_id=None):
+        """Start the Parquet file for a DBF file, returning (tablename, fkeys, indexes still to build)"""
+        if project_id is not None:
+            raise ValueError('Merged projects are only written to a SQLite database')
+        tablename = dbf.name
+        table_map[tbl] = tablename
+        schema = table_schema(dbf, tablename, info)
+        fields = {field.name: field for field in dbf.fields}
+        arrow_schema = self.pa.schema([(col, self.arrow_type(sql_type, fields.get(col)))
+                                       for col, sql_type in schema.columns.items()])
+        metadata = {
+            'tbl': tbl,
+            'table': tablename,
+            'primary': schema.primary,
+            'unique': schema.unique,
+            'foreign': [{'column': key, 'table': ref_table, 'ref_column': ref_col}
+                        for key, ref_table, ref_col in schema.foreign]
+                       + [{'column': key, 'table': ref_table, 'ref_column': ref_col, 'where': dict(conditions)}
+                          for key, ref_table, ref_col, conditions in schema.conditional],
+            'indexes': [columns for _name, columns in schema.indexes],
+            'version': Version,
+        }
+        self.open_table(tablename, arrow_schema, metadata)
+        return tablename, info.get(FOREIGN, None), []
+
+    def insert_sql(self, tablename, field_names, project_id=None):
+        """The records of a table are sent by its name"""
+        return tablename
+
+    def arrow_column(self, values, arrow_type, name):
+        """Make the Arrow array of a column of values
+
+        A value that can't be made the column type is left null, and logged,
+        as is a binary memo in a text column, rather than written as its repr.
+        """
+        pa = self.pa
+        errors = (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError)
+        try:
+            return pa.array(values, arrow_type)
+        except errors:
+            pass
+        column = []
+        for value in values:
+            try:
+                pa.array([value], arrow_type)
+                column.append(value)
+            except errors:
+                if pa.types.is_string(arrow_type) and not isinstance(value, (bytes, bytearray, memoryview)):
+                    column.append(str(value))
+                else:
+                    LOG.warning(f'Not a {arrow_type}: {name} = {value!r}')
+                    column.append(None)
+        return pa.array(column, arrow_type)
+
+    def insert_columns(self, sql, columns, field_names=None, first=None):
+        """Add a chunk of records, as the list of each column, to the table named sql, as a record batch"""
+        if not columns or not columns[0]:
+            return
+        table = self.tables[sql]
+        schema = table['schema']
+        arrays = [self.arrow_column(values, field.type, field.name) for values, field in zip(columns, schema)]
+        batch = self.pa.RecordBatch.from_arrays(arrays, schema=schema)
+        table['batches'].append(batch)
+        table['bytes'] += batch.nbytes
+        self.buffered += batch.nbytes
+        while self.buffered > self.buffer_bytes:
+            self.write_batches(max(self.tables, key=lambda name: self.tables[name]['bytes']))
+
+    def write_batches(self, tablename):
+        """Write the batches held for a table to its file, as a row group"""
+        table = self.tables[tablename]
+        if table['batches']:
+            table['writer'].write_table(self.pa.Table.from_batches(table['batches'], table['schema']),
+                                        row_group_size=sum(batch.num_rows for batch in table['batches']))
+        self.buffered -= table['bytes']
+        table['batches'] = []
+        table['bytes'] = 0
+
+    def commit(self):
+        pass
+
+    def build_indexes(self, tablename, indexes):
+        pass
+
+    def check_references(self, tablename, fkeys, columns=None, project_id=None):
+        """The Foreign Keys are only recorded in the metadata"""
+        return {}
+
+    def write_settings(self, tablename, settings):
+        """Write the .pjc settings, as (section, key, value), to their own file"""
+        string = self.pa.string()
+        self.open_table(tablename, self.pa.schema([('section', string), ('key', string), ('value', string)]))
+        columns = [[], [], []]
+        for setting in settings:
+            for column, value in zip(columns, setting):
+                column.append(value)
+        self.insert_columns(tablename, columns)
+        self.write_batches(tablename)
+
+    def close(self):
+        for tablename, table in self.tables.items():
+            self.write_batches(tablename)
+            table['writer'].close()
+
+
+def dbf_size(dbf):
+    """Return the number of bytes in the files of an open DBF file, including the memo file"""
+    size = file_stat(getattr(dbf, 'location', dbf.filename))[0]
+    if getattr(dbf, 'memofilename', None):
+        size += file_stat(dbf.memofilename)[0]
+    return size
+
+
+def copy_dbf(filename, tbl: str, conn, info=None, batch_size=0, defer_indexes=False, use_dbfread=False,
+             stats=None, project_id=None, options=None):
+    """Copy a DBF file into the Database
+
+    Parameters:
+    filename -- path of the .dbf file to copy
+    tbl -- table_info key for the file
+    conn -- Database connection to write to, or an output writer (see SqliteWriter)
+    info -- table_info entry for the table
+    batch_size -- if not 0, records are inserted in chunks of this size with executemany
+    defer_indexes -- build the indexes after the data is loaded, rather than before
+    use_dbfread -- read the file with dbfread rather than DbfReader
+    stats -- ConversionStats to add the time of each phase to
+    project_id -- the project being added to a merged database (see create_table)
+    options -- Options for the progress reports and cancelling (see report)
+
+    The Primary Key and Unique columns are always constraints of the table (see
+    table_ddl), so a record that duplicates an earlier key is rejected as it is
+    inserted. defer_indexes only leaves the other indexes to be built after the load.
+
+    Returns the number of records read.
+    """
+    if info is None:
+        info = {}
+    if stats is None:
+        stats = ConversionStats(filename)
+    if options is None:
+        options = Options()
+    print(filename, '', end='')
+    LOG.info(f"\n{filename}")
+    LOG.debug(pformat(info))
+    start = time.perf_counter()
+    dbf = open_dbf(filename, use_dbfread)
+    writer = as_writer(conn)
+    tablename, fkeys, indexes = writer.create_table(dbf, tbl, info, defer_indexes, project_id)
+    stats.add(tbl, 'open', time.perf_counter() - start, bytes_read=dbf_size(dbf))
+
+    # Create data rows
+    date_cols = date_fields(info, dbf.field_names)
+    field_names = table_columns(dbf.field_names, date_cols)
+    sql = writer.insert_sql(tablename, field_names, project_id)
+    LOG.debug(sql)
+    columnar = writer.columnar
+    if columnar:
+        batch_size = batch_size or BATCH_SIZE   # Columns only come in chunks
+    convert = record_converter(dbf.fields, fkeys, date_cols, columnar)
+
+    def insert_chunk(chunk, first):
+        """Insert a chunk of records, returning the seconds taken by the writer"""
+        if columnar:
+            columns, char_errors = convert(chunk)
+            for num in char_errors:
+                LOG.warning(f"Character Error: {pformat(dict(zip(field_names, chunk[num])))}")
+            insert_start = time.perf_counter()
+            writer.insert_columns(sql, columns, field_names, first)
+        else:
+            add_date_columns(chunk, date_cols)
+            insert_start = time.perf_counter()
+            writer.insert_rows(sql, chunk, field_names, first)
+        return time.perf_counter() - insert_start
+
+    recno = 0
+    progress_interval = 1000
+    batch = []
+    insert_time = 0.0
+    start = time.perf_counter()
+    for rec in dbf:
+        recno += 1
+        if not columnar:
+            rec, char_error = convert(rec)
+            if char_error:
+                LOG.warning(f"Character Error: {pformat(dict(zip(field_names, rec)))}")
+            LOG.debug(rec)
+        if batch_size:
+            batch.append(rec)
+            if len(batch) >= batch_size:
+                insert_time += insert_chunk(batch, recno - len(batch) + 1)
+                batch = []
+                report(options, 'rows', (tbl, recno, dbf.header.numrecords))
+        else:
+            add_date_columns((rec,), date_cols)
+            insert_start = time.perf_counter()
+            writer.insert_row(sql, rec, field_names, recno)
+            insert_time += time.perf_counter() - insert_start
+
+        if (recno % progress_interval) == 0:
+            if not batch_size:
+                report(options, 'rows', (tbl, recno, dbf.header.numrecords))
+            num = recno // progress_interval
+            if num % 10 == 0:
+                print('', num, '', end='')
+            else:
+                print(num % 10, end='')
+    print('')  # Add a return
+    if batch:
+        insert_time += insert_chunk(batch, recno - len(batch) + 1)
+    report(options, 'rows', (tbl, recno, dbf.header.numrecords))
+    insert_start = time.perf_counter()
+    writer.commit()
+    insert_time += time.perf_counter() - insert_start
+    stats.add(tbl, 'decode', time.perf_counter() - start - insert_time, recno)
+    stats.add(tbl, 'insert', insert_time, recno)
+    LOG.info(f'Records: {recno}')
+
+    if indexes:
+        with stats.timer(tbl, 'index', recno):
+            writer.build_indexes(tablename, indexes)
+            writer.commit()
+
+    if fkeys is not None:
+        with stats.timer(tbl, 'verify', recno):
+            writer.check_references(tablename, fkeys, project_id=project_id)
+            writer.commit()
+    return recno
+
+
+# Queue from the copy_tables pool workers back to the writer, set by _init_worker
+_record_queue = None
+
+
+def _init_worker(record_queue):
+    """Pool initializer, giving each worker the queue back to the writer"""
+    global _record_queue
+    _record_queue = record_queue
+
+
+def read_dbf(filename, tbl: str, fkeys, date_cols, chunk_size, use_dbfread=False, columnar=False):
+    """Pool worker for copy_tables: decode and convert the records of a DBF file
+
+    The DATE fields at positions date_cols are decoded for each chunk (see add_date_columns).
+
+    The records are put on the queue in chunks as ('records', tbl, records, char_errors),
+    or for a columnar writer, with the chunk as the lists of its columns (see
+    record_converter), where char_errors are the records with a character error, as dictionaries. At the end of the
+    file, ('timing', tbl, seconds) gives the time spent decoding, not waiting on the queue, and
+    ('end', tbl, error) marks the end, where error is None, or the error if the file couldn't be read.
+    """
+    start = time.perf_counter()
+    wait_time = 0.0
+    try:
+        dbf = open_dbf(filename, use_dbfread)
+        convert = record_converter(dbf.fields, fkeys, date_cols, columnar)
+
+        def put_chunk(batch, char_errors):
+            """Put a chunk on the queue, returning the seconds spent waiting for room"""
+            if columnar:
+                columns, errors = convert(batch)
+                char_errors = [dict(zip(dbf.field_names, batch[num])) for num in errors]
+                batch = columns
+            else:
+                add_date_columns(batch, date_cols)
+            wait_start = time.perf_counter()
+            _record_queue.put(('records', tbl, batch, char_errors))
+            return time.perf_counter() - wait_start
+
+        batch = []
+        char_errors = []
+        for rec in dbf:
+            if not columnar:
+                rec, char_error = convert(rec)
+                if char_error:
+                    char_errors.append(dict(zip(dbf.field_names, rec)))
+            batch.append(rec)
+            if len(batch) >= chunk_size:
+                wait_time += put_chunk(batch, char_errors)
+                batch = []
+                char_errors = []
+        if batch:
+            wait_time += put_chunk(batch, char_errors)
+        error = None
+    except Exception as err:
+        error = f'{type(err).__name__}: {err}'
+    _record_queue.put(('timing', tbl, time.perf_counter() - start - wait_time))
+    _record_queue.put(('end', tbl, error))
+
+
+def copy_tables(tables, conn, options=None, stats=None, project_id=None):
+    """Copy a list of DBF files into the Database
+
+    Parameters:
+    tables -- list of (filename, tbl, info), in the order to copy them
+    conn -- Database connection to write to, or an output writer (see SqliteWriter)
+    options -- Options for the batch_size, defer_indexes, workers and dbfread to use
+    stats -- ConversionStats to add the time of each phase of each table to
+    project_id -- the project being added to a merged database (see create_table)
+
+    With workers of 1, the tables are copied one at a time by copy_dbf.
+
+    With more than one worker, a process pool decodes and converts the records
+    of all the tables at once, while this process creates the tables and is the
+    only writer to the database. The Foreign Key checks are run in table order,
+    each once its table and the tables it references are complete, so the
+    database ends up the same as when copying one table at a time.
+
+    The decode time of each table is then the time its worker spent reading and
+    converting the records, which overlaps the insert time of the other tables.
+
+    Returns the number of records read.
+    """
+    if options is None:
+        options = Options()
+    if stats is None:
+        stats = ConversionStats(None)
+    batch_size = options.batch_size
+    defer_indexes = options.defer_indexes
+    workers = options.workers
+    writer = as_writer(conn)
+    rows = 0
+    if workers <= 1:
+        for filename, tbl, info in tables:
+            rows += copy_dbf(filename, tbl, writer, info, batch_size, defer_indexes, options.dbfread, stats,
+                             project_id, options)
+            report(options, 'table', tbl)
+        return rows
+
+    # Create all the tables first, in order, so table_map is complete
+    state = {}
+    for filename, tbl, info in tables:
+        if info is None:
+            info = {}
+        LOG.info(f"\n{filename}")
+        LOG.debug(pformat(info))
+        start = time.perf_counter()
+        dbf = open_dbf(filename, options.dbfread)
+        tablename, fkeys, indexes = writer.create_table(dbf, tbl, info, defer_indexes, project_id)
+        stats.add(tbl, 'open', time.perf_counter() - start, bytes_read=dbf_size(dbf))
+        date_cols = date_fields(info, dbf.field_names)
+        refs = set() if fkeys is None else {value[0] for value in fkeys.values()}
+        state[tbl] = {
+            'filename': filename,
+            'tablename': tablename,
+            'fkeys': fkeys,
+            'refs': refs & {t for _f, t, _i in tables},
+            'indexes': indexes,
+            'date_cols': date_cols,
+            'field_names': table_columns(dbf.field_names, date_cols),
+            'sql': writer.insert_sql(tablename, table_columns(dbf.field_names, date_cols), project_id),
+            'records': 0,
+            'total': dbf.header.numrecords,
+        }
+    writer.commit()
+
+    checks = [tbl for _f, tbl, _i in tables if state[tbl]['fkeys'] is not None]
+    done = set()
+    context = multiprocessing.get_context()
+    record_queue = context.Queue(maxsize=4 * workers)
+    with context.Pool(workers, initializer=_init_worker, initargs=(record_queue,)) as pool:
+        results = [pool.apply_async(read_dbf, (filename, tbl, state[tbl]['fkeys'], state[tbl]['date_cols'],
+                                                batch_size or BATCH_SIZE, options.dbfread, writer.columnar))
+                   for filename, tbl, _info in tables]
+        while len(done) < len(tables):
+            try:
+                message = record_queue.get(timeout=0.5)
+            except queue.Empty:
+                report(options, 'wait')
+                for result in results:
+                    if result.ready():
+                        result.get()    # Raise any error from the worker
+                continue
+            kind, tbl = message[:2]
+            table = state[tbl]
+            if kind == 'records':
+                _kind, _tbl, chunk, char_errors = message
+                for rec in char_errors:
+                    LOG.warning(f"Character Error: {pformat(rec)}")
+                count = len(chunk[0]) if writer.columnar else len(chunk)
+                with stats.timer(tbl, 'insert', count):
+                    if writer.columnar:
+                        writer.insert_columns(table['sql'], chunk, table['field_names'], table['records'] + 1)
+                    elif batch_size:
+                        writer.insert_rows(table['sql'], chunk, table['field_names'], table['records'] + 1)
+                    else:
+                        for num, rec in enumerate(chunk, table['records'] + 1):
+                            writer.insert_row(table['sql'], rec, table['field_names'], num)
+                table['records'] += count
+                report(options, 'rows', (tbl, table['records'], table['total']))
+                continue
+            if kind == 'timing':
+                stats.add(tbl, 'decode', message[2], table['records'])
+                continue
+
+            # End of the table
+            error = message[2]
+            if error is not None:
+                print(f"Error reading {table['filename']}: {error}")
+                LOG.error(f"Error reading {table['filename']}: {error}")
+            with stats.timer(tbl, 'insert'):
+                writer.commit()
+            print(table['filename'], table['records'])
+            LOG.info(f"{table['filename']} Records: {table['records']}")
+            if table['indexes']:
+                with stats.timer(tbl, 'index', table['records']):
+                    writer.build_indexes(table['tablename'], table['indexes'])
+                    writer.commit()
+            rows += table['records']
+            done.add(tbl)
+            report(options, 'table', tbl)
+
+            # Run, in table order, the Foreign Key checks that are now ready
+            while checks and checks[0] in done and state[checks[0]]['refs'] <= done:
+                tbl = checks.pop(0)
+                table = state[tbl]
+                with stats.timer(tbl, 'verify', table['records']):
+                    writer.check_references(table['tablename'], table['fkeys'], project_id=project_id)
+                    writer.commit()
+    return rows
+
+
+def file_hash(filename):
+    """Return the SHA-256 of the contents of a file (or archive member)"""
+    digest = hashlib.sha256()
+    with open_stream(filename) as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def dbf_fingerprint(filename, content_hash=False):
+    """Describe the state of a DBF file (and its memo file) to detect changes
+
+    Returns a dictionary of the file sizes and modification times, the record
+    count and last update date from the header, and with content_hash, a hash
+    of the contents of the files.
+    """
+    dbf = open_dbf(filename)
+    size, mtime = file_stat(filename)
+    fingerprint = {
+        'filename': str(filename),
+        'size': size,
+        'mtime': mtime,
+        'memo_size': None,
+        'memo_mtime': None,
+        'records': dbf.header.numrecords,
+        'last_update': None if dbf.date is None else str(dbf.date),
+        'hash': None,
+        'version': Version,
+    }
+    if dbf.memofilename:
+        fingerprint['memo_size'], fingerprint['memo_mtime'] = file_stat(dbf.memofilename)
+    if content_hash:
+        fingerprint['hash'] = file_hash(filename)
+        if dbf.memofilename:
+            fingerprint['hash'] += file_hash(dbf.memofilename)
+    return fingerprint
+
+
+def same_fingerprint(old, new):
+    """Check if a DBF file is unchanged since the old fingerprint was taken
+
+    If both have a content hash, the modification times are ignored.
+    """
+    if old is None:
+        return False
+    if old['hash'] and new['hash']:
+        keys = ('size', 'memo_size', 'records', 'hash', 'version')
+    else:
+        keys = ('size', 'mtime', 'memo_size', 'memo_mtime', 'records', 'last_update', 'version')
+    return all(old[key] == new[key] for key in keys)
+
+
+def make_fingerprints(cursor):
+    """Create the table of fingerprints of the files the tables were copied from"""
+    sql = f'''CREATE TABLE IF NOT EXISTS "{FINGERPRINTS}" (
+    "tbl" TEXT PRIMARY KEY,
+    "table_name" TEXT,
+    "filename" TEXT,
+    "size" INTEGER,
+    "mtime" INTEGER,
+    "memo_size" INTEGER,
+    "memo_mtime" INTEGER,
+    "records" INTEGER,
+    "last_update" TEXT,
+    "hash" TEXT,
+    "version" TEXT
+)'''
+    do_sql(cursor, sql)
+
+
+def read_fingerprints(cursor):
+    """Return the saved fingerprints, as a dictionary by table_info key"""
+    make_fingerprints(cursor)
+    do_sql(cursor, f'SELECT * FROM "{FINGERPRINTS}"')
+    names = [col[0] for col in cursor.description]
+    return {row[0]: dict(zip(names, row)) for row in cursor.fetchall()}
+
+
+def save_fingerprint(cursor, tbl, fingerprint):
+    """Save the fingerprint of the file a table was copied from"""
+    parms = dict(fingerprint, tbl=tbl, table_name=table_map[tbl])
+    do_sql(cursor, f'''INSERT OR REPLACE INTO "{FINGERPRINTS}" VALUES (:tbl, :table_name,
+    :filename, :size, :mtime, :memo_size, :memo_mtime, :records, :last_update, :hash, :version)''', parms)
+
+
+def table_exists(cursor, tablename):
+    """Check if the database has a table"""
+    do_sql(cursor, "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name", {'name': tablename})
+    return cursor.fetchone() is not None
+
+
+def register_project(cursor, projname):
+    """Add a project to the _projects table of a merged database, returning its project_id
+
+    A project already in the database is loaded again under the same project_id,
+    so its records are deleted from all the tables first.
+    """
+    do_sql(cursor, f'''CREATE TABLE IF NOT EXISTS "{PROJECTS}" (
+    "project_id" INTEGER PRIMARY KEY,
+    "project" TEXT UNIQUE,
+    "name" TEXT,
+    "loaded" TEXT,
+    "rows" INTEGER
+)''')
+    project = str(Path(projname).resolve())
+    loaded = datetime.datetime.now().isoformat(timespec='seconds')
+    do_sql(cursor, f'SELECT "project_id" FROM "{PROJECTS}" WHERE "project" = :project', {'project': project})
+    row = cursor.fetchone()
+    if row is None:
+        do_sql(cursor, f'''INSERT INTO "{PROJECTS}" ("project", "name", "loaded")
+    VALUES (:project, :name, :loaded)''', {'project': project, 'name': Path(projname).stem, 'loaded': loaded})
+        return cursor.lastrowid
+
+    project_id = row[0]
+    print(f'Replacing project {project_id}: {project}')
+    LOG.warning(f'Replacing project {project_id}: {project}')
+    delete_search(cursor, project_id)
+    do_sql(cursor, "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB :prefix",
+           {'prefix': MERGED_PREFIX + '*'})
+    for (tablename,) in cursor.fetchall():
+        do_sql(cursor, f'DELETE FROM "{tablename}" WHERE "project_id" = :project_id', {'project_id': project_id})
+    views = tuple(VIEW_PREFIX + view.name for view in READ_VIEWS)
+    for tablename in (MISSING_REFS, REJECTED, VIOLATIONS, LINEAGE) + views:
+        if table_exists(cursor, tablename):
+            do_sql(cursor, f'DELETE FROM "{tablename}" WHERE "project_id" = :project_id', {'project_id': project_id})
+    do_sql(cursor, f'UPDATE "{PROJECTS}" SET "loaded" = :loaded, "rows" = NULL WHERE "project_id" = :project_id',
+           {'loaded': loaded, 'project_id': project_id})
+    return project_id
+
+
+def read_settings(pjc):
+    """Read the settings of a TMG project .pjc file, returning a list of (section, key, value)"""
+    config = configparser.ConfigParser()
+    with open_stream(pjc) as file:
+        config.read_file(io.TextIOWrapper(file), source=str(pjc))
+    return [(section, key, str(config[section][key])) for section in config.sections() for key in config[section]]
+
+
+def project_tables(pjc, files):
+    """Find the DBF files of the tables of a project
+
+    Parameters:
+    pjc -- the project .pjc file
+    files -- dictionary of the upper case names of the files of the project to their locations (see project_files)
+
+    Returns a list of (file, tbl, info) for copy_tables, in table_info order, then the
+    files that aren't in table_info, with an info of None. The missing tables are reported.
+    """
+    length = len(pjc.stem)-1
+    base = pjc.stem[:-1]
+    pat = (base + '*.dbf').upper()
+    tables = []
+    for tbl in table_info.keys():
+        file = files.get((base + tbl + ".dbf").upper())
+        if file is not None:
+            tables.append((file, tbl, table_info[tbl]))
+        else:
+            if not (table_info[tbl].get(OPTIONAL, False)):
+                print("Missing:", base + tbl + ".dbf")
+                LOG.error(f"Missing File {base + tbl + '.dbf'}")
+
+    # Process any unknown file type
+    for fname, file in files.items():
+        if fnmatch(fname, pat):
+            tbl = file.stem[length:].upper()
+            info = table_info.get(tbl, None)
+            if info is None:
+                print("Unknown:", fname)
+                LOG.warning(f"\n{tbl}  {info}")
+                tables.append((file, tbl, info))
+    return tables
+
+
+# The lineage closure
+#
+# The parents of each person, from the FATHER and MOTHER of $ and the
+# relationships in F, are turned into the _lineage table: a row for every
+# ancestor of every person, so "all the ancestors of X" is one index range
+# scan rather than a recursive query.
+
+def make_lineage(cursor, merged=False):
+    """Create the _lineage table, and return its index for finding the ancestors of a person
+
+    The table is WITHOUT ROWID, keyed on (ancestor, descendant), so the descendants
+    of a person are a range of the table itself, and the index on descendant has
+    the other columns (with the key), so the ancestors are a range of the index.
+    In a merged database, the key and index start with the project_id.
+
+    Returns the index to build, as (name, columns), for build_indexes.
+    """
+    project = '"project_id" INTEGER NOT NULL,\n    ' if merged else ''
+    key = '"project_id", ' if merged else ''
+    do_sql(cursor, f'''CREATE TABLE IF NOT EXISTS "{LINEAGE}" (
+    {project}"ancestor" INTEGER NOT NULL,
+    "descendant" INTEGER NOT NULL,
+    "generations" INTEGER NOT NULL,
+    "primary_generations" INTEGER,
+    PRIMARY KEY ({key}"ancestor", "descendant")
+) WITHOUT ROWID''')
+    return f'{LINEAGE}_descendant', ('project_id',) * merged + ('descendant', 'generations', 'primary_generations')
+
+
+def parent_links(cursor, project_id=None):
+    """Read the parent links of the people into compact arrays
+
+    The links are the FATHER and MOTHER of each person in $, which are primary,
+    and the relationships in F, primary if the PRIMARY flag is set. Each person
+    gets a number, in order of PER_NO, and the children of each are stored as
+    in a compressed sparse row matrix.
+
+    Returns (people, starts, children, primary), where people is an array of
+    the PER_NO of each number, and the children of number n are
+    children[starts[n]:starts[n + 1]], with primary[i] set if the link to
+    children[i] is primary.
+    """
+    project = '' if project_id is None else f' AND "project_id" = {int(project_id)}'
+    links = {}      # (parent, child): primary
+    if '$' in table_map:
+        for column in ('FATHER', 'MOTHER'):
+            do_sql(cursor, f'''SELECT "{column}", "PER_NO" FROM "{table_map['$']}"
+    WHERE "{column}" IS NOT NULL AND "PER_NO" IS NOT NULL{project}''')
+            for link in cursor:
+                links[link] = True
+    if 'F' in table_map:
+        do_sql(cursor, f'''SELECT "PARENT", "CHILD", "PRIMARY" FROM "{table_map['F']}"
+    WHERE "PARENT" IS NOT NULL AND "CHILD" IS NOT NULL{project}''')
+        for parent, child, is_primary in cursor:
+            links[parent, child] = links.get((parent, child), False) or bool(is_primary)
+
+    people = array('q', sorted({per_no for link in links for per_no in link}))
+    number = {per_no: num for num, per_no in enumerate(people)}
+    starts = array('l', [0]) * (len(people) + 1)
+    for parent, _child in links:
+        starts[number[parent] + 1] += 1
+    for num in range(len(people)):
+        starts[num + 1] += starts[num]
+    filled = array('l', starts)
+    children = array('l', [0]) * len(links)
+    primary = array('b', [0]) * len(links)
+    for (parent, child), is_primary in links.items():
+        pos = filled[number[parent]]
+        filled[number[parent]] += 1
+        children[pos] = number[child]
+        primary[pos] = is_primary
+    return people, starts, children, primary
+
+
+def lineage_rows(people, starts, children, primary):
+    """Walk down from each person to all their descendants, breadth first
+
+    Yields (ancestor number, list of (ancestor PER_NO, descendant PER_NO,
+    generations, primary generations)), for the ancestors in order, so the
+    rows come in the order of the _lineage key, or near enough. generations is
+    the fewest links from the ancestor down to the descendant, and primary
+    generations the fewest by primary links only, or None if there is no such
+    line. The walk by primary links is only needed if the first walk reached
+    a person with a child by a link that isn't primary. A person who is
+    their own ancestor (a loop in the links) isn't included.
+    """
+    count = len(people)
+    seen = array('l', [-1]) * count       # The ancestor each number was last reached from
+    # The people with a child by a link that isn't primary
+    mixed = array('b', [0]) * count
+    for person in range(count):
+        mixed[person] = not all(primary[starts[person]:starts[person + 1]])
+    for ancestor in range(count):
+        seen[ancestor] = ancestor
+        levels = []         # The descendants of each generation
+        frontier = [ancestor]
+        all_primary = True
+        while frontier:
+            following = []
+            for person in frontier:
+                if mixed[person]:
+                    all_primary = False
+                for child in children[starts[person]:starts[person + 1]]:
+                    if seen[child] != ancestor:
+                        seen[child] = ancestor
+                        following.append(child)
+            if following:
+                levels.append(following)
+            frontier = following
+        if not levels:
+            continue
+        per_no = people[ancestor]
+        if all_primary:
+            yield ancestor, [(per_no, people[child], generation, generation)
+                             for generation, level in enumerate(levels, 1) for child in level]
+            continue
+        # Walk again by the primary links only
+        primary_generations = {ancestor: 0}
+        frontier = [ancestor]
+        generation = 0
+        while frontier:
+            generation += 1
+            following = []
+            for person in frontier:
+                for pos in range(starts[person], starts[person + 1]):
+                    child = children[pos]
+                    if primary[pos] and child not in primary_generations:
+                        primary_generations[child] = generation
+                        following.append(child)
+            frontier = following
+        yield ancestor, [(per_no, people[child], generation, primary_generations.get(child))
+                         for generation, level in enumerate(levels, 1) for child in level]
+
+
+def build_lineage(conn, options=None, stats=None, project_id=None):
+    """Make the _lineage table of every ancestor of every person in the project
+
+    Parameters:
+    conn -- the database connection, with the $ and F tables loaded (see tmg2db)
+    options -- Options for the progress reports and cancel event
+    stats -- ConversionStats that gets a lineage phase
+    project_id -- the project in a merged database, None for a database of one project
+
+    The links are read into arrays (see parent_links) and walked in memory
+    (see lineage_rows), and the rows, already in key order, are inserted
+    batch_size at a time, and the index on descendant is built after them.
+    Each row has the PER_NO of the ancestor and the
+    descendant, the generations between them, and the generations by the
+    primary parents only (None if they are only related through other
+    relationships, like an adoption that isn't primary).
+
+    Returns the number of rows.
+    """
+    if options is None:
+        options = Options()
+    start = time.perf_counter()
+    cursor = conn.cursor()
+    if project_id is None:
+        do_sql(cursor, f'DROP TABLE IF EXISTS "{LINEAGE}"')
+        indexes = [make_lineage(cursor) + (False,)]
+        sql = f'INSERT INTO "{LINEAGE}" VALUES (?, ?, ?, ?)'
+    else:
+        # As for the other tables of a merged database, the index is kept up to date
+        new = not table_exists(cursor, LINEAGE)
+        indexes = [make_lineage(cursor, merged=True) + (False,)] if new else []
+        do_sql(cursor, f'DELETE FROM "{LINEAGE}" WHERE "project_id" = :project_id', {'project_id': project_id})
+        sql = f'INSERT INTO "{LINEAGE}" VALUES ({int(project_id)}, ?, ?, ?, ?)'
+    people, starts, children, primary = parent_links(cursor, project_id)
+    batch_size = options.batch_size or BATCH_SIZE
+    rows = 0
+    batch = []
+    for ancestor, descendants in lineage_rows(people, starts, children, primary):
+        batch += descendants
+        if len(batch) >= batch_size:
+            cursor.executemany(sql, batch)
+            rows += len(batch)
+            batch = []
+            report(options, 'rows', (LINEAGE, ancestor, len(people)))
+    cursor.executemany(sql, batch)
+    rows += len(batch)
+    build_indexes(cursor, LINEAGE, indexes)
+    conn.commit()
+    if stats is not None:
+        stats.add(None, 'lineage', time.perf_counter() - start, rows)
+    print(f'Lineage: {rows} ancestors of {len(people)} people')
+    LOG.info(f'Lineage: {rows} ancestors of {len(people)} people: {time.perf_counter() - start:.3f} sec')
+    return rows
+
+
+# Full-text search
+#
+# The SEARCH columns of a table get an FTS5 index, named for the table_info key
+# (see SEARCH_PREFIX). It is an external content index, so the text is only
+# kept in the table itself, and the Primary Key (and person) columns are
+# UNINDEXED columns of it, read from the table, to give the records found.
+
+# The FTS5 tokenizer, which ignores accents, and the prefix lengths indexed, for quick prefix searches
+SEARCH_TOKENIZE = 'unicode61 remove_diacritics 2'
+SEARCH_PREFIXES = '2 3'
+
+# A result of search: the table_info key of the table, the Primary Key of the record,
+# the PER_NO of the person it is of (if it has one), the project_id in a merged database,
+# and the rank (bm25, lower is better, 0 for a match by Soundex only)
+SearchHit = namedtuple('SearchHit', 'tbl key person project_id rank')
+
+# The tables of name and place parts, with their SDX Soundex codes, to the table linking the
+# parts to their records and the table of the records, for a phonetic search (see search)
+PHONETIC_PARTS = {
+    'ND': ('NPV', 'N'),
+    'PD': ('PPV', 'P'),
+}
+
+
+def search_person(info):
+    """Return the column of the person a record of the table is of, the first Foreign Key to a person, or None"""
+    for col, ref in info.get(FOREIGN, {}).items():
+        if ref == PERSON:
+            return col
+    return None
+
+
+def search_columns(info, project_id=None):
+    """Return (UNINDEXED columns, SEARCH columns) of the full-text index of a table
+
+    The UNINDEXED columns are the project_id in a merged database, the Primary
+    Key and the person (see search_person).
+    """
+    key = info[PRIMARY]
+    person = search_person(info)
+    unindexed = (('project_id',) if project_id is not None else ()) + (key,) + ((person,) if person else ())
+    return list(unindexed), list(info[SEARCH])
+
+
+def drop_search(cursor):
+    """Drop the full-text indexes, which would be out of date"""
+    for tbl, info in table_info.items():
+        if SEARCH in info:
+            do_sql(cursor, f'DROP TABLE IF EXISTS "{SEARCH_PREFIX}{tbl}"')
+
+
+def delete_search(cursor, project_id):
+    """Take the records of a project out of the full-text indexes of a merged database
+
+    Run before its records are deleted (see register_project), as an external
+    content index needs the values it indexed to remove a record.
+    """
+    for tbl, info in table_info.items():
+        name = SEARCH_PREFIX + tbl
+        if SEARCH not in info or not table_exists(cursor, name):
+            continue
+        unindexed, searched = search_columns(info, project_id)
+        cols = ', '.join(f'"{col}"' for col in unindexed + searched)
+        do_sql(cursor, f'''INSERT INTO "{name}"("{name}", rowid, {cols})
+    SELECT 'delete', rowid, {cols} FROM "{MERGED_PREFIX}{tbl}" WHERE "project_id" = :project_id''',
+               {'project_id': project_id})
+
+
+def build_search(conn, options=None, stats=None, project_id=None, create=True):
+    """Make the full-text indexes of the tables with SEARCH columns
+
+    Parameters:
+    conn -- the database connection, with the tables loaded (see tmg2db)
+    options -- Options for the cancel event
+    stats -- ConversionStats that gets a search phase for each table
+    project_id -- the project in a merged database, None for a database of one project
+    create -- make the indexes that aren't there, otherwise only add to those of a merged database
+
+    In a database of one project, each index is made again, and filled in one
+    go with the FTS5 'rebuild' command, which reads the whole table. In a
+    merged database, only the records of the project are added to an index
+    that is there (a project being replaced was taken out by delete_search),
+    leaving those of the other projects as they are, and a new index is
+    rebuilt over all the projects. Tables that the project doesn't have, or
+    that don't have all the SEARCH columns, are left out.
+    """
+    cursor = conn.cursor()
+    if project_id is None:
+        drop_search(cursor)
+    for tbl, info in table_info.items():
+        if SEARCH not in info or tbl not in table_map:
+            continue
+        name = SEARCH_PREFIX + tbl
+        exists = project_id is not None and table_exists(cursor, name)
+        if not (exists or create):
+            continue
+        report(options or Options(), 'wait')
+        tablename = table_map[tbl]
+        do_sql(cursor, f'PRAGMA table_info("{tablename}")')
+        columns = {row[1] for row in cursor.fetchall()}
+        if not set(info[SEARCH]) <= columns:
+            LOG.warning(f'No full-text index of {tablename}, missing {sorted(set(info[SEARCH]) - columns)}')
+            continue
+        start = time.perf_counter()
+        unindexed, searched = search_columns(info, project_id)
+        if exists:
+            cols = ', '.join(f'"{col}"' for col in unindexed + searched)
+            do_sql(cursor, f'''INSERT INTO "{name}"(rowid, {cols})
+    SELECT rowid, {cols} FROM "{tablename}" WHERE "project_id" = :project_id''', {'project_id': project_id})
+        else:
+            do_sql(cursor, f'''CREATE VIRTUAL TABLE "{name}" USING fts5(
+    {', '.join([f'"{col}" UNINDEXED' for col in unindexed] + [f'"{col}"' for col in searched])},
+    content='{tablename}', content_rowid='rowid',
+    tokenize='{SEARCH_TOKENIZE}', prefix='{SEARCH_PREFIXES}'
+)''')
+            do_sql(cursor, f'''INSERT INTO "{name}"("{name}") VALUES ('rebuild')''')
+        conn.commit()
+        if stats is not None:
+            stats.add(tbl, 'search', time.perf_counter() - start)
+        LOG.info(f'Full-text index {name}: {time.perf_counter() - start:.3f} sec')
+
+
+# Soundex codes of the letters, as kept in the SDX columns of ND and PD
+SOUNDEX_CODES = {letter: str(code) for code, letters in enumerate(
+    ('AEIOUY', 'BFPV', 'CGJKQSXZ', 'DT', 'L', 'MN', 'R')) for letter in letters}
+
+
+def soundex(word):
+    """Return the American Soundex code of a word (a letter and three digits), or '' if it has no letters"""
+    letters = [char for char in word.upper() if 'A' <= char <= 'Z']
+    if not letters:
+        return ''
+    code = letters[0]
+    last = SOUNDEX_CODES.get(letters[0])
+    for char in letters[1:]:
+        digit = SOUNDEX_CODES.get(char)     # H and W are None, and don't separate letters of the same code
+        if digit is None:
+            continue
+        if digit != last and digit != '0':
+            code += digit
+        last = digit
+    return (code + '000')[:4]
+
+
+def related_table(content, tbl, other):
+    """Return the name of the table other (a table_info key) in the database of content
+
+    content is the name of the table of the key tbl, as a full-text index gives it: the
+    project's name and the key in lower case, or in a merged database, MERGED_PREFIX and the key.
+    """
+    prefix = content[:len(content) - len(tbl)]
+    return prefix + (other if content.endswith(tbl) else other.lower())
+
+
+def search(conn, text, tables=None, limit=50, phonetic=False, project_id=None):
+    """Search the full-text indexes of a converted database (see build_search)
+
+    Parameters:
+    conn -- connection to the database
+    text -- the words to find, each as the start of a word (so 'Bro' finds Brown)
+    tables -- table_info keys of the tables to search, None for all those with an index
+    limit -- the most results to give from each table
+    phonetic -- also find the names (N) and places (P) with a part (in ND or PD, through
+                NPV or PPV) whose SDX Soundex code is that of one of the words
+    project_id -- in a merged database, only find the records of this project
+
+    Returns a list of SearchHit, the best first.
+    """
+    words = [word for word in text.split() if word.strip('"')]
+    if not words:
+        return []
+    query = ' '.join('"' + word.replace('"', '""') + '"*' for word in words)
+    cursor = conn.cursor()
+    do_sql(cursor, "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name GLOB :prefix",
+           {'prefix': SEARCH_PREFIX + '*'})
+    # The content table of each index, which names the tables of the database
+    contents = {}
+    for name, sql in cursor.fetchall():
+        match = re.search(r"content='([^']+)'", sql or '')
+        if match:
+            contents[name] = match.group(1)
+    merged = table_exists(cursor, PROJECTS)
+    project = '' if project_id is None else ' AND "project_id" = :project_id'
+    hits = {}
+    for tbl, info in table_info.items():
+        name = SEARCH_PREFIX + tbl
+        if name not in contents or (tables is not None and tbl not in tables):
+            continue
+        person = search_person(info)
+        person_col = f'"{person}"' if person else 'NULL'
+        project_col = '"project_id"' if merged else 'NULL'
+        do_sql(cursor, f'''SELECT "{info[PRIMARY]}", {person_col}, {project_col}, rank FROM "{name}"
+    WHERE "{name}" MATCH :query{project} ORDER BY rank LIMIT :limit''',
+               {'query': query, 'project_id': project_id, 'limit': limit})
+        for key, per_no, project_of, rank in cursor.fetchall():
+            hits[tbl, key, project_of] = SearchHit(tbl, key, per_no, project_of, rank)
+        if phonetic and tbl in PHONETIC_PARTS:
+            codes = sorted({soundex(word) for word in words} - {''})
+            parts_tbl, records_tbl = PHONETIC_PARTS[tbl]
+            parts = related_table(contents[name], tbl, parts_tbl)
+            records = related_table(contents[name], tbl, records_tbl)
+            if not codes or not (table_exists(cursor, parts) and table_exists(cursor, records)):
+                continue
+            person = search_person(table_info[records_tbl])
+            person_col = f'r."{person}"' if person else 'NULL'
+            project_col = 'r."project_id"' if merged else 'NULL'
+            joins = (f'JOIN "{parts}" AS v ON v."UID" = d."UID"\n    '
+                     f'JOIN "{records}" AS r ON r."RECNO" = v."RECNO"')
+            if merged:
+                joins = (f'JOIN "{parts}" AS v ON v."project_id" = d."project_id" AND v."UID" = d."UID"\n    '
+                         f'JOIN "{records}" AS r ON r."project_id" = v."project_id" AND r."RECNO" = v."RECNO"')
+            parms = {f'sdx{num}': code for num, code in enumerate(codes)}
+            marks = ', '.join(':' + parm for parm in parms)
+            parms.update({'project_id': project_id, 'limit': limit})
+            where = '' if project_id is None else ' AND d."project_id" = :project_id'
+            do_sql(cursor, f'''SELECT DISTINCT r."{table_info[records_tbl][PRIMARY]}", {person_col}, {project_col}
+    FROM "{contents[name]}" AS d
+    {joins}
+    WHERE d."SDX" IN ({marks}){where} LIMIT :limit''', parms)
+            for key, per_no, project_of in cursor.fetchall():
+                hits.setdefault((records_tbl, key, project_of),
+                                SearchHit(records_tbl, key, per_no, project_of, 0.0))
+    return sorted(hits.values(), key=lambda hit: hit.rank)
+
+
+# Read views
+#
+# Tables of the joins that reports make over and over, so that a lookup is of
+# one indexed table. Each is made by one INSERT ... SELECT over the whole of its
+# tables once they are loaded. As in the integrity rules, the tables are written
+# as {key}, and filled in from table_map (see build_views). The names are the
+# primary names (the lowest RECNO if there is more than one), and a place is
+# its parts from PD, in the order of their TYPE, all made in one pass of PPV. The
+# parts are joined by group_concat as a window function, as only its ORDER BY
+# sets the order they are joined in. The columns of the TMG tables keep their
+# names, the columns made from other tables are in lower case.
+ReadView = namedtuple('ReadView', 'name needs description indexes sql')
+
+READ_VIEWS = (
+    ReadView('person', ('$', 'N', 'ND'), 'A person with their primary name, birth, death and parents',
+             ((('PER_NO',), True), (('surname', 'given'), False), (('FATHER',), False), (('MOTHER',), False)), """
+SELECT p."PER_NO", p."REF_ID", p."SEX", p."LIVING",
+       n."RECNO" AS "name_recno", n."SRNAMEDISP" AS "name", sn."VALUE" AS "surname", gn."VALUE" AS "given",
+       p."PBIRTH", p."PBIRTH_DAYNUM", p."PBIRTH_YEAR", p."PBIRTH_QUAL",
+       p."PDEATH", p."PDEATH_DAYNUM", p."PDEATH_YEAR", p."PDEATH_QUAL",
+       p."FATHER", fn."SRNAMEDISP" AS "father_name", p."MOTHER", mn."SRNAMEDISP" AS "mother_name"
+FROM {$} AS p
+LEFT JOIN {N} AS n ON n."RECNO" = (SELECT min(o."RECNO") FROM {N} AS o WHERE o."NPER" = p."PER_NO" AND o."PRIMARY")
+LEFT JOIN {ND} AS sn ON sn."UID" = n."SURID"
+LEFT JOIN {ND} AS gn ON gn."UID" = n."GIVID"
+LEFT JOIN {N} AS fn ON fn."RECNO" = (SELECT min(o."RECNO") FROM {N} AS o WHERE o."NPER" = p."FATHER" AND o."PRIMARY")
+LEFT JOIN {N} AS mn ON mn."RECNO" = (SELECT min(o."RECNO") FROM {N} AS o WHERE o."NPER" = p."MOTHER" AND o."PRIMARY")"""),
+
+    ReadView('event', ('G', 'T', 'P', 'PPV', 'PD', 'N', 'E'),
+             'An event with its tag type, date, place, principals and number of witnesses',
+             ((('RECNO',), True), (('PER1',), False), (('PER2',), False), (('ETYPE',), False),
+              (('PLACENUM',), False)), """
+SELECT g."RECNO", g."ETYPE", t."ETYPENAME" AS "type_name", t."GEDCOM_TAG" AS "gedcom_tag",
+       g."EDATE", g."EDATE_DAYNUM", g."EDATE_YEAR", g."EDATE_QUAL", g."SRTDATE",
+       g."PLACENUM", pn."place", pl."SHORTPLACE" AS "short_place",
+       g."PER1", n1."SRNAMEDISP" AS "per1_name", g."PER2", n2."SRNAMEDISP" AS "per2_name",
+       (SELECT count(*) FROM {E} AS e WHERE e."GNUM" = g."RECNO") AS "witnesses"
+FROM {G} AS g
+LEFT JOIN {T} AS t ON t."ETYPENUM" = g."ETYPE"
+LEFT JOIN {P} AS pl ON pl."RECNO" = g."PLACENUM"
+LEFT JOIN (SELECT DISTINCT v."RECNO", group_concat(d."VALUE", ', ') OVER (PARTITION BY v."RECNO" ORDER BY v."TYPE"
+               ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS "place"
+           FROM {PPV} AS v JOIN {PD} AS d ON d."UID" = v."UID"
+           WHERE d."VALUE" <> '') AS pn ON pn."RECNO" = g."PLACENUM"
+LEFT JOIN {N} AS n1 ON n1."RECNO" = (SELECT min(o."RECNO") FROM {N} AS o WHERE o."NPER" = g."PER1" AND o."PRIMARY")
+LEFT JOIN {N} AS n2 ON n2."RECNO" = (SELECT min(o."RECNO") FROM {N} AS o WHERE o."NPER" = g."PER2" AND o."PRIMARY")"""),
+
+    ReadView('citation', ('S', 'M', 'W', 'R'), 'A citation with its source and (primary) repository',
+             ((('RECNO',), True), (('STYPE', 'REFREC'), False), (('MAJSOURCE',), False)), """
+SELECT s."RECNO", s."STYPE", s."REFREC", s."SUBSOURCE", s."CITREF",
+       s."MAJSOURCE", m."TITLE" AS "source_title", m."ABBREV" AS "source_abbrev", m."REF_ID" AS "source_ref_id",
+       r."RECNO" AS "repository", r."NAME" AS "repository_name"
+FROM {S} AS s
+LEFT JOIN {M} AS m ON m."MAJNUM" = s."MAJSOURCE"
+LEFT JOIN {R} AS r ON r."RECNO" = (SELECT w."RNUMBER" FROM {W} AS w WHERE w."MNUMBER" = s."MAJSOURCE"
+                                   ORDER BY w."PRIMARY" DESC, w."RNUMBER" LIMIT 1)"""),
+)
+
+
+def drop_views(cursor):
+    """Drop the read view tables, which would be out of date"""
+    for view in READ_VIEWS:
+        do_sql(cursor, f'DROP TABLE IF EXISTS "{VIEW_PREFIX}{view.name}"')
+
+
+def build_views(conn, options=None, stats=None, project_id=None, views=READ_VIEWS):
+    """Make the read view tables, each from one INSERT ... SELECT
+
+    Parameters:
+    conn -- the database connection, with the tables loaded (see tmg2db)
+    options -- Options for the cancel event
+    stats -- ConversionStats that gets a view phase for each table
+    project_id -- the project in a merged database, None for a database of one project
+    views -- the ReadViews to make, defaults to READ_VIEWS
+
+    The table of a view is created from the columns of its SELECT, filled,
+    and then indexed. In a merged database, the {key} tables are the records
+    of the project, the table starts with the project_id, and the project's
+    rows are replaced, with the indexes (which start with the project_id) kept
+    up to date. Views needing a table that isn't in table_map are skipped.
+
+    Returns a dictionary of view name: number of rows
+    """
+    cursor = conn.cursor()
+    counts = {}
+    for view in views:
+        tablename = VIEW_PREFIX + view.name
+        if not all(key in table_map for key in view.needs):
+            LOG.warning(f'No {tablename}, missing {[key for key in view.needs if key not in table_map]}')
+            if project_id is None:
+                do_sql(cursor, f'DROP TABLE IF EXISTS "{tablename}"')
+            continue
+        report(options or Options(), 'wait')
+        start = time.perf_counter()
+        if project_id is None:
+            select = view.sql.format_map({key: f'"{table_map[key]}"' for key in view.needs})
+            do_sql(cursor, f'DROP TABLE IF EXISTS "{tablename}"')
+            do_sql(cursor, f'CREATE TABLE "{tablename}" AS SELECT * FROM ({select}) LIMIT 0')
+            indexes = [(f'{tablename}_{"_".join(columns)}', columns, unique) for columns, unique in view.indexes]
+        else:
+            project = f'"project_id" = {int(project_id)}'
+            select = view.sql.format_map({key: f'(SELECT * FROM "{table_map[key]}" WHERE {project})' for key in view.needs})
+            select = f'SELECT {int(project_id)} AS "project_id", * FROM ({select})'
+            indexes = []
+            if not table_exists(cursor, tablename):
+                do_sql(cursor, f'CREATE TABLE "{tablename}" AS {select} LIMIT 0')
+                indexes = [(f'{tablename}_{"_".join(columns)}', ('project_id',) + columns, unique)
+                           for columns, unique in view.indexes]
+            do_sql(cursor, f'DELETE FROM "{tablename}" WHERE "project_id" = :project_id', {'project_id': project_id})
+        do_sql(cursor, f'INSERT INTO "{tablename}" {select}')
+        counts[view.name] = cursor.rowcount
+        build_indexes(cursor, tablename, indexes)
+        conn.commit()
+        if stats is not None:
+            stats.add(tablename, 'view', time.perf_counter() - start, counts[view.name])
+        LOG.info(f'View {tablename}: {counts[view.name]} rows: {time.perf_counter() - start:.3f} sec')
+    return counts
+
+
+def tmg2db(projname, conn, options=None, stats=None):
+    """ Convert a TMG Project to a SQL Database
+
+    Parameters:
+    projname -- path/name of the TMG .pjc file, or of a .SQZ backup of the project
+    conn -- Database connection to use to write the database
+    options -- Options for the conversion (see Options), defaults to Options()
+    stats -- ConversionStats for the run, saved to the _conversion_stats table at the end
+
+    The files of a .SQZ are read straight from the archive (see project_files).
+    The tables are copied by copy_tables. With defer_indexes, ANALYZE is run
+    at the end. With content_hash, the fingerprints include a hash of the
+    file contents.
+
+    A fingerprint of each file copied is saved in the _fingerprints table.
+    With incremental, the tables whose files still match their fingerprint
+    are kept as they are, and only the Foreign Keys that refer to the tables
+    that were copied again are checked.
+
+    With merge, the project is added to a database shared with other projects:
+    it gets a project_id in the _projects table, and its records are added to
+    tables named for the table_info keys (see create_table), leaving the
+    records of the other projects as they are. The .pjc settings go in the
+    tmg_pjc table. Fingerprints aren't kept, and ANALYZE only samples the indexes.
+
+    With lineage, the _lineage table is made once the tables are copied (see
+    build_lineage). Without it, any _lineage table is dropped (or in a merged
+    database, the project's rows deleted), as it would be out of date.
+    Likewise with fts, the full-text indexes are made (see build_search), or
+    without it, dropped, except that in a merged database, the indexes there
+    are kept, and the project added to them. With views, the read view tables
+    are made (see build_views).
+
+    Returns the number of records read.
+    """
+
+    if options is None:
+        options = Options()
+    if stats is None:
+        stats = ConversionStats(projname)
+    incremental = options.incremental and not options.merge
+    table_map.clear()
+
+    pjc, files = project_files(projname)
+    LOG.debug(pjc)
+    cursor = conn.cursor()
+    conn.row_factory = sqlite3.Row
+    if options.merge:
+        project_id = register_project(cursor, projname)
+        make_missing_refs(cursor, merged=True)
+        make_rejected_rows(cursor, merged=True)
+        fingerprints = {}
+        tablename = MERGED_PREFIX + 'pjc'
+        sql = f'''CREATE TABLE IF NOT EXISTS "{tablename}"
+    ("project_id" INTEGER, "section" 'TEXT', "key" 'TEXT', "value" 'TEXT')'''
+        do_sql(cursor, sql)
+        do_sql(cursor, f'DELETE FROM "{tablename}" WHERE "project_id" = {project_id}')
+        sql = f'''INSERT INTO "{tablename}" VALUES ({project_id}, :section, :key, :value)'''
+    else:
+        project_id = None
+        if not incremental:
+            do_sql(cursor, f'DROP TABLE IF EXISTS "{MISSING_REFS}"')
+            do_sql(cursor, f'DROP TABLE IF EXISTS "{REJECTED}"')
+        # The violations are of the old records, so go even when incremental
+        do_sql(cursor, f'DROP TABLE IF EXISTS "{VIOLATIONS}"')
+        make_missing_refs(cursor)
+        make_rejected_rows(cursor)
+        fingerprints = read_fingerprints(cursor)
+        tablename = pjc.stem + 'pjc'
+        do_sql(cursor, 'DROP TABLE IF EXISTS %s' % tablename)
+        sql = '''CREATE TABLE "%s" ("section" 'TEXT', "key" 'TEXT', "value" 'TEXT')''' % (tablename,)
+        do_sql(cursor, sql)
+        sql = '''INSERT INTO "%s" VALUES (:section, :key, :value)''' % (tablename,)
+    for section, key, value in read_settings(pjc):
+        do_sql(cursor, sql, {"section": section, "key": key, "value": value})
+    conn.commit()
+
+    tables = project_tables(pjc, files)
+
+    # Find the tables that need to be copied
+    changed = []
+    new_fingerprints = {}
+    for file, tbl, info in tables:
+        if options.merge:
+            changed.append((file, tbl, info))
+            continue
+        fingerprint = dbf_fingerprint(file, options.content_hash)
+        old = fingerprints.get(tbl)
+        if incremental and same_fingerprint(old, fingerprint) and table_exists(cursor, old['table_name']):
+            LOG.info(f'Unchanged: {file}')
+            table_map[tbl] = old['table_name']
+        else:
+            changed.append((file, tbl, info))
+            new_fingerprints[tbl] = fingerprint
+    if incremental:
+        print(f'Changed Tables: {len(changed)} of {len(tables)}')
+        LOG.warning(f'Changed Tables: {len(changed)} of {len(tables)}')
+
+    rows = copy_tables(changed, conn, options, stats, project_id)
+    if options.merge:
+        do_sql(cursor, f'UPDATE "{PROJECTS}" SET "rows" = :rows WHERE "project_id" = :project_id',
+               {'rows': rows, 'project_id': project_id})
+
+    for tbl, fingerprint in new_fingerprints.items():
+        save_fingerprint(cursor, tbl, fingerprint)
+    conn.commit()
+
+    # Recheck the references from the unchanged tables to the changed ones
+    if incremental:
+        for file, tbl, info in tables:
+            if tbl not in new_fingerprints and info is not None and info.get(FOREIGN) is not None:
+                columns = [col for col, ref in info[FOREIGN].items() if ref[0] in new_fingerprints]
+                if columns:
+                    with stats.timer(tbl, 'verify'):
+                        check_references(cursor, table_map[tbl], info[FOREIGN], columns)
+        conn.commit()
+
+    if options.lineage:
+        build_lineage(conn, options, stats, project_id)
+    elif project_id is None:
+        do_sql(cursor, f'DROP TABLE IF EXISTS "{LINEAGE}"')
+    if project_id is not None:
+        # Keep any indexes up to date, as the records of the other projects stay in them
+        build_search(conn, options, stats, project_id, create=options.fts)
+    elif options.fts:
+        build_search(conn, options, stats)
+    else:
+        drop_search(cursor)
+    if options.views:
+        build_views(conn, options, stats, project_id)
+    elif project_id is None:
+        drop_views(cursor)
+
+    if (options.defer_indexes or options.merge) and changed:
+        # Give the query planner statistics on the new indexes
+        start = time.perf_counter()
+        if options.merge:
+            # Sample the indexes, rather than reading the whole of a large database
+            do_sql(cursor, 'PRAGMA analysis_limit = 1000')
+        do_sql(cursor, 'ANALYZE')
+        conn.commit()
+        stats.add(None, 'analyze', time.perf_counter() - start)
+        LOG.info(f'ANALYZE: {time.perf_counter() - start:.3f} sec')
+
+    stats.save(cursor)
+    conn.commit()
+    return rows
+
+
+def output_path(path, output=None, suffix='.sqlite'):
+    """Return the path of the database (or script) to write a project to
+
+    Parameters:
+    path -- Path of the TMG project .pjc file
+    output -- None for next to the project, a directory to put it in, or the database file
+    suffix -- the suffix of the file, when it is named after the project
+    """
+    if output is None:
+        return path.with_suffix(suffix)
+    output = Path(output)
+    if output.is_dir():
+        return output / path.with_suffix(suffix).name
+    return output
+
+
+def remove_output(path):
+    """Remove an output file, or directory of Parquet files, if it is there"""
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+@contextmanager
+def partial_output(target):
+    """Give the path to write an output to, which is renamed to target when it is complete
+
+    The output is written next to target, with .partial added to its name. When
+    the block finishes, it replaces target. If the block fails, or the conversion
+    is cancelled, it is removed instead, so a half written output is never left
+    behind. A database that is added to is updated in place instead (see update_database).
+    """
+    partial = target.with_name(target.name + '.partial')
+    journal = partial.with_name(partial.name + '-journal')
+    remove_output(partial)
+    remove_output(journal)
+    try:
+        yield partial
+    except BaseException:
+        remove_output(partial)
+        remove_output(journal)
+        raise
+    if target.is_dir():
+        shutil.rmtree(target)
+    os.replace(partial, target)
+
+
+def project_size(pjc, files):
+    """Return the bytes in the files of a project (not counting the other projects in its directory)"""
+    base = pjc.stem[:-1].upper()
+    return sum(file_stat(location)[0] for name, location in files.items() if name.startswith(base))
+
+
+def stage_database(size):
+    """Open the database to build a new database in, when staging (see tmg2sqlite)
+
+    Parameters:
+    size -- the expected bytes of the database
+
+    The database is in memory, unless size is over STAGE_MEMORY_LIMIT, when it
+    is a temporary file. Only new databases are staged, as an incremental or
+    merged conversion would have to load the whole existing database.
+
+    Returns (connection, the temporary file or None)
+    """
+    temp = None
+    if size > STAGE_MEMORY_LIMIT:
+        handle, temp = tempfile.mkstemp(suffix='.sqlite', prefix='TMG2SQL-')
+        os.close(handle)
+        temp = Path(temp)
+        LOG.info(f'Staging in {temp}')
+    conn = sqlite3.connect(':memory:' if temp is None else str(temp))
+    return conn, temp
+
+
+def publish_database(conn, target, options, stats=None):
+    """Write a staged database to the target file, which mustn't exist
+
+    The pages are copied with the backup API, BACKUP_PAGES at a time, sending
+    'publish' progress reports (see report), or with vacuum, written with
+    VACUUM INTO, which leaves out the free pages and defragments the tables.
+    """
+    start = time.perf_counter()
+    if options.vacuum:
+        do_sql(conn.cursor(), 'VACUUM INTO :target', {'target': str(target)})
+    else:
+        def progress(_status, remaining, total):
+            report(options, 'publish', (total - remaining, total))
+
+        dest = sqlite3.connect(str(target))
+        try:
+            conn.backup(dest, pages=BACKUP_PAGES, progress=progress)
+        finally:
+            dest.close()
+    if stats is not None:
+        stats.add(None, 'publish', time.perf_counter() - start)
+    LOG.info(f'Published {target}: {time.perf_counter() - start:.3f} sec')
+
+
+class UpdateConnection(sqlite3.Connection):
+    """A SQLite connection whose commits are held while hold is set (see update_database)
+
+    tmg2db commits after each step, which suits a new database. An update of an
+    existing database is one transaction, so commit() does nothing until it is done.
+    """
+    hold = False
+
+    def commit(self):
+        if not self.hold:
+            super().commit()
+
+
+def update_database(projname, sdb, options, stats):
+    """Convert a project into an existing database in place, in one transaction
+
+    For incremental and merged conversions, which leave most of the database as
+    it is. tmg2db runs inside a transaction that is only committed when it is
+    done, so an error or cancelling (see Options.cancel) rolls the database back
+    to how it was. When bulk loading, the UPDATE_PRAGMAS settings keep the
+    journal on disk, so even a conversion that is killed is rolled back the
+    next time the database is opened.
+
+    Returns the number of records read.
+    """
+    conn = sqlite3.connect(str(sdb), factory=UpdateConnection, isolation_level=None)
+    try:
+        cursor = conn.cursor()
+        do_sql(cursor, 'PRAGMA foreign_keys = OFF')     # While we are processing ignore Foreign Key Errors
+        if options.batch_size:
+            set_pragmas(conn, UPDATE_PRAGMAS)
+        do_sql(cursor, 'BEGIN')
+        conn.hold = True
+        try:
+            rows = tmg2db(projname, conn, options, stats)
+        except BaseException:
+            conn.hold = False
+            conn.rollback()
+            LOG.warning(f'Rolled back {sdb}')
+            raise
+        conn.hold = False
+        conn.commit()
+        if options.batch_size:
+            set_pragmas(conn, SAFE_PRAGMAS)
+    finally:
+        conn.close()
+    return rows
+
+
+def tmg2sqlite(projname, options=None):
+    """Convert a TMG Project to Sqlite.
+
+    Parameters:
+    projname -- path to the TMG project .pjc file, or a .SQZ backup of the project
+    options -- Options for the conversion (see Options), defaults to Options()
+
+    When bulk loading (a batch_size other than 0), the database uses the BULK_PRAGMAS settings during
+    the conversion, and is returned to the SAFE_PRAGMAS settings when done.
+
+    A new database is written to a .partial file which replaces the database when
+    the conversion is done, so an error or cancelling the conversion (see
+    Options.cancel) leaves the database as it was. With incremental or merge,
+    an existing database is instead updated in place, in one transaction that
+    is rolled back on an error or cancel (see update_database).
+
+    With the stage option, a new database is instead built in memory, or for a
+    large project, a temporary file (see stage_database), then written to the
+    .partial file in one go (see publish_database), so the file is only written
+    to once, and with vacuum, is compacted. It can't be used with incremental or merge.
+
+    With validate, the integrity rules are then run over the finished database,
+    and the records that break them are listed in the _violations table (see
+    validate_database). Their times, like the publish time, are only in the
+    log and the _stats.json file, as the _conversion_stats table is already saved.
+
+    Returns a summary dictionary of project, seconds, rows and errors,
+    or None if the project doesn't exist.
+
+    The time of each phase of each table is saved in the _conversion_stats table
+    (see ConversionStats), and with stats_json, in a _stats.json file next to the database.
+
+    Creates a Sqlite database by the same name as the project with a '.Sqlite' extension,
+    or as given by the output option (see output_path)
+    Tables within the database have names matching the names of the .dbf files
+    reads the .dbf files with DbfReader, or https://github.com/olemb/dbfread/ as a fallback
+    """
+
+    if options is None:
+        options = Options()
+    if options.log_level is not None:
+        LOG.setLevel(options.log_level)
+    report(options, 'project', projname)
+    start = time.perf_counter()
+    path = Path(projname)
+    path.resolve()
+    print(projname)
+    if not path.exists():
+        print(f"File {projname} Doesn't Exist")
+        return
+    if options.merge and (options.output is None or Path(options.output).is_dir()):
+        print("Merging projects needs an output database file")
+        LOG.error("Merging projects needs an output database file")
+        return
+    if options.stage and (options.incremental or options.merge):
+        print("Staging can't be used with incremental or merged conversions")
+        LOG.error("Staging can't be used with incremental or merged conversions")
+        return
+    sdb = output_path(path, options.output)
+    logfile = path.with_suffix('.log')
+    print(logfile)
+    handler = logging.FileHandler(filename=logfile, mode='w')
+    LOG.addHandler(handler)
+    errors = ErrorCount()
+    LOG.addHandler(errors)
+    # Allow options of other types of output
+    # TMG Seems to only use N fields for integers, and Sqlite will still store floats as floats
+    typemap["N"] = "INTEGER"
+    stats = ConversionStats(projname)
+    try:
+        if (options.incremental or options.merge) and sdb.is_file():
+            rows = update_database(path, sdb, options, stats)
+            if options.validate:
+                validate_database(sdb, options, stats, path if options.merge else None)
+        else:
+            with partial_output(sdb) as partial:
+                temp = None
+                if options.stage:
+                    pjc, files = project_files(path)
+                    conn, temp = stage_database(project_size(pjc, files))
+                else:
+                    conn = sqlite3.connect(str(partial))
+                cursor = conn.cursor()
+                do_sql(cursor, 'PRAGMA foreign_keys = OFF')     # While we are processing ignore Foreign Key Errors
+                try:
+                    if options.batch_size:
+                        set_pragmas(conn, BULK_PRAGMAS)
+                    rows = tmg2db(path, conn, options, stats)
+                    if options.batch_size:
+                        set_pragmas(conn, SAFE_PRAGMAS)
+                    if options.stage:
+                        publish_database(conn, partial, options, stats)
+                finally:
+                    conn.close()
+                    if temp is not None:
+                        temp.unlink()
+                if options.validate:
+                    validate_database(partial, options, stats, path if options.merge else None)
+        if options.stats_json:
+            stats.write_json(sdb.with_name(sdb.stem + '_stats.json'))
+    finally:
+        LOG.removeHandler(handler)
+        LOG.removeHandler(errors)
+        handler.close()
+    return {'project': str(projname), 'seconds': time.perf_counter() - start, 'rows': rows, 'errors': errors.count}
+
+
+@contextmanager
+def open_writer(output_format, target):
+    """Open the writer for a script or Parquet output format, writing to the target file or directory"""
+    if output_format == 'parquet':
+        writer = ParquetWriter(target)
+        yield writer
+        return
+    with open(target, 'w', encoding='utf-8', newline='\n') as file:
+        yield PostgresWriter(file) if output_format == 'postgres' else SqlScriptWriter(file)
+
+
+def tmg2script(projname, options=None):
+    """Convert a TMG Project to a SQL script or Parquet files, rather than a database
+
+    Parameters:
+    projname -- path to the TMG project .pjc file, or a .SQZ backup of the project
+    options -- Options for the conversion (see Options), with the format of 'sql', 'postgres' or 'parquet'
+
+    The 'sql' format is a script for the sqlite3 shell (see SqlScriptWriter),
+    and 'postgres' a script for psql, loading the records with COPY (see
+    PostgresWriter). The 'parquet' format is a directory of a Parquet file for
+    each table (see ParquetWriter), and needs pyarrow. The records are written
+    as they are read, so a project of any size can be written. The output is
+    named as the database would be (see output_path), with a .sql, .pgsql or
+    .parquet suffix, and like a database, is only there once it is complete
+    (see partial_output). The Foreign Keys aren't checked, there are no
+    _missing_refs, _fingerprints or _conversion_stats tables, and projects
+    can't be merged, converted incrementally, validated or given a _lineage
+    table, full-text indexes or read views.
+
+    Returns a summary dictionary of project, seconds, rows and errors,
+    or None if the project doesn't exist.
+    """
+    if options is None:
+        options = Options()
+    if options.log_level is not None:
+        LOG.setLevel(options.log_level)
+    report(options, 'project', projname)
+    start = time.perf_counter()
+    path = Path(projname)
+    print(projname)
+    if not path.exists():
+        print(f"File {projname} Doesn't Exist")
+        return
+    if options.merge or options.incremental or options.validate or options.lineage or options.fts or options.views:
+        print("Only a SQLite database can be merged, converted incrementally, validated "
+              "or given a lineage, full-text index or read views")
+        LOG.error("Only a SQLite database can be merged, converted incrementally, validated "
+                  "or given a lineage, full-text index or read views")
+        return
+    if options.format == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        print("The parquet format needs pyarrow (pip install pyarrow)")
+        LOG.error("The parquet format needs pyarrow (pip install pyarrow)")
+        return
+    script = output_path(path, options.output, OUTPUT_FORMATS[options.format])
+    logfile = path.with_suffix('.log')
+    print(logfile)
+    handler = logging.FileHandler(filename=logfile, mode='w')
+    LOG.addHandler(handler)
+    errors = ErrorCount()
+    LOG.addHandler(errors)
+    typemap["N"] = "INTEGER"    # As for tmg2sqlite
+    table_map.clear()
+    stats = ConversionStats(projname)
+    try:
+        with partial_output(script) as partial, open_writer(options.format, partial) as writer:
+            pjc, files = project_files(path)
+            LOG.debug(pjc)
+            writer.write_settings(pjc.stem + 'pjc', read_settings(pjc))
+            rows = copy_tables(project_tables(pjc, files), writer, options, stats)
+            writer.close()
+        if options.stats_json:
+            stats.write_json(script.with_name(script.stem + '_stats.json'))
+    finally:
+        LOG.removeHandler(handler)
+        LOG.removeHandler(errors)
+        handler.close()
+    return {'project': str(projname), 'seconds': time.perf_counter() - start, 'rows': rows, 'errors': errors.count}
+
+
+def convert_project(projname, options=None):
+    """Convert a TMG Project to the output format of the options, with tmg2sqlite or tmg2script"""
+    if options is not None and options.format != 'sqlite':
+        return tmg2script(projname, options)
+    return tmg2sqlite(projname, options)
+
+
+def find_projects(path: Path, pat: str, recurse=True):
+    """Search Path for all files that match pat, returning a list of their paths"""
+    print("Processing:", path, pat)
+    projects = []
+    for filename in os.listdir(path):
+        fullname = (path / filename).resolve()
+        if filename[0] == '.':
+            # Ignore files and directories beginning with .
+            pass
+        elif os.path.isdir(fullname):
+            print("\nDir: ", filename)
+            LOG.info(f"Dir {filename}")
+            if recurse:
+                projects += find_projects(fullname, pat, recurse)
+        elif fnmatch(filename.upper(), pat):
+            print('File: ', filename)
+            LOG.warning(f"\nFile {filename}")
+            projects.append(path.joinpath(filename))
+    return projects
+
+
+def _init_batch_worker(level):
+    """Initializer for the convert_batch worker processes"""
+    LOG.setLevel(level)
+
+
+def convert_batch(projects, options=None):
+    """Convert a list of TMG projects, several at a time
+
+    Parameters:
+    projects -- list of paths of the TMG project .pjc files
+    options -- Options for the conversions, workers is the number of projects converted at the same time
+
+    With more than one worker, each project is converted by tmg2sqlite in a
+    process of a pool, so has its own table_map and log file. Each project is
+    converted by convert_project, to the format of the options. A single project
+    instead uses the workers to decode its tables, as do merged projects, which
+    are added to the database one at a time. A summary of the time, rows
+    and errors of each project is printed at the end.
+
+    Returns the list of summaries from convert_project.
+    """
+    if options is None:
+        options = Options()
+    summaries = [None] * len(projects)
+    if options.workers <= 1 or len(projects) == 1 or options.merge:
+        for num, projname in enumerate(projects):
+            summaries[num] = convert_project(projname, options)
+    else:
+        # The callback stays in this process, and each project uses one process
+        project_options = copy.copy(options)
+        project_options.workers = 1
+        project_options.progress = None
+        project_options.cancel = None
+        with ProcessPoolExecutor(options.workers, initializer=_init_batch_worker, initargs=(LOG.level,)) as pool:
+            futures = {pool.submit(convert_project, projname, project_options): num
+                       for num, projname in enumerate(projects)}
+            pending = set(futures)
+            while pending:
+                finished, pending = wait(pending, timeout=0.5)
+                try:
+                    report(options, 'wait')
+                except ConversionCancelled:
+                    # The projects being converted finish, but no more are started
+                    for future in pending:
+                        future.cancel()
+                    raise
+                for future in finished:
+                    num = futures[future]
+                    try:
+                        summaries[num] = future.result()
+                    except Exception as err:
+                        print(f'Error converting {projects[num]}: {err}')
+                        LOG.error(f'Error converting {projects[num]}: {err}')
+                        summaries[num] = {'project': str(projects[num]), 'seconds': None, 'rows': 0, 'errors': 1}
+
+    print('')
+    print(f"{'Project':60} {'Seconds':>9} {'Rows':>10} {'Errors':>7}")
+    for summary in summaries:
+        if summary is not None:
+            seconds = '' if summary['seconds'] is None else f"{summary['seconds']:.1f}"
+            print(f"{summary['project']:60} {seconds:>9} {summary['rows']:>10} {summary['errors']:>7}")
+    return summaries
+
+
+def find_file(path: Path, pat: str, options=None):
+    """Search Path for all files that match pat and then process
+
+    Subdirectories are searched if options.recursive is set, and with more
+    than one worker, that many projects are converted at a time.
+    """
+    if options is None:
+        options = Options()
+    projects = find_projects(path, pat, options.recursive)
+    return convert_batch(projects, options)
+
+
+# Milliseconds between the GUI's checks of the progress queue
+POLL_INTERVAL = 100
+
+
+def gui(options):
+    """Run the GUI, with options giving the initial settings
+
+    tkinter is only imported here, so the rest of the module can be used
+    without a display.
+
+    The conversions run on a worker thread, so the window stays responsive.
+    Its progress reports (see report) are put on a queue, which the window
+    checks every POLL_INTERVAL with after(). Cancel sets the cancel event of
+    the Options, which stops the conversion at the end of the chunk being
+    copied, leaving no partial output (see partial_output).
+    """
+    from tkinter import Tk
+    from tkinter import IntVar
+    from tkinter import StringVar
+    from tkinter.filedialog import askopenfilenames
+    from tkinter.filedialog import askdirectory
+    from tkinter.ttk import Checkbutton
+    from tkinter.ttk import Entry
+    from tkinter.ttk import Frame
+    from tkinter.ttk import Button
+    from tkinter.ttk import Label
+    from tkinter.ttk import Radiobutton
+
+    root = Tk()
+    events = queue.Queue()          # Progress reports from the worker thread
+    cancel = threading.Event()
+    worker = None
+    pattern = StringVar(value="*")
+    recursive = IntVar(value=int(options.recursive))
+    bulk_load = IntVar(value=int(options.batch_size > 0))
+    deferred_index = IntVar(value=int(options.defer_indexes))
+    worker_count = IntVar(value=options.workers)
+    only_changed = IntVar(value=int(options.incremental))
+    validate = IntVar(value=int(options.validate))
+    lineage = IntVar(value=int(options.lineage))
+    fts = IntVar(value=int(options.fts))
+    views = IntVar(value=int(options.views))
+    project = StringVar(value="Project")
+    progress_file = StringVar()
+    progress_rows = StringVar()
+    log_level = IntVar(value=-1 if options.log_level is None else options.log_level)
+    batch_size = options.batch_size or BATCH_SIZE
+
+    started = {}    # When each table started, for its rate
+
+    def queue_progress(kind, value):
+        """Put a progress report on the queue for the window, run on the worker thread
+
+        The 'rows' reports get the rate (records per second) and the seconds left
+        for the table added.
+        """
+        if kind == 'project':
+            started.clear()
+        elif kind == 'rows':
+            tbl, done, total = value
+            now = time.perf_counter()
+            start = started.setdefault(tbl, (now, done))
+            rate = (done - start[1]) / (now - start[0]) if now > start[0] else 0.0
+            eta = (total - done) / rate if rate > 0 else None
+            value = (tbl, done, total, rate, eta)
+        events.put((kind, value))
+
+    def show_progress():
+        """Show the progress reports on the queue, until the worker is done"""
+        while True:
+            try:
+                kind, value = events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'project':
+                project.set(value)
+                progress_file.set("")
+                progress_rows.set("")
+            elif kind == 'table':
+                progress_file.set(progress_file.get() + value + " ")
+            elif kind == 'rows':
+                tbl, done, total, rate, eta = value
+                left = '' if eta is None else f', {eta:.0f} sec left'
+                progress_rows.set(f'{tbl}: {done} of {total} records, {rate:.0f} per sec{left}')
+            elif kind == 'publish':
+                done, total = value
+                progress_rows.set(f'Writing the database: {done} of {total} pages')
+            elif kind == 'rule':
+                progress_rows.set(f'Checked {value}')
+            elif kind == 'error':
+                progress_rows.set(value)
+            elif kind == 'done':
+                progress_rows.set(value)
+        if worker is not None and worker.is_alive():
+            root.after(POLL_INTERVAL, show_progress)
+        else:
+            for button in start_buttons:
+                button.state(['!disabled'])
+            cancel_button.state(['disabled'])
+
+    def run(convert, *args):
+        """Run a conversion on the worker thread"""
+        nonlocal worker
+
+        def work():
+            try:
+                convert(*args)
+                events.put(('done', 'Done'))
+            except ConversionCancelled:
+                events.put(('done', 'Cancelled'))
+            except Exception as err:
+                LOG.exception(err)
+                events.put(('done', f'Error: {err}'))
+
+        cancel.clear()
+        for button in start_buttons:
+            button.state(['disabled'])
+        cancel_button.state(['!disabled'])
+        worker = threading.Thread(target=work, name='TMG2SQL conversion')
+        worker.start()
+        root.after(POLL_INTERVAL, show_progress)
+
+    def quit_gui():
+        """Close the window, stopping any conversion (at the end of its chunk)"""
+        cancel.set()
+        root.destroy()
+
+    def get_options():
+        """Make the Options from the controls"""
+        level = log_level.get()
+        return Options(batch_size=batch_size if bulk_load.get() else 0,
+                       defer_indexes=deferred_index.get() > 0,
+                       workers=worker_count.get(),
+                       incremental=only_changed.get() > 0,
+                       content_hash=options.content_hash,
+                       dbfread=options.dbfread,
+                       # TODO only add if not added by user. What to do for other extensions?
+                       pattern=pattern.get() + ".PJC",
+                       recursive=recursive.get() > 0,
+                       output=options.output,
+                       log_level=level if level > 0 else None,
+                       stats_json=options.stats_json,
+                       merge=options.merge,
+                       format=options.format,
+                       stage=options.stage,
+                       vacuum=options.vacuum,
+                       validate=validate.get() > 0,
+                       lineage=lineage.get() > 0,
+                       fts=fts.get() > 0,
+                       views=views.get() > 0,
+                       progress=queue_progress,
+                       cancel=cancel)
+
+    def open_directory():
+        directory = askdirectory()
+        if directory:
+            settings = get_options()
+            run(find_file, Path(directory), settings.pattern, settings)
+
+    def open_file():
+        patterns = [
+            ("Project Files", "*.pjc"),
+            ("Project Backups", "*.sqz"),
+        ]
+        settings = get_options()
+        paths = askopenfilenames(filetypes=patterns)
+        if paths:
+            run(lambda: [convert_project(Path(path), settings) for path in paths])
+
+    frm = Frame(root, padding = 10)
+    frm.grid()
+    open_directory_button = Button(frm, text="Open Directory", command=open_directory)
+    open_directory_button.grid(sticky="W", column=0, row=0)
+    Label(frm, text="Pattern:").grid(sticky="E", column=1, row=0)
+    Entry(frm, textvariable=pattern, width=12).grid(column=2, row=0)
+
+    open_file_button = Button(frm, text="Open File", command=open_file)
+    open_file_button.grid(sticky="W", column=0, row=1)
+    start_buttons = (open_directory_button, open_file_button)
+    cancel_button = Button(frm, text="Cancel", command=cancel.set, state='disabled')
+    cancel_button.grid(sticky="W", column=0, row=2)
+    Checkbutton(frm, text="Recursive", variable=recursive).grid(column=2, row=1)
+    Checkbutton(frm, text="Bulk Load", variable=bulk_load).grid(column=2, row=2)
+    Checkbutton(frm, text="Defer Indexes", variable=deferred_index).grid(column=2, row=3)
+    Label(frm, text="Workers:").grid(sticky="E", column=1, row=4)
+    Entry(frm, textvariable=worker_count, width=12).grid(column=2, row=4)
+    Checkbutton(frm, text="Only Changed Tables", variable=only_changed).grid(column=2, row=5)
+    Checkbutton(frm, text="Validate", variable=validate).grid(column=2, row=6)
+    Checkbutton(frm, text="Lineage", variable=lineage).grid(column=2, row=7)
+    Checkbutton(frm, text="Full-Text Index", variable=fts).grid(column=2, row=8)
+    Checkbutton(frm, text="Read Views", variable=views).grid(column=2, row=9)
+    Button(frm, text="Quit", command=quit_gui).grid(sticky="W", column=0, row=9)
+    Label(frm, text="Version: "+Version).grid(sticky="W", column=1, row=9)
+
+    Label(frm, textvariable=project, width=100).grid(column=0, columnspan=10, row=10)
+    Label(frm, textvariable=progress_file, width=100).grid(column=0, columnspan=10, row=11)
+    Label(frm, textvariable=progress_rows, width=100).grid(column=0, columnspan=10, row=12)
+
+    Label(frm, text="Logging:").grid(sticky="E", column=4, row=0)
     Radiobutton(frm, text="None", variable=log_level, value=-1).grid(sticky="W", column=5, row=0)
     Radiobutton(frm, text="Errors", variable=log_level, value=logging.ERROR).grid(sticky="W", column=5, row=1)
     Radiobutton(frm, text="Warnings", variable=log_level, value=logging.WARNING).grid(sticky="W", column=5, row=2)
     Radiobutton(frm, text="Info", variable=log_level, value=logging.INFO).grid(sticky="W", column=5, row=4)
     Radiobutton(frm, text="Debug", variable=log_level, value=logging.DEBUG).grid(sticky="W", column=5, row=5)
+    root.protocol("WM_DELETE_WINDOW", quit_gui)
     root.mainloop()
 
 
+# Names of the --log-level choices
+LOG_LEVELS = {
+    'none':     None,
+    'error':    logging.ERROR,
+    'warning':  logging.WARNING,
+    'info':     logging.INFO,
+    'debug':    logging.DEBUG,
+}
+
+
+def make_parser():
+    """Make the parser for the command line"""
+    parser = argparse.ArgumentParser(
+        prog='TMG2SQL',
+        description='Convert TMG projects to Sqlite databases (or SQL scripts). With no projects, opens the window.')
+    parser.add_argument('paths', nargs='*', type=Path,
+                        help='TMG project .pjc files or .sqz backups, or directories to search for projects')
+    parser.add_argument('-p', '--pattern', default='*',
+                        help='pattern of the projects to convert in the directories, without the .PJC (default: *)')
+    parser.add_argument('-r', '--recursive', action=argparse.BooleanOptionalAction, default=True,
+                        help='search the subdirectories of the directories (default: on)')
+    parser.add_argument('-o', '--output', type=Path,
+                        help='database file to write, or directory to write the databases in '
+                             '(default: next to each project)')
+    parser.add_argument('-l', '--log-level', choices=LOG_LEVELS, default='warning',
+                        help='detail of the log file written next to each project (default: warning)')
+    parser.add_argument('-b', '--batch-size', type=int, default=BATCH_SIZE,
+                        help='records inserted at a time when bulk loading, '
+                             '0 to insert a record at a time with the safe settings (default: %(default)s)')
+    parser.add_argument('--defer-indexes', action=argparse.BooleanOptionalAction, default=True,
+                        help='build the indexes after loading each table (default: on)')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+                        help='processes to decode the tables with, or for more than one project, '
+                             'the number of projects converted at the same time (default: 1)')
+    parser.add_argument('-i', '--incremental', action='store_true',
+                        help='only copy the tables whose files have changed since the last conversion')
+    parser.add_argument('-m', '--merge', action='store_true',
+                        help='add all the projects to the --output database, with a project_id column')
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='sqlite',
+                        help='write a SQLite database, a SQL script for sqlite3, a PostgreSQL script for psql, '
+                             'or a directory of Parquet files, one for each table (default: sqlite)')
+    parser.add_argument('--stage', action='store_true',
+                        help='build each new database in memory (or a temporary file, if large), '
+                             'then write it to the output in one go (not with --merge or --incremental)')
+    parser.add_argument('--vacuum', action='store_true',
+                        help='with --stage, write the output with VACUUM INTO, so it is compacted')
+    parser.add_argument('--validate', action='store_true',
+                        help='run the integrity rules over each database, listing the records that break them '
+                             'in the _violations table')
+    parser.add_argument('--lineage', action='store_true',
+                        help='add the _lineage table of every ancestor of every person, for lineage queries')
+    parser.add_argument('--fts', action='store_true',
+                        help='add full-text indexes of the names, places, memos and citations (see search)')
+    parser.add_argument('--views', action='store_true',
+                        help='add the _view_ tables of people, events and citations, joined with their names, '
+                             'places, sources and repositories')
+    parser.add_argument('--content-hash', action='store_true',
+                        help='fingerprint the files by their contents as well as their sizes and times')
+    parser.add_argument('--dbfread', action='store_true',
+                        help='read the .dbf files with dbfread rather than the built-in reader')
+    parser.add_argument('--stats-json', action='store_true',
+                        help='also write the conversion statistics to a _stats.json file next to the database')
+    parser.add_argument('--gui', action='store_true',
+                        help='open the window, using the other options as its settings')
+    parser.add_argument('--version', action='version', version=f'%(prog)s {Version}')
+    return parser
+
+
+def main(argv=None):
+    """The command line entry point, opening the GUI if no projects are given
+
+    Returns the exit status, 0 if all the projects were converted.
+    """
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    options = Options(batch_size=args.batch_size,
+                      defer_indexes=args.defer_indexes,
+                      workers=args.workers,
+                      incremental=args.incremental,
+                      content_hash=args.content_hash,
+                      dbfread=args.dbfread,
+                      pattern=(args.pattern + ".PJC").upper(),
+                      recursive=args.recursive,
+                      output=args.output,
+                      log_level=LOG_LEVELS[args.log_level],
+                      stats_json=args.stats_json,
+                      merge=args.merge,
+                      format=args.format,
+                      stage=args.stage,
+                      vacuum=args.vacuum,
+                      validate=args.validate,
+                      lineage=args.lineage,
+                      fts=args.fts,
+                      views=args.views)
+    if args.merge and (args.output is None or args.output.is_dir()):
+        parser.error('--merge needs an --output database file')
+    if args.merge and args.incremental:
+        parser.error('--merge and --incremental can\'t be used together')
+    if args.vacuum and not args.stage:
+        parser.error('--vacuum needs --stage')
+    if args.stage and (args.merge or args.incremental):
+        parser.error('--stage can\'t be used with --merge or --incremental')
+    if args.format != 'sqlite' and (args.merge or args.incremental or args.stage or args.validate
+                                    or args.lineage or args.fts or args.views):
+        parser.error(f'--format {args.format} can\'t be used with '
+                     '--merge, --incremental, --stage, --validate, --lineage, --fts or --views')
+    if args.gui or not args.paths:
+        gui(options)
+        return 0
+
+    projects = []
+    for path in args.paths:
+        if path.is_dir():
+            projects += find_projects(path, options.pattern, options.recursive)
+        else:
+            projects.append(path)
+    if not projects:
+        print("No projects found")
+        return 1
+    if len(projects) > 1 and options.output is not None and not options.output.is_dir() and not options.merge:
+        parser.error('--output must be an existing directory to convert more than one project')
+    summaries = convert_batch(projects, options)
+    if all(summary is not None and summary['seconds'] is not None for summary in summaries):
+        return 0
+    return 1
+
+
 if __name__ == "__main__":
+    # In the PyInstaller exe, a worker process (see copy_tables and convert_batch)
+    # runs this too, and must start the worker rather than main()
+    multiprocessing.freeze_support()
     # if 'idlelib.run' in sys.modules:
     #     sys.argv.extend(('../Family/*.pjc',))   # Default Arguments to use in IDLE
-    main()
+    sys.exit(main())
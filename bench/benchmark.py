@@ -0,0 +1,153 @@
+"""Time TMG2SQL conversions of synthetic projects, and compare them to a saved baseline
+
+For each scale, a synthetic project (see synth.py) is made in the fixtures
+directory, unless it is already there, and converted repeat times. The time of
+each phase (open, decode, insert, index, verify, analyze and the total) is
+taken from the _conversion_stats table of the database, summed over the tables,
+and the best of the repeats is kept. With --fts, the full-text indexes are
+made too (the search phase), and query is the time to search them for each
+of the synthetic surnames, by prefix and by Soundex (see TMG2SQL.search).
+
+The times are compared with those in the baseline file. A phase is a regression
+when it is slower by more than the threshold (a fraction) and by more than
+MIN_SECONDS. The exit status is 1 if there are any regressions.
+
+Usage:
+    python bench/benchmark.py [--scale small medium] [--repeat 3] [--save]
+
+Baselines only compare on the same machine, so save one (--save) before
+making a change, then run again after it.
+"""
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(BENCH_DIR.parent))
+
+import TMG2SQL     # noqa: E402
+import synth       # noqa: E402
+
+SCALES = {'small': 1_000, 'medium': 100_000, 'large': 1_000_000}
+PHASES = ('open', 'decode', 'insert', 'index', 'verify', 'search', 'analyze', 'query', 'total')
+MIN_SECONDS = 0.05      # Changes smaller than this are noise, whatever the fraction
+BASELINE = BENCH_DIR / 'baseline.json'
+FIXTURES = Path(tempfile.gettempdir()) / 'tmg2sql-fixtures'
+
+
+def fixture(directory, people, seed=1):
+    """Return the .pjc of the synthetic project of people, making it if it isn't in directory"""
+    path = Path(directory) / f'{people}-{seed}-v{synth.GENERATOR_VERSION}'
+    pjc = path / 'synth__.pjc'
+    if not pjc.exists():
+        print(f'Making a project of {people} people in {path}')
+        start = time.perf_counter()
+        synth.make_project(path, people, seed)
+        print(f'Made in {time.perf_counter() - start:.1f} sec')
+    return pjc
+
+
+def run_conversion(pjc, options):
+    """Convert the project once, returning the seconds of each phase and the number of records"""
+    with tempfile.TemporaryDirectory() as directory:
+        options.output = Path(directory) / 'bench.sqlite'
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = TMG2SQL.tmg2sqlite(pjc, options)
+        conn = sqlite3.connect(options.output)
+        try:
+            times = dict.fromkeys(PHASES, 0.0)
+            for phase, seconds in conn.execute(f'SELECT phase, sum(seconds) FROM "{TMG2SQL.STATS}" GROUP BY phase'):
+                times[phase] = round(seconds, 4)
+            if options.fts:
+                start = time.perf_counter()
+                for surname in synth.SURNAMES:
+                    if not TMG2SQL.search(conn, surname, phonetic=True):
+                        raise RuntimeError(f'Nothing found for {surname}')
+                times['query'] = round(time.perf_counter() - start, 4)
+        finally:
+            conn.close()
+    return times, summary['rows']
+
+
+def benchmark(scale, people, options, repeat, fixtures):
+    """Run the conversions of a scale, returning the best time of each phase"""
+    pjc = fixture(fixtures, people)
+    best = None
+    rows = None
+    for run in range(repeat):
+        times, rows = run_conversion(pjc, TMG2SQL.Options(**options))
+        print(f'{scale} run {run + 1}: {times["total"]:.2f} sec')
+        best = times if best is None else {phase: min(best[phase], times[phase]) for phase in PHASES}
+    return {'people': people, 'rows': rows, 'options': options, 'phases': best}
+
+
+def compare(scale, result, baseline, threshold):
+    """Print the phases of a scale against the baseline, returning the list of regressions"""
+    base = baseline.get('scales', {}).get(scale)
+    print(f'\n{scale}: {result["people"]} people, {result["rows"]} records')
+    if base is None:
+        print('  No baseline')
+        for phase in PHASES:
+            print(f'  {phase:10}{result["phases"][phase]:10.3f}')
+        return []
+    if base['rows'] != result['rows'] or base['options'] != result['options']:
+        print('  Warning: the baseline was of a different project or options')
+    regressions = []
+    print(f'  {"Phase":10}{"Baseline":>10}{"Now":>10}{"Change":>9}')
+    for phase in PHASES:
+        old = base['phases'].get(phase, 0.0)
+        new = result['phases'].get(phase, 0.0)
+        change = f'{(new - old) / old:+8.1%}' if old else ''
+        flag = ''
+        if new - old > MIN_SECONDS and new > old * (1 + threshold):
+            flag = '  REGRESSION'
+            regressions.append((scale, phase))
+        print(f'  {phase:10}{old:10.3f}{new:10.3f}{change:>9}{flag}')
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark TMG2SQL on synthetic projects')
+    parser.add_argument('--scale', nargs='+', default=['small', 'medium'], choices=SCALES,
+                        help='sizes of project to convert: small (1k people), medium (100k) or large (1M)')
+    parser.add_argument('--repeat', type=int, default=3, help='conversions of each project, the best is kept')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='fraction slower than the baseline that is a regression (default 0.10)')
+    parser.add_argument('--baseline', type=Path, default=BASELINE, help='the baseline file')
+    parser.add_argument('--save', action='store_true', help='save the results as the baseline')
+    parser.add_argument('--fixtures', type=Path, default=FIXTURES,
+                        help='directory to keep the synthetic projects in')
+    parser.add_argument('-b', '--batch-size', type=int, default=TMG2SQL.BATCH_SIZE)
+    parser.add_argument('-j', '--workers', type=int, default=1)
+    parser.add_argument('--fts', action='store_true', help='also make the full-text indexes, and time searching them')
+    args = parser.parse_args(argv)
+
+    options = {'batch_size': args.batch_size, 'workers': args.workers, 'fts': args.fts}
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    results = {scale: benchmark(scale, SCALES[scale], options, args.repeat, args.fixtures)
+               for scale in args.scale}
+    regressions = []
+    for scale, result in results.items():
+        regressions += compare(scale, result, baseline, args.threshold)
+
+    if args.save:
+        baseline.update({'version': TMG2SQL.Version, 'python': platform.python_version(),
+                         'machine': f'{platform.system()} {platform.machine()} {platform.processor()}'.strip()})
+        baseline.setdefault('scales', {}).update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=1) + '\n')
+        print(f'\nSaved {args.baseline}')
+    elif regressions:
+        print(f'\nRegressions: {", ".join(f"{scale} {phase}" for scale, phase in regressions)}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
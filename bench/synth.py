@@ -0,0 +1,346 @@
+"""Write a synthetic TMG project, as test data for TMG2SQL
+
+Makes a .pjc file and the .dbf/.fpt files of every table in TMG2SQL.table_info,
+with made up people, names, events, places and sources. The number of records
+in each table follows the number of people, with a fan-out like a real project:
+about 1.2 names, 1.4 parents, 2.5 events and 1.5 citations per person.
+
+The files are written a record at a time, so large projects (a million people)
+don't need to fit in memory. The same people and seed always give the same files.
+
+Usage: python bench/synth.py directory [people] [--seed N] [--errors]
+"""
+import argparse
+import datetime
+import random
+import struct
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from TMG2SQL import soundex     # noqa: E402
+
+GENERATOR_VERSION = 2   # Change when the files written change, so saved fixtures get rebuilt
+
+# The fields of each table, as NAME:TypeLength (see docs/TMG9_file_structures.rtf)
+SCHEMA = """
+$: PER_NO:I4 FATHER:I4 MOTHER:I4 LAST_EDIT:D8 DSID:I4 REF_ID:I4 REFERENCE:C12 SPOULAST:I4 SCBUFF:C10 PBIRTH:C30 PDEATH:C30 SEX:C1 LIVING:C1 BIRTHORDER:C2 MULTIBIRTH:C1 ADOPTED:C1 ANCE_INT:C1 DESC_INT:C1 RELATE:I4 RELATEFO:I4 TT:C1 FLAG1:C1
+A: RULESET:N1 DSID:I4 SOURTYPE:I4 TRANS_TO:I4 NAME:C66 FOOT:M4 SHORT:M4 BIB:M4 CUSTFOOT:M4 CUSTSHORT:M4 CUSTBIB:M4 SAMEAS:I4 SAMEASMSG:M4 PRIMARY:L1 REMINDERS:M4 TT:C1
+B: GROUPNUM:I4 MEMBERNUM:I4 TT:C1 DSID:I4
+C: FLAGLABEL:C50 FLAGFIELD:C10 FLAGVALUE:C250 SEQUENCE:I4 DESCRIPT:M4 ACTIVE:L1 FLAGID:I4 PROPERTY:M4 DSID:I4 TT:C1
+D: DSID:I4 DSNAME:C100 DSLOCATION:C253 DSTYPE:N2 DSLOCKED:L1 DSENABLED:L1 PROPERTY:M4 DSP:M4 DSP2:M4 TT:C1 DCOMMENT:M4 HOST:M4 NAMESTYLE:I4 PLACESTYLE:I4
+DNA: DSID:I4 ID_DNA:I4 ID_PERSON:I4 DNANAME:C100 COMMENTS:M4 DESCRIPT:M4 RESULT:M4 URL:M4 LOGO:M4 TT:C1 KITNUMBER:C24 TYPE:C1 NAMEREC:I4
+E: EPER:I4 GNUM:I4 PRIMARY:L1 WSENTENCE:M4 TT:C1 ROLE:C5 DSID:I4 NAMEREC:I4 WITMEMO:M4 SEQUENCE:I4
+F: PRIMARY:L1 CHILD:I4 PARENT:I4 PTYPE:I4 PNOTE:M4 PSURE:C1 FSURE:C1 RECNO:I4 TT:C1 DSID:I4
+G: ETYPE:I4 DSID:I4 PER1SHOW:L1 PER2SHOW:L1 PER1:I4 PER2:I4 EDATE:C30 PLACENUM:I4 EFOOT:M4 ENSURE:C1 ESSURE:C1 EDSURE:C1 EPSURE:C1 EFSURE:C1 RECNO:I4 SENTENCE:M4 SRTDATE:C30 TT:C1 REF_ID:I4
+I: IDEXHIBIT:I4 IDREF:I4 RLTYPE:C1 RLNUM:I4 XNAME:C30 VFILENAME:M4 IFILENAME:M4 AFILENAME:M4 TFILENAME:M4 REFERENCE:C25 TEXT:M4 IMAGE:M4 AUDIO:M4 DESCRIPT:M4 RLPER1:I4 RLPER2:I4 RLGTYPE:I4 PRIMARY:L1 VIDEO:M4 PROPERTY:M4 DSID:I4 TT:C1 ID_PERSON:I4 ID_EVENT:I4 ID_SOURCE:I4 ID_REPOS:I4 THUMB:M4 ID_CIT:I4 ID_PLACE:I4 CAPTION:M4 SORTEXH:I4 IMAGEFORE:M4 IMAGEBACK:M4 TRANSPAR:N4
+K: IDLOCK:I4 TNAME:C50 DSID:I4 TT:C1
+L: RLTYPE:C1 RLNUM:I4 RLPER1:I4 RLPER2:I4 RLGTYPE:I4 TASK:M4 RLEDITED:C11 DESIGNED:C11 BEGUN:C11 PROGRESS:C11 COMPLETED:C11 PLANNED:C11 COMMENTS:M4 RLNOTE:M4 KEYWORDS:M4 DSID:I4 ID_PERSON:I4 ID_EVENT:I4 ID_SOURCE:I4 ID_REPOS:I4 TT:C1 REFERENCE:C30
+M: MACTIVE:L1 MAJNUM:I4 REF_ID:I4 ABBREV:C50 DEFSURE:C1 TITLE:M4 TYPE:N3 RECORDER:N2 MEDIA:N2 FIDELITY:N2 INDEXED:N1 STATUS:N2 TEXT:M4 SPERNO:I4 ISPICKED:L1 INFO:M4 FFORM:M4 SFORM:M4 BFORM:M4 CITED:L1 IBIDTYPE:N1 SUBJECTID:I4 COMPILERID:I4 EDITORID:I4 SPERNO2:I4 UNCITEDFLD:M4 CUSTTYPE:I4 FIRSTCD:M4 DSID:I4 REMINDERS:M4 TT:C1
+N: NPER:I4 ALTYPE:I4 ISPICKED:L1 INFS:L1 INFG:L1 PRIMARY:L1 NSURE:C1 FSURE:C1 NNOTE:M4 RECNO:I4 SENTENCE:M4 NDATE:C30 SRTDATE:C30 DSURE:C1 DSID:I4 TT:C1 SRNAMESORT:C70 GVNAMESORT:C70 STYLEID:I4 SURID:I4 GIVID:I4 SRNAMEDISP:C70 SNDXSURN:C4 SNDXGVN:C4 PBIRTH:C30 PDEATH:C30 REFER:C30 PREF_ID:I4 LAST_EDIT:D8
+ND: UID:I4 VALUE:M4 SDX:C4 TT:C1
+NPT: ID:I4 VALUE:C100 SYSTEM:L1 TYPE:I4 SHORTVALUE:C20 TT:C1 DSID:I4 TEMPLATE:C30
+NPV: RECNO:I4 UID:I4 TYPE:I4 ID:I4 TT:C1 DSID:I4
+O: GROUPNUM:I4 GROUPNAME:C40 RECENT:L1 TT:C1
+P: RECNO:I4 STYLEID:I4 DSID:I4 TT:C1 STARTYEAR:C4 ENDYEAR:C4 COMMENT:M4 SHORTPLACE:M4
+PD: UID:I4 VALUE:M4 SDX:C4 TT:C1
+PICK1: REF_ID:I4 FATHER:I4 MOTHER:I4 NAME:C60
+PPT: ID:I4 TYPE:I4 VALUE:C100 SYSTEM:L1 SHORTVALUE:C20 TT:C1 DSID:I4
+PPV: RECNO:I4 UID:I4 TYPE:I4 ID:I4 TT:C1 DSID:I4
+R: DSID:I4 NAME:M4 RECNO:I4 REF_ID:I4 ABBREV:C50 ADDRESS:I4 RNOTE:M4 RPERNO:I4 ISPICKED:L1 TT:C1
+S: RECNO:I4 STYPE:C1 REFREC:I4 MAJSOURCE:I4 SUBSOURCE:M4 SNSURE:C1 SSSURE:C1 SDSURE:C1 SPSURE:C1 SFSURE:C1 ISPICKED:L1 SEQUENCE:I4 CITMEMO:M4 EXCLUDE:L1 TT:C1 DSID:I4 CITREF:C30
+ST: STYLEID:I4 ST_DISPLAY:M4 ST_OUTPUT:M4 GROUP:C1 SRNAMESORT:M4 SRNAMEDISP:M4 GVNAMESORT:M4 GVNAMEDISP:M4 OTHERDISP:M4 TT:C1 DSID:I4 STYLENAME:C100
+T: ISPICKED:L1 DSID:I4 ACTIVE:L1 ETYPENUM:I4 ORIGETYPE:I4 ADMIN:N2 LDSONLY:L1 ETYPENAME:C20 GEDCOM_TAG:C4 ISREPORT:L1 TSENTENCE:M4 ABBREV:C4 WITDISP:L1 PASTTENSE:C20 PRINROLE:L1 WITROLE:L1 MAXYEAR:N4 MINYEAR:N4 REMINDERS:M4 TT:C1 PROPERTIES:M4
+U: RECNO:I4 DSID:I4 ELEMENT:C30 GROUPNUM:N3 TT:C1
+W: MNUMBER:I4 RNUMBER:I4 REFERENCE:C25 PRIMARY:L1 TT:C1 DSID:I4
+XD: DSID:I4 PER1:I4 PER2:I4 TT:C1
+"""
+
+SURNAMES = ('Smith', 'Jones', 'Brown', 'Miller', 'Davis', 'García', 'Müller', "O'Brien", 'Nguyen', 'Kowalski')
+GIVEN = ('John', 'Mary', 'William', 'Elizabeth', 'James', 'Anna', 'Thomas', 'Margaret', 'José', 'Zoë')
+# ETYPENUM, ETYPENAME, GEDCOM_TAG and ADMIN, the tag group (4 is Birth, 5 Death, 6 Marriage, 99 Other...)
+EVENT_TYPES = ((1, 'Birth', 'BIRT', 4), (2, 'Death', 'DEAT', 5), (3, 'Father-Biological', '', 2),
+               (4, 'Mother-Biological', '', 3), (5, 'Marriage', 'MARR', 6), (6, 'Census', 'CENS', 99),
+               (7, 'Name-Var', '', 1), (8, 'Burial', 'BURI', 9))
+MEMO_BLOCK = 64
+TODAY = datetime.date(2024, 5, 6)
+
+
+def parse_schema():
+    """Return SCHEMA as a dictionary of table key to a list of (name, type, length)"""
+    tables = {}
+    for line in SCHEMA.strip().splitlines():
+        key, fields = line.split(':', 1)
+        tables[key] = [(name, spec[0], int(spec[1:])) for name, spec in
+                       (field.split(':') for field in fields.split())]
+    return tables
+
+
+class DbfWriter:
+    """Writes a Visual FoxPro .dbf file, and its .fpt memo file, a record at a time
+
+    Parameters:
+    path -- the .dbf file to write
+    fields -- list of (name, type, length), of types C, I, N, L, D and M
+    """
+
+    def __init__(self, path, fields):
+        self.fields = fields
+        self.count = 0
+        self.headerlen = 32 + 32 * len(fields) + 1 + 263
+        self.file = open(path, 'wb')
+        self.file.write(b'\0' * self.headerlen)     # Written by close, once the count is known
+        self.memo = None
+        if any(ftype == 'M' for _name, ftype, _length in fields):
+            self.memo = open(Path(path).with_suffix('.fpt'), 'wb')
+            self.memo.write(b'\0' * 512)
+            self.nextblock = 512 // MEMO_BLOCK
+
+    def add_memo(self, text):
+        """Write a memo, returning its block number"""
+        data = text.encode('cp1252', 'replace')
+        body = struct.pack('>LL', 1, len(data)) + data
+        body += b'\0' * (-len(body) % MEMO_BLOCK)
+        block = self.nextblock
+        self.memo.write(body)
+        self.nextblock += len(body) // MEMO_BLOCK
+        return block
+
+    def write(self, values, deleted=False):
+        """Write a record from a dictionary of field values, missing fields are left empty"""
+        rec = bytearray(b'*' if deleted else b' ')
+        for name, ftype, length in self.fields:
+            value = values.get(name)
+            if ftype == 'C':
+                rec += (value or '').encode('cp1252', 'replace')[:length].ljust(length)
+            elif ftype == 'I':
+                rec += struct.pack('<i', value or 0)
+            elif ftype == 'N':
+                rec += b' ' * length if value is None else str(value).encode().rjust(length)
+            elif ftype == 'L':
+                rec += b' ' if value is None else b'T' if value else b'F'
+            elif ftype == 'D':
+                rec += value.strftime('%Y%m%d').encode() if value else b' ' * 8
+            elif ftype == 'M':
+                rec += struct.pack('<I', self.add_memo(value) if value else 0)
+        self.file.write(rec)
+        self.count += 1
+
+    def close(self):
+        """Finish the files, writing the headers"""
+        self.file.write(b'\x1a')
+        header = bytearray(struct.pack('<BBBBLHH', 0x30, TODAY.year - 1900, TODAY.month, TODAY.day, self.count,
+                                       self.headerlen, 1 + sum(length for _name, _type, length in self.fields)))
+        header += b'\0' * 17 + b'\x03' + b'\0' * 2     # Code page 1252
+        offset = 1
+        for name, ftype, length in self.fields:
+            header += name.encode('ascii').ljust(11, b'\0') + ftype.encode() + struct.pack('<LBB', offset, length, 0)
+            header += b'\0' * 14
+            offset += length
+        header += b'\x0d' + b'\0' * 263
+        self.file.seek(0)
+        self.file.write(header)
+        self.file.close()
+        if self.memo is not None:
+            self.memo.seek(0)
+            self.memo.write(struct.pack('>LHH', self.nextblock, 0, MEMO_BLOCK))
+            self.memo.close()
+
+
+def tmg_date(rnd, year=None):
+    """Return a random TMG date, with some empty, irregular (text) and range dates"""
+    chance = rnd.random()
+    if chance < 0.05:
+        return '0About the time of the war'
+    if chance < 0.15:
+        return '100000000030000000000'
+    year = year or rnd.randint(1600, 2000)
+    qualifier = rnd.choice('0123345')
+    second = '%04d0000' % (year + rnd.randint(1, 5)) if qualifier == '5' else '00000000'
+    return '1%04d%02d%02d0%s%s0%s' % (year, rnd.randint(0, 12), rnd.randint(0, 28), qualifier, second,
+                                      rnd.choice('01'))
+
+
+def make_project(directory, people=1000, seed=1, errors=False, base='synth_'):
+    """Write a synthetic TMG project into directory
+
+    Parameters:
+    directory -- the directory to write the files in, made if needed
+    people -- the number of people in the project, the other tables scale with it
+    seed -- seed for the random values
+    errors -- add a duplicate person, a reference to a missing person, a deleted event and a
+              source of a type only a custom type can be, to exercise the error checks
+    base -- the prefix of the file names
+
+    Returns the path of the .pjc file.
+    """
+    rnd = random.Random(seed)
+    schema = parse_schema()
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    pjc = directory / (base + '_.pjc')
+    pjc.write_text('[General]\nVersion=9.05\nName=Synthetic\nPeople=%d\n[Advanced]\nDataSets=1\n' % people)
+    writers = {key: DbfWriter(directory / (base + key + '.dbf'), fields) for key, fields in schema.items()}
+
+    def row(key, **values):
+        writers[key].write(values)
+
+    n_sources = max(5, people // 50)
+    n_repositories = max(2, people // 500)
+    n_places = max(10, people // 5)
+    n_name_parts = max(20, people // 3)
+    n_place_parts = max(20, people // 4)
+
+    # Reference tables
+    row('D', DSID=1, DSNAME='Main', DSLOCATION='C:\\TMG', DSTYPE=1, DSLOCKED=False, DSENABLED=True,
+        NAMESTYLE=1, PLACESTYLE=2, DCOMMENT='Data set memo')
+    for i in range(1, 4):
+        row('C', FLAGLABEL='Flag %d' % i, FLAGFIELD='FLAG%d' % i, FLAGVALUE='?YN', SEQUENCE=i, ACTIVE=True,
+            FLAGID=i, DSID=1)
+    for num, name, tag, admin in EVENT_TYPES:
+        row('T', ISPICKED=False, DSID=1, ACTIVE=True, ETYPENUM=num, ORIGETYPE=num, ADMIN=admin, LDSONLY=False,
+            ETYPENAME=name, GEDCOM_TAG=tag, ISREPORT=False, TSENTENCE='[P] <was|is> ' + name.lower() + ' [D] [L]',
+            MAXYEAR=2000, MINYEAR=1500)
+    row('ST', STYLEID=1, ST_DISPLAY='[GIVEN] [SURNAME]', GROUP='N', DSID=1, STYLENAME='Standard Name')
+    row('ST', STYLEID=2, ST_DISPLAY='[CITY], [STATE]', GROUP='P', DSID=1, STYLENAME='Standard Place')
+    for i, (name, place) in enumerate((('Surname', 'City'), ('Given', 'County'), ('Title', 'State')), 1):
+        row('NPT', ID=i, VALUE=name, SYSTEM=True, TYPE=1, SHORTVALUE='S%d' % i, DSID=1, TEMPLATE='[%s]' % name.upper())
+        row('PPT', ID=i, TYPE=1, VALUE=place, SYSTEM=True, SHORTVALUE='P%d' % i, DSID=1)
+    for i in range(1, 11):
+        row('A', RULESET=1, DSID=1, SOURTYPE=i, TRANS_TO=0, NAME='Type %d' % i, FOOT='[AUTHOR], [TITLE]',
+            SHORT='[TITLE]', BIB='[AUTHOR]. [TITLE].', SAMEAS=0, PRIMARY=False)
+        row('A', RULESET=3, DSID=1, SOURTYPE=i, TRANS_TO=i, NAME='Custom %d' % i, FOOT='[TITLE]', SAMEAS=i,
+            PRIMARY=(i == 1))
+    for i in range(1, 33):
+        row('U', RECNO=i, DSID=1, ELEMENT='[ELEMENT%d]' % i, GROUPNUM=i)
+    row('O', GROUPNUM=1, GROUPNAME='Focus', RECENT=False)
+
+    # Name and place parts
+    for i in range(1, n_name_parts + 1):
+        value = rnd.choice(SURNAMES + GIVEN) + str(i)
+        row('ND', UID=i, VALUE=value, SDX=soundex(value))
+    for i in range(1, n_place_parts + 1):
+        row('PD', UID=i, VALUE='Town%d' % i, SDX=soundex('Town'))
+    for i in range(1, n_places + 1):
+        row('P', RECNO=i, STYLEID=2, DSID=1, STARTYEAR='1800', ENDYEAR='',
+            COMMENT='Place note %d' % i if i % 3 == 0 else None)
+        for part in (1, 3):
+            row('PPV', RECNO=i, UID=rnd.randint(1, n_place_parts), TYPE=part, ID=part, DSID=1)
+
+    # Sources and repositories
+    for i in range(1, n_repositories + 1):
+        row('R', DSID=1, NAME='Repository %d' % i, RECNO=i, REF_ID=i, ABBREV='Rep%d' % i,
+            ADDRESS=rnd.randint(1, n_places), RPERNO=0, ISPICKED=False)
+    for i in range(1, n_sources + 1):
+        row('M', MACTIVE=True, MAJNUM=i, REF_ID=i, ABBREV='Src%d' % i, TITLE='Source title %d' % i,
+            TYPE=rnd.randint(1, 10), TEXT='Source text %d' % i, SPERNO=0, CITED=True,
+            SUBJECTID=rnd.randint(0, people), COMPILERID=0, EDITORID=0, SPERNO2=0, CUSTTYPE=rnd.randint(0, 10),
+            DSID=1)
+        row('W', MNUMBER=i, RNUMBER=rnd.randint(1, n_repositories), REFERENCE='Shelf %d' % i, PRIMARY=True, DSID=1)
+
+    # People, with their names, parents, events, witnesses and citations
+    names = 0
+    parents = 0
+    events = 0
+    citations = 0
+
+    def event(etype, person, spouse, date):
+        nonlocal events, citations
+        events += 1
+        writers['G'].write(dict(ETYPE=etype, DSID=1, PER1SHOW=True, PER2SHOW=bool(spouse), PER1=person, PER2=spouse,
+                                EDATE=date, PLACENUM=rnd.randint(1, n_places), RECNO=events, SRTDATE=date, REF_ID=0,
+                                EFOOT='Event memo for %d: %s' % (person, 'x' * rnd.randint(0, 200))
+                                if rnd.random() < 0.5 else None),
+                           deleted=(errors and events == 4))
+        row('E', EPER=person, GNUM=events, PRIMARY=True, ROLE='Princ', DSID=1, NAMEREC=0, SEQUENCE=1)
+        if spouse:
+            row('E', EPER=spouse, GNUM=events, PRIMARY=True, ROLE='Princ', DSID=1, NAMEREC=0, SEQUENCE=2)
+        if rnd.random() < 0.3:
+            witness = rnd.randint(1, people)
+            if witness not in (person, spouse):
+                row('E', EPER=witness, GNUM=events, PRIMARY=False, ROLE='Witn', DSID=1, NAMEREC=0, SEQUENCE=3,
+                    WITMEMO='Witness memo' if rnd.random() < 0.2 else None)
+        for sequence in range(1, rnd.choice((0, 0, 1, 1, 1, 2, 3)) + 1):
+            citations += 1
+            row('S', RECNO=citations, STYPE='E', REFREC=events, MAJSOURCE=rnd.randint(1, n_sources),
+                SUBSOURCE='Page %d' % rnd.randint(1, 500), SNSURE='3', ISPICKED=False, SEQUENCE=sequence,
+                CITMEMO='Citation memo %d' % citations if rnd.random() < 0.3 else None, EXCLUDE=False, DSID=1)
+
+    for person in range(1, people + 1):
+        father = rnd.randint(1, person - 1) if person > 2 and rnd.random() < 0.7 else 0
+        mother = rnd.randint(1, person - 1) if person > 2 and rnd.random() < 0.7 else 0
+        year = rnd.randint(1600, 1990)
+        birth = tmg_date(rnd, year)
+        death = tmg_date(rnd, year + rnd.randint(0, 90))
+        surname = rnd.choice(SURNAMES)
+        given = rnd.choice(GIVEN)
+        row('$', PER_NO=person, FATHER=father, MOTHER=mother, LAST_EDIT=datetime.date(2020, 1, 1 + person % 28),
+            DSID=1, REF_ID=person, REFERENCE='R%d' % person, SPOULAST=0, PBIRTH=birth, PDEATH=death,
+            SEX=rnd.choice('MF?'), LIVING='N', FLAG1='?')
+        for alternate in range(1 if rnd.random() < 0.8 else 2):
+            names += 1
+            surname_id = rnd.randint(1, n_name_parts)
+            row('N', NPER=person, ALTYPE=7, ISPICKED=False, INFS=False, INFG=False, PRIMARY=(alternate == 0),
+                NSURE='3', RECNO=names, NNOTE='Name note for %d' % person if person % 7 == 0 else None,
+                NDATE=birth, SRTDATE=birth, DSID=1, SRNAMESORT=surname, GVNAMESORT=given, STYLEID=1,
+                SURID=surname_id, GIVID=rnd.randint(1, n_name_parts), SRNAMEDISP='%s %s' % (given, surname),
+                SNDXSURN=soundex(surname), SNDXGVN=soundex(given), PREF_ID=person)
+            row('NPV', RECNO=names, UID=surname_id, TYPE=1, ID=1, DSID=1)
+            row('NPV', RECNO=names, UID=rnd.randint(1, n_name_parts), TYPE=2, ID=2, DSID=1)
+        for parent, ptype in ((father, 3), (mother, 4)):
+            if parent:
+                parents += 1
+                row('F', PRIMARY=True, CHILD=person, PARENT=parent, PTYPE=ptype, PSURE='3', RECNO=parents, DSID=1,
+                    PNOTE='Relationship note' if person % 11 == 0 else None)
+        event(1, person, 0, birth)
+        if rnd.random() < 0.6:
+            event(2, person, 0, death)
+        if rnd.random() < 0.4 and person > 1:
+            event(5, person, rnd.randint(1, person - 1), tmg_date(rnd, year + rnd.randint(18, 40)))
+        if rnd.random() < 0.3:
+            event(6, person, 0, tmg_date(rnd, year + rnd.randint(0, 60)))
+
+    # Records that refer to the people and events
+    for i in range(1, min(people, 20) + 1):
+        row('B', GROUPNUM=1, MEMBERNUM=i, DSID=1)
+        row('PICK1', REF_ID=i, NAME='Person %d' % i)
+    for i in range(1, min(people, 5) + 1):
+        row('I', IDEXHIBIT=i, IDREF=i, RLTYPE='P', RLNUM=i, XNAME='Photo %d' % i, IFILENAME='c:\\photos\\%d.jpg' % i,
+            DESCRIPT='Exhibit description', RLPER1=0, RLPER2=0, RLGTYPE=0, PRIMARY=True, DSID=1, ID_PERSON=i,
+            ID_EVENT=0, ID_SOURCE=0, ID_REPOS=0, ID_CIT=0, ID_PLACE=0, SORTEXH=i, TRANSPAR=0)
+        row('L', RLTYPE='P', RLNUM=i, RLPER1=i, RLPER2=0, RLGTYPE=0, TASK='Find records for %d' % i,
+            RLEDITED='20200101', DSID=1, ID_PERSON=i, ID_EVENT=0, ID_SOURCE=0, ID_REPOS=0, REFERENCE='')
+    row('K', IDLOCK=1, TNAME='US History', DSID=1)
+    row('XD', DSID=1, PER1=1, PER2=min(2, people))
+    row('DNA', DSID=1, ID_DNA=1, ID_PERSON=1, DNANAME='Kit', COMMENTS='DNA comment', KITNUMBER='K1', TYPE='Y',
+        NAMEREC=1)
+    if errors:
+        row('$', PER_NO=min(5, people), DSID=1, REF_ID=people + 1, PBIRTH=tmg_date(rnd))
+        row('F', PRIMARY=False, CHILD=1, PARENT=people + 50, PTYPE=3, RECNO=parents + 1, DSID=1)
+        row('B', GROUPNUM=1, MEMBERNUM=1, DSID=1)
+        # Source type 11 is only a custom type (RULESET 3), so is a good CUSTTYPE but a missing TYPE
+        row('A', RULESET=3, DSID=1, SOURTYPE=11, TRANS_TO=0, NAME='Custom 11', FOOT='[TITLE]', SAMEAS=0,
+            PRIMARY=False)
+        row('M', MACTIVE=True, MAJNUM=n_sources + 1, REF_ID=n_sources + 1, ABBREV='Src%d' % (n_sources + 1),
+            TITLE='Custom source', TYPE=11, SPERNO=0, CITED=False, SUBJECTID=0, COMPILERID=0, EDITORID=0,
+            SPERNO2=0, CUSTTYPE=11, DSID=1)
+
+    for writer in writers.values():
+        writer.close()
+    return pjc
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Write a synthetic TMG project')
+    parser.add_argument('directory', help='the directory to write the project in')
+    parser.add_argument('people', type=int, nargs='?', default=1000, help='the number of people (default 1000)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random values (default 1)')
+    parser.add_argument('--errors', action='store_true',
+                        help='add a duplicate person and a missing reference')
+    args = parser.parse_args(argv)
+    print(make_project(args.directory, args.people, args.seed, args.errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Fixtures for the TMG2SQL tests: synthetic projects (see bench/synth.py), made once a session"""
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'bench'))
+
+import TMG2SQL     # noqa: E402
+import synth       # noqa: E402
+
+PEOPLE = 300
+
+# Tables that differ from run to run, so are left out when comparing databases
+RUN_TABLES = {TMG2SQL.STATS, TMG2SQL.FINGERPRINTS, 'sqlite_stat1'}
+
+
+@pytest.fixture(scope='session')
+def clean_project(tmp_path_factory):
+    """A synthetic project with no errors in it"""
+    return synth.make_project(tmp_path_factory.mktemp('clean'), PEOPLE)
+
+
+@pytest.fixture(scope='session')
+def errors_project(tmp_path_factory):
+    """A synthetic project with a duplicate person, a missing parent, a deleted event and a bad source type"""
+    return synth.make_project(tmp_path_factory.mktemp('errors'), PEOPLE, errors=True)
+
+
+def convert(pjc, output, **options):
+    """Convert a project to the output database, returning the summary of tmg2sqlite"""
+    return TMG2SQL.tmg2sqlite(pjc, TMG2SQL.Options(output=output, **options))
+
+
+def dump(database, skip=RUN_TABLES):
+    """Return the rows of every table of a database, sorted, as a dictionary of table name: rows"""
+    conn = sqlite3.connect(str(database))
+    try:
+        names = [name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+                 if name not in skip]
+        tables = {}
+        for name in names:
+            count = len(conn.execute(f'SELECT * FROM "{name}" LIMIT 0').description)
+            order = ', '.join(str(col) for col in range(1, count + 1))
+            tables[name] = conn.execute(f'SELECT * FROM "{name}" ORDER BY {order}').fetchall()
+        return tables
+    finally:
+        conn.close()
@@ -0,0 +1,35 @@
+"""The command line entry point, main, and importing the module without the GUI"""
+import subprocess
+import sys
+
+import pytest
+
+import TMG2SQL
+from conftest import ROOT, dump
+
+
+def test_main_converts_projects(clean_project, tmp_path):
+    """main returns 0 when every project is converted, as tmg2sqlite would convert it"""
+    assert TMG2SQL.main([str(clean_project), '-o', str(tmp_path / 'main.sqlite'), '-j', '2']) == 0
+    TMG2SQL.tmg2sqlite(clean_project, TMG2SQL.Options(output=tmp_path / 'direct.sqlite'))
+    assert dump(tmp_path / 'main.sqlite') == dump(tmp_path / 'direct.sqlite')
+
+
+def test_main_return_codes(clean_project, tmp_path):
+    """main returns 1 for a missing project or no projects, and usage errors exit with 2"""
+    assert TMG2SQL.main([str(tmp_path / 'missing.pjc'), '-o', str(tmp_path / 'missing.sqlite')]) == 1
+    assert not (tmp_path / 'missing.sqlite').exists()
+    (tmp_path / 'empty').mkdir()
+    assert TMG2SQL.main([str(tmp_path / 'empty')]) == 1
+    for args in (['--vacuum'], ['--merge', '--incremental'], ['--stage', '--incremental'], ['-f', 'sql', '--fts']):
+        with pytest.raises(SystemExit) as exit_info:
+            TMG2SQL.main([str(clean_project), '-o', str(tmp_path / 'usage.sqlite')] + args)
+        assert exit_info.value.code == 2, args
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['empty']
+
+
+def test_import_has_no_tkinter():
+    """Importing the module doesn't load tkinter, so it runs without a display"""
+    result = subprocess.run([sys.executable, '-c', "import sys, TMG2SQL; print('tkinter' in sys.modules)"],
+                            cwd=ROOT, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == 'False'
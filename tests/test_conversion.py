@@ -0,0 +1,548 @@
+"""Tests of converting synthetic projects to SQLite"""
+import datetime
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import zipfile
+from pathlib import Path
+
+import pytest
+
+import TMG2SQL
+import synth
+from conftest import PEOPLE, convert, dump
+
+
+def test_bulk_load_matches_record_at_a_time(clean_project, tmp_path):
+    """Bulk loading, deferring the indexes and decoding in worker processes don't change the data"""
+    convert(clean_project, tmp_path / 'safe.sqlite', batch_size=0, defer_indexes=False)
+    convert(clean_project, tmp_path / 'bulk.sqlite')
+    convert(clean_project, tmp_path / 'workers.sqlite', workers=2)
+    safe = dump(tmp_path / 'safe.sqlite')
+    assert sum(len(rows) for rows in safe.values()) > PEOPLE * 10
+    assert dump(tmp_path / 'bulk.sqlite') == safe
+    assert dump(tmp_path / 'workers.sqlite') == safe
+
+
+def test_staged_database_matches(clean_project, tmp_path):
+    """Staging builds the same database, and is refused for a merged or incremental conversion"""
+    convert(clean_project, tmp_path / 'bulk.sqlite')
+    convert(clean_project, tmp_path / 'staged.sqlite', stage=True)
+    assert dump(tmp_path / 'staged.sqlite') == dump(tmp_path / 'bulk.sqlite')
+    for update in ('merge', 'incremental'):
+        assert convert(clean_project, tmp_path / 'bulk.sqlite', stage=True, **{update: True}) is None
+    assert sorted(path.name for path in tmp_path.iterdir()) == ['bulk.sqlite', 'staged.sqlite']
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_sqz_matches_the_directory(clean_project, tmp_path, workers):
+    """A project read from a .SQZ backup converts to the same database as from its directory"""
+    sqz = tmp_path / 'backup.SQZ'
+    with zipfile.ZipFile(sqz, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for path in sorted(clean_project.parent.iterdir()):
+            if path.suffix.lower() in ('.pjc', '.dbf', '.fpt'):
+                archive.write(path, path.name)
+    convert(clean_project, tmp_path / 'directory.sqlite')
+    convert(sqz, tmp_path / 'sqz.sqlite', workers=workers)
+    assert dump(tmp_path / 'sqz.sqlite') == dump(tmp_path / 'directory.sqlite')
+
+
+def test_deferred_indexes_keep_the_schema(clean_project, tmp_path):
+    """Deferring the indexes gives the same tables, keys and indexes as building them up front"""
+    def schema(database):
+        conn = sqlite3.connect(str(database))
+        try:
+            return sorted(conn.execute("""SELECT type, name, tbl_name, sql FROM sqlite_master
+    WHERE name NOT LIKE 'sqlite_stat%'"""))
+        finally:
+            conn.close()
+
+    convert(clean_project, tmp_path / 'deferred.sqlite', defer_indexes=True)
+    convert(clean_project, tmp_path / 'immediate.sqlite', defer_indexes=False)
+    assert schema(tmp_path / 'deferred.sqlite') == schema(tmp_path / 'immediate.sqlite')
+    conn = sqlite3.connect(str(tmp_path / 'deferred.sqlite'))
+    assert [row[1] for row in conn.execute('PRAGMA table_info("synth_e")') if row[5]] == ['EPER', 'GNUM']
+    conn.close()
+
+
+def test_missing_references(errors_project, tmp_path):
+    """The references to the deleted event, a missing parent and a missing source type are listed in _missing_refs
+
+    The source's TYPE and CUSTTYPE are both type 11, which is only a custom type (an A record of
+    RULESET 3), so only its TYPE, which must be a type of RULESET 1, is missing.
+    """
+    database = tmp_path / 'errors.sqlite'
+    convert(errors_project, database)
+    conn = sqlite3.connect(str(database))
+    missing = conn.execute(f'''SELECT "table_name", "column_name", "ref_table", "ref_column", "value"
+    FROM "{TMG2SQL.MISSING_REFS}"''').fetchall()
+    assert sorted(missing) == [('synth_e', 'GNUM', 'synth_g', 'RECNO', 4),         # The deleted event
+                               ('synth_f', 'PARENT', 'synth_$', 'PER_NO', PEOPLE + 50),
+                               ('synth_m', 'TYPE', 'synth_a', 'SOURTYPE', 11)]
+    # The deleted event isn't loaded
+    assert conn.execute('SELECT count(*) FROM "synth_g" WHERE "RECNO" = 4').fetchone() == (0,)
+    conn.close()
+
+
+def test_rejected_rows(errors_project, tmp_path):
+    """The duplicate person and group member are listed in _rejected_rows, and the first kept"""
+    database = tmp_path / 'errors.sqlite'
+    convert(errors_project, database)
+    conn = sqlite3.connect(str(database))
+    rejected = conn.execute(f'SELECT "table_name", "error_class", "record" FROM "{TMG2SQL.REJECTED}"').fetchall()
+    assert sorted((table, error_class) for table, error_class, _record in rejected) == [
+        ('synth_$', 'IntegrityError'), ('synth_b', 'IntegrityError')]
+    records = {table: json.loads(record) for table, _error_class, record in rejected}
+    assert records['synth_$']['PER_NO'] == 5
+    assert records['synth_$']['REF_ID'] == PEOPLE + 1
+    assert (records['synth_b']['GROUPNUM'], records['synth_b']['MEMBERNUM']) == (1, 1)
+    # The first person 5 is the one kept
+    assert conn.execute('SELECT "REF_ID" FROM "synth_$" WHERE "PER_NO" = 5').fetchall() == [(5,)]
+    conn.close()
+
+
+def test_clean_project_has_no_violations(clean_project, tmp_path):
+    """Every integrity rule runs and finds nothing on a project without errors"""
+    database = tmp_path / 'clean.sqlite'
+    convert(clean_project, database, validate=True)
+    assert TMG2SQL.validate_database(database) == {rule.name: 0 for rule in TMG2SQL.INTEGRITY_RULES}
+
+
+def test_validate_finds_injected_faults(clean_project, tmp_path):
+    """A repeated relationship and a second PRIMARY Birth are found, but not a second PRIMARY Marriage"""
+    database = tmp_path / 'faults.sqlite'
+    convert(clean_project, database)
+    conn = sqlite3.connect(str(database))
+    conn.execute('''INSERT INTO "synth_f" ("PRIMARY", "CHILD", "PARENT", "PTYPE", "RECNO")
+    SELECT 0, "CHILD", "PARENT", "PTYPE", (SELECT max("RECNO") + 1 FROM "synth_f") FROM "synth_f" LIMIT 1''')
+    person = conn.execute('''SELECT e."EPER" FROM "synth_e" AS e JOIN "synth_g" AS g ON g."RECNO" = e."GNUM"
+    JOIN "synth_t" AS t ON t."ETYPENUM" = g."ETYPE" WHERE t."ADMIN" = 4 AND e."PRIMARY" LIMIT 1''').fetchone()[0]
+    for admin in (4, 6):
+        recno = conn.execute('SELECT max("RECNO") + 1 FROM "synth_g"').fetchone()[0]
+        conn.execute('''INSERT INTO "synth_g" ("ETYPE", "PER1", "RECNO")
+    SELECT "ETYPENUM", ?, ? FROM "synth_t" WHERE "ADMIN" = ? LIMIT 1''', (person, recno, admin))
+        conn.execute('INSERT INTO "synth_e" ("EPER", "GNUM", "PRIMARY") VALUES (?, ?, 1)', (person, recno))
+    conn.commit()
+    conn.close()
+    expected = {rule.name: 0 for rule in TMG2SQL.INTEGRITY_RULES}
+    expected.update(relationship_unique=1, witness_primary_unique=2)
+    assert TMG2SQL.validate_database(database) == expected
+
+
+def test_validate_missing_project(clean_project, tmp_path):
+    """Validating a project that isn't in a merged database is reported, rather than failing"""
+    database = tmp_path / 'merged.sqlite'
+    convert(clean_project, database, merge=True)
+    reports = []
+    options = TMG2SQL.Options(progress=lambda kind, value: reports.append((kind, value)))
+    assert TMG2SQL.validate_database(database, options, project=tmp_path / 'other.pjc') == {}
+    assert [kind for kind, _value in reports] == ['error']
+
+
+def test_incremental_copies_only_changed_tables(clean_project, tmp_path):
+    """An incremental conversion skips the tables whose files haven't changed"""
+    project = tmp_path / 'project'
+    shutil.copytree(clean_project.parent, project)
+    pjc = project / clean_project.name
+    database = tmp_path / 'incremental.sqlite'
+    first = convert(pjc, database)
+    before = dump(database)
+
+    assert convert(pjc, database, incremental=True)['rows'] == 0
+    assert dump(database) == before
+
+    names = project / 'synth_N.dbf'
+    stat = names.stat()
+    os.utime(names, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    again = convert(pjc, database, incremental=True)
+    assert 0 < again['rows'] < first['rows']
+    assert again['rows'] == len(before['synth_n'])
+    assert dump(database) == before
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('', (None, None, None)),
+    (None, (None, None, None)),
+    ('0About the time of the war', (None, None, 'irregular')),
+    ('100000000030000000000', (None, None, None)),                  # No year
+    ('120000101030000000000', (datetime.date(2000, 1, 1), 2000, 'exact')),
+    ('118950711040000000000', (datetime.date(1895, 7, 11), 1895, 'after')),
+    ('116270000030000000001', (datetime.date(1627, 1, 1), 1627, 'exact?')),     # Unknown month and day
+    ('119000231000000000000', (datetime.date(1900, 2, 28), 1900, 'before')),    # Day past the end of the month
+    ('117500412051755000000', (datetime.date(1750, 4, 12), 1750, 'between')),
+])
+def test_decode_tmg_date(value, expected):
+    date, year, qualifier = expected
+    day_number = None if date is None else date.toordinal() + 1721425
+    assert TMG2SQL.decode_tmg_date(value) == (day_number, year, qualifier)
+
+
+def test_day_number_is_julian():
+    assert TMG2SQL.decode_tmg_date('120000101030000000000')[0] == 2451545
+
+
+def test_conversion_stats(errors_project, tmp_path):
+    """The statistics have the phases of every table, with its records, and the JSON file has the same rows"""
+    database = tmp_path / 'stats.sqlite'
+    convert(errors_project, database, stats_json=True)
+    conn = sqlite3.connect(str(database))
+    conn.row_factory = sqlite3.Row
+    saved = [dict(row) for row in conn.execute(f'SELECT * FROM "{TMG2SQL.STATS}" ORDER BY rowid')]
+    rejected = dict(conn.execute(f'SELECT "table_name", count(*) FROM "{TMG2SQL.REJECTED}" GROUP BY 1').fetchall())
+    phases = {(row['tbl'], row['phase']): row for row in saved}
+    assert len(phases) == len(saved)
+    tables = {tbl for tbl, _phase in phases if tbl is not None}
+    assert {'$', 'N', 'G', 'E', 'F'} <= tables
+    for tbl in tables:
+        tablename = 'synth_' + tbl.lower()
+        count, = conn.execute(f'SELECT count(*) FROM "{tablename}"').fetchone()
+        assert {'open', 'decode', 'insert'} <= {phase for key, phase in phases if key == tbl}
+        assert phases[tbl, 'decode']['rows'] == phases[tbl, 'insert']['rows'] == count + rejected.get(tablename, 0)
+        assert phases[tbl, 'open']['bytes_read'] > 0
+    assert phases['E', 'verify']['rows'] == phases['E', 'decode']['rows']
+    total = saved[-1]
+    assert (total['tbl'], total['phase']) == (None, 'total')
+    assert total['rows'] == sum(phases[tbl, 'decode']['rows'] for tbl in tables)
+    assert all(0 < row['peak_rss_kb'] <= total['peak_rss_kb'] for row in saved)
+    conn.close()
+
+    # The JSON is written at the end of the run, so only the total is later
+    written = json.loads(database.with_name('stats_stats.json').read_text())
+    assert written[:-1] == saved[:-1]
+
+    def fixed(row):
+        return {key: value for key, value in row.items() if key not in ('seconds', 'rows_per_sec', 'peak_rss_kb')}
+    assert fixed(written[-1]) == fixed(total)
+
+
+def test_lineage_matches_recursive_query(clean_project, tmp_path):
+    """_lineage has the shortest line, and shortest line of primary parents, between every ancestor and descendant"""
+    database = tmp_path / 'lineage.sqlite'
+    convert(clean_project, database, lineage=True)
+    conn = sqlite3.connect(str(database))
+
+    def closure(condition):
+        return {(ancestor, descendant): generations for ancestor, descendant, generations in conn.execute(f'''
+WITH RECURSIVE links(parent, child) AS (
+    SELECT "FATHER", "PER_NO" FROM "synth_$" WHERE coalesce("FATHER", 0) <> 0
+    UNION SELECT "MOTHER", "PER_NO" FROM "synth_$" WHERE coalesce("MOTHER", 0) <> 0
+    UNION SELECT "PARENT", "CHILD" FROM "synth_f" WHERE coalesce("PARENT", 0) <> 0 {condition}
+), lines(ancestor, descendant, generations) AS (
+    SELECT parent, child, 1 FROM links
+    UNION SELECT links.parent, lines.descendant, lines.generations + 1
+    FROM lines JOIN links ON links.child = lines.ancestor WHERE lines.generations < {PEOPLE}
+)
+SELECT ancestor, descendant, min(generations) FROM lines WHERE ancestor <> descendant GROUP BY 1, 2''')}
+
+    every = closure('')
+    primary = closure('AND "PRIMARY"')
+    lineage = {(ancestor, descendant): (generations, primary_generations)
+               for ancestor, descendant, generations, primary_generations
+               in conn.execute(f'SELECT * FROM "{TMG2SQL.LINEAGE}"')}
+    conn.close()
+    assert len(every) > PEOPLE
+    assert lineage == {key: (generations, primary.get(key)) for key, generations in every.items()}
+
+
+def test_merge_keeps_each_project_apart(clean_project, errors_project, tmp_path):
+    """Merged projects have the same records as their own databases, and loading one again replaces it"""
+    database = tmp_path / 'merged.sqlite'
+    for pjc in (clean_project, errors_project, clean_project):
+        convert(pjc, database, merge=True)
+    convert(clean_project, tmp_path / 'clean.sqlite')
+    single = dump(tmp_path / 'clean.sqlite')
+
+    conn = sqlite3.connect(str(database))
+    projects = conn.execute(f'SELECT "project_id", "project" FROM "{TMG2SQL.PROJECTS}" ORDER BY 1').fetchall()
+    assert [project for _project_id, project in projects] == [str(clean_project.resolve()),
+                                                              str(errors_project.resolve())]
+    for key in ('$', 'N', 'G', 'S'):
+        columns = [row[1] for row in conn.execute(f'PRAGMA table_info("tmg_{key}")') if row[1] != 'project_id']
+        merged = conn.execute(f'''SELECT {', '.join(f'"{col}"' for col in columns)} FROM "tmg_{key}"
+    WHERE "project_id" = 1 ORDER BY {', '.join(str(num) for num in range(1, len(columns) + 1))}''').fetchall()
+        assert merged == single['synth_' + key.lower()]
+    missing = conn.execute(f'SELECT "project_id", count(*) FROM "{TMG2SQL.MISSING_REFS}" GROUP BY 1').fetchall()
+    assert missing == [(2, 3)]
+    conn.close()
+
+
+def test_sql_script_builds_the_database(errors_project, tmp_path):
+    """Running the sql script gives the tables and indexes of a direct conversion, skipping the same records"""
+    convert(errors_project, tmp_path / 'direct.sqlite')
+    script = tmp_path / 'errors.sql'
+    TMG2SQL.tmg2script(errors_project, TMG2SQL.Options(output=script, format='sql'))
+    conn = sqlite3.connect(str(tmp_path / 'script.sqlite'))
+    conn.executescript(script.read_text(encoding='utf-8'))
+    conn.close()
+    direct = dump(tmp_path / 'direct.sqlite')
+    assert direct.pop(TMG2SQL.REJECTED) and direct.pop(TMG2SQL.MISSING_REFS)
+    assert dump(tmp_path / 'script.sqlite') == direct
+
+    def indexes(database):
+        conn = sqlite3.connect(str(database))
+        try:
+            return sorted(conn.execute("SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'index'"))
+        finally:
+            conn.close()
+    assert indexes(tmp_path / 'script.sqlite') == [index for index in indexes(tmp_path / 'direct.sqlite')
+                                                   if not index[1].startswith('_')]
+
+
+@pytest.mark.parametrize('value, text', [
+    (None, '\\N'), (True, 't'), (False, 'f'), (42, '42'), (2.5, '2.5'), (float('nan'), 'NaN'),
+    (float('-inf'), '-Infinity'), (b'\x00\xff', '\\\\x00ff'), ('a\\b\tc\nd\re\0f', 'a\\\\b\\tc\\nd\\ref'),
+])
+def test_copy_text(value, text):
+    assert TMG2SQL.copy_text(value) == text
+
+
+def test_postgres_script_structure(errors_project, tmp_path):
+    """The postgres script loads every record in COPY blocks, then keys the tables, then adds NOT VALID Foreign Keys"""
+    convert(errors_project, tmp_path / 'direct.sqlite')
+    direct = dump(tmp_path / 'direct.sqlite')
+    rejected = {}
+    for table_name, *_rest in direct[TMG2SQL.REJECTED]:
+        rejected[table_name] = rejected.get(table_name, 0) + 1
+    script = tmp_path / 'errors.pgsql'
+    TMG2SQL.tmg2script(errors_project, TMG2SQL.Options(output=script, format='postgres'))
+    lines = script.read_text(encoding='utf-8').split('\n')
+
+    copied = {}
+    copying = None
+    width = last_copy = 0
+    for num, line in enumerate(lines):
+        if copying is not None:
+            if line == '\\.':
+                copying = None
+                continue
+            assert len(line.split('\t')) == width and '\r' not in line, (num, line)
+            copied[copying] += 1
+        elif line.startswith('COPY '):
+            assert line.endswith(') FROM stdin;')
+            copying = line.split('"')[1]
+            width = line.count(', ') + 1
+            copied[copying] = 0
+            last_copy = num
+    assert copying is None
+    for name, rows in direct.items():
+        if not name.startswith('_'):
+            assert copied[name] == len(rows) + rejected.get(name, 0), name
+
+    key = lines.index('CREATE UNIQUE INDEX "synth_$_pkey" ON "synth_$"("PER_NO");')
+    assert lines[key - 1].startswith('DELETE FROM "synth_$" a USING "synth_$" b WHERE a.ctid > b.ctid')
+    foreign = [num for num, line in enumerate(lines) if line.startswith('ALTER TABLE')]
+    assert foreign and min(foreign) > last_copy
+    assert all(lines[num].endswith(' NOT VALID;') for num in foreign)
+    assert 'ALTER TABLE "synth_e" ADD FOREIGN KEY ("GNUM") REFERENCES "synth_g"("RECNO") NOT VALID;' in lines
+    assert lines[-3:] == ['COMMIT;', 'ANALYZE;', '']
+
+
+def test_parquet_binary_memos(tmp_path):
+    """General and picture memos are binary columns, and a binary memo isn't written as text"""
+    writer = TMG2SQL.ParquetWriter(tmp_path / 'out.parquet')
+    pa = writer.pa
+    for ftype in 'GP0':
+        assert writer.arrow_type('TEXT', TMG2SQL.DbfField('MEMO', ftype, 4, 0)) == pa.binary()
+    assert writer.arrow_type('TEXT', TMG2SQL.DbfField('MEMO', 'M', 4, 0)) == pa.string()
+    picture = b'\x89PNG\r\n\x1a\n\xff'
+    column = writer.arrow_column([picture, None], pa.binary(), 'PICTURE')
+    assert column.to_pylist() == [picture, None]
+    column = writer.arrow_column(['text', picture], pa.string(), 'COMMENTS')
+    assert column.to_pylist() == ['text', None]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_parquet_matches_the_database(clean_project, tmp_path, workers):
+    """Each Parquet file has the records of its table in the database, with typed columns and the keys"""
+    pq = pytest.importorskip('pyarrow.parquet')
+    convert(clean_project, tmp_path / 'clean.sqlite')
+    database = dump(tmp_path / 'clean.sqlite')
+    output = tmp_path / 'clean.parquet'
+    summary = TMG2SQL.tmg2script(clean_project, TMG2SQL.Options(output=output, format='parquet', workers=workers))
+    assert summary['errors'] == 0
+
+    def value(value):
+        if isinstance(value, datetime.datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        if isinstance(value, datetime.date):
+            return value.isoformat()
+        return int(value) if isinstance(value, bool) else value
+
+    files = {path.stem: pq.read_table(path) for path in output.iterdir()}
+    assert set(files) == set(database) - {TMG2SQL.MISSING_REFS, TMG2SQL.REJECTED}
+    for name, table in files.items():
+        assert sorted(tuple(map(value, rec.values())) for rec in table.to_pylist()) == database[name]
+    people = files['synth_$']
+    assert people.schema.field('PER_NO').type == 'int64'
+    assert people.schema.field('PBIRTH_DAYNUM').type == 'int64'
+    assert str(people.schema.field('LAST_EDIT').type) == 'date32[day]'
+    assert str(files['synth_n'].schema.field('PRIMARY').type) == 'bool'
+    metadata = json.loads(people.schema.metadata[b'tmg2sql'])
+    assert (metadata['tbl'], metadata['table'], metadata['primary']) == ('$', 'synth_$', ['PER_NO'])
+    foreign = json.loads(files['synth_e'].schema.metadata[b'tmg2sql'])['foreign']
+    assert {'column': 'GNUM', 'table': 'synth_g', 'ref_column': 'RECNO'} in foreign
+
+
+@pytest.mark.parametrize('stop', [TMG2SQL.ConversionCancelled, RuntimeError])
+@pytest.mark.parametrize('update', ['merge', 'incremental'])
+def test_stopped_update_leaves_the_database(clean_project, errors_project, tmp_path, update, stop):
+    """A merge or incremental conversion is made in place, and rolled back if cancelled or failing part way"""
+    database = tmp_path / 'update.sqlite'
+    convert(clean_project, database, merge=(update == 'merge'))
+    before = dump(database)
+    cancel = threading.Event()
+
+    def progress(kind, _value):
+        assert not database.with_name('update.sqlite.partial').exists()
+        if kind == 'table':
+            if stop is RuntimeError:
+                raise RuntimeError('Failed')
+            cancel.set()
+
+    with pytest.raises(stop):
+        convert(errors_project, database, progress=progress, cancel=cancel, **{update: True})
+    assert dump(database) == before
+    assert [path.name for path in tmp_path.iterdir()] == ['update.sqlite']
+
+
+@pytest.mark.parametrize('word, code', [
+    ('Robert', 'R163'), ('Rupert', 'R163'), ('Rubin', 'R150'), ('Ashcraft', 'A261'),
+    ('Tymczak', 'T522'), ('Pfister', 'P236'), ('Honeyman', 'H555'), ("O'Brien", 'O165'),
+    ('Lee', 'L000'), ('', ''), ('123', ''),
+])
+def test_soundex(word, code):
+    assert TMG2SQL.soundex(word) == code
+
+
+def test_phonetic_search_finds_records(clean_project, tmp_path):
+    """A phonetic search gives the names and places with a part of the Soundex code, by their own keys"""
+    database = tmp_path / 'fts.sqlite'
+    convert(clean_project, database, fts=True)
+    conn = sqlite3.connect(str(database))
+    hits = TMG2SQL.search(conn, 'Braun', limit=10 ** 6, phonetic=True)
+    names = {(hit.key, hit.person) for hit in hits if hit.tbl == 'N'}
+    assert names and {hit.tbl for hit in hits} == {'N'}
+    by_surname = set(conn.execute('''SELECT n."RECNO", n."NPER" FROM "synth_n" AS n
+    JOIN "synth_nd" AS d ON d."UID" = n."SURID" WHERE d."SDX" = ?''', ('B650',)).fetchall())
+    assert by_surname and by_surname <= names
+    for key, _person in names:
+        assert conn.execute('''SELECT 1 FROM "synth_npv" AS v JOIN "synth_nd" AS d ON d."UID" = v."UID"
+    WHERE v."RECNO" = ? AND d."SDX" = ?''', (key, 'B650')).fetchone()
+    places = [hit for hit in TMG2SQL.search(conn, 'Tone', limit=10 ** 6, phonetic=True) if hit.tbl == 'P']
+    assert len(places) == conn.execute('SELECT count(DISTINCT "RECNO") FROM "synth_ppv"').fetchone()[0]
+    assert all(hit.person is None for hit in places)
+    conn.close()
+
+
+def found(database, word, project_id=None):
+    """The (table, key, person) of each record search finds for a word, phonetically too"""
+    conn = sqlite3.connect(str(database))
+    try:
+        return {(hit.tbl, hit.key, hit.person)
+                for hit in TMG2SQL.search(conn, word, limit=10 ** 6, phonetic=True, project_id=project_id)}
+    finally:
+        conn.close()
+
+
+def test_search_merged_projects(clean_project, errors_project, tmp_path):
+    """The full-text indexes of a merged database find what those of each project's own database do
+
+    Projects added or replaced keep the indexes up to date, even without fts.
+    """
+    convert(clean_project, tmp_path / 'clean.sqlite', fts=True)
+    convert(errors_project, tmp_path / 'errors.sqlite', fts=True)
+    words = synth.SURNAMES + ('Braun', 'Smyth')
+    expected = {word: (found(tmp_path / 'clean.sqlite', word), found(tmp_path / 'errors.sqlite', word))
+                for word in words}
+    assert all(clean and errors for clean, errors in expected.values())
+
+    database = tmp_path / 'merged.sqlite'
+    for step, (pjc, options) in enumerate(((clean_project, {'fts': True}), (errors_project, {}), (clean_project, {}))):
+        convert(pjc, database, merge=True, **options)
+        conn = sqlite3.connect(str(database))
+        indexes = [name for (name,) in conn.execute("""SELECT name FROM sqlite_master
+    WHERE name GLOB '_search_*' AND sql LIKE 'CREATE VIRTUAL TABLE%'""")]
+        assert len(indexes) == 5
+        for name in indexes:
+            conn.execute(f'''INSERT INTO "{name}"("{name}", rank) VALUES ('integrity-check', 1)''')
+        conn.close()
+        for word in words:
+            assert found(database, word, 1) == expected[word][0]
+            if step:
+                assert found(database, word, 2) == expected[word][1]
+
+
+def test_read_views_match_the_tables(clean_project, tmp_path):
+    """Each read view has a row per record of its main table, with what its joins find in the tables"""
+    database = tmp_path / 'views.sqlite'
+    convert(clean_project, database, views=True)
+    conn = sqlite3.connect(str(database))
+
+    def rows(sql, *args):
+        return conn.execute(sql, args).fetchall()
+
+    def name_of(per_no):
+        (name,), = rows('''SELECT "SRNAMEDISP" FROM "synth_n" WHERE "RECNO" =
+    (SELECT min("RECNO") FROM "synth_n" WHERE "NPER" = ? AND "PRIMARY")''', per_no) or [(None,)]
+        return name
+
+    for view, table in (('person', 'synth_$'), ('event', 'synth_g'), ('citation', 'synth_s')):
+        assert rows(f'SELECT count(*) FROM "_view_{view}"') == rows(f'SELECT count(*) FROM "{table}"')
+
+    people = rows('SELECT "PER_NO", "name", "surname", "given", "PBIRTH", "FATHER", "father_name" '
+                  'FROM "_view_person" ORDER BY 1 LIMIT 20')
+    for per_no, name, surname, given, birth, father, father_name in people:
+        assert name == name_of(per_no)
+        assert (surname, given) == rows('''SELECT s."VALUE", g."VALUE" FROM "synth_n" AS n
+    JOIN "synth_nd" AS s ON s."UID" = n."SURID" JOIN "synth_nd" AS g ON g."UID" = n."GIVID"
+    WHERE n."NPER" = ? AND n."PRIMARY" ORDER BY n."RECNO" LIMIT 1''', per_no)[0]
+        assert birth == rows('SELECT "PBIRTH" FROM "synth_$" WHERE "PER_NO" = ?', per_no)[0][0]
+        assert father_name == name_of(father)
+    assert any(father for *_, father, _name in people)
+
+    events = rows('SELECT "RECNO", "EDATE", "PLACENUM", "place", "PER1", "per1_name", "witnesses" '
+                  'FROM "_view_event" ORDER BY 1 LIMIT 50')
+    for recno, date, placenum, place, per1, per1_name, witnesses in events:
+        assert date == rows('SELECT "EDATE" FROM "synth_g" WHERE "RECNO" = ?', recno)[0][0]
+        parts = rows('''SELECT d."VALUE" FROM "synth_ppv" AS v JOIN "synth_pd" AS d ON d."UID" = v."UID"
+    WHERE v."RECNO" = ? AND d."VALUE" <> '' ORDER BY v."TYPE"''', placenum)
+        assert place == (', '.join(value for value, in parts) or None)
+        assert per1_name == name_of(per1)
+        assert witnesses == rows('SELECT count(*) FROM "synth_e" WHERE "GNUM" = ?', recno)[0][0]
+    assert any(place for *_, place, _per1, _name, _witnesses in events)
+    assert any(witnesses for *_, witnesses in events)
+
+    citations = rows('SELECT "RECNO", "MAJSOURCE", "source_title", "repository" FROM "_view_citation" '
+                     'ORDER BY 1 LIMIT 20')
+    for recno, source, title, repository in citations:
+        assert title == rows('SELECT "TITLE" FROM "synth_m" WHERE "MAJNUM" = ?', source)[0][0]
+        assert repository == (rows('''SELECT "RNUMBER" FROM "synth_w" WHERE "MNUMBER" = ?
+    ORDER BY "PRIMARY" DESC, "RNUMBER" LIMIT 1''', source) or [(None,)])[0][0]
+    assert citations
+    conn.close()
+
+
+def test_convert_batch(clean_project, errors_project, tmp_path, capsys):
+    """A batch found in a directory tree converts each project in its own process, next to its own log"""
+    batch = tmp_path / 'batch'
+    for name, pjc in (('clean', clean_project), ('errors', errors_project)):
+        shutil.copytree(pjc.parent, batch / 'clients' / name, ignore=shutil.ignore_patterns('*.log', '*.sqlite'))
+    expected = {name: convert(pjc, tmp_path / f'{name}.sqlite')
+                for name, pjc in (('clean', clean_project), ('errors', errors_project))}
+    capsys.readouterr()
+
+    summaries = TMG2SQL.find_file(batch, '*.PJC', TMG2SQL.Options(workers=2))
+    printed = capsys.readouterr().out
+    assert [Path(summary['project']).parent.name for summary in summaries] == ['clean', 'errors']
+    for summary in summaries:
+        pjc = Path(summary['project'])
+        name = pjc.parent.name
+        assert (summary['rows'], summary['errors']) == (expected[name]['rows'], expected[name]['errors'])
+        assert summary['seconds'] > 0
+        # Each log has only its own project's errors
+        assert ('Missing References' in pjc.with_suffix('.log').read_text()) == (name == 'errors')
+        assert dump(pjc.with_suffix('.sqlite')) == dump(tmp_path / f'{name}.sqlite')
+        assert f"{summary['project']:60} {summary['seconds']:9.1f} {summary['rows']:>10}" in printed
+    assert summaries[0]['errors'] == 0 and summaries[1]['errors'] > 0
@@ -0,0 +1,105 @@
+"""DbfReader against dbfread, on the synthetic projects, and the record converter"""
+import datetime
+from decimal import Decimal
+from itertools import product
+from pathlib import Path
+
+import pytest
+from dbfread import DBF
+
+import TMG2SQL
+from TMG2SQL import DbfField, DbfReader, ERROR_CHAR, record_converter, record_tuple
+
+
+def dbf_files(pjc):
+    return sorted(Path(pjc).parent.glob('*.dbf'))
+
+
+@pytest.mark.parametrize('fixture', ['clean_project', 'errors_project'])
+def test_reader_matches_dbfread(fixture, request):
+    """The records, deleted records and value types are the same as read by dbfread"""
+    files = dbf_files(request.getfixturevalue(fixture))
+    assert files
+    for filename in files:
+        reader = DbfReader(filename)
+        table = DBF(str(filename), char_decode_errors='replace', recfactory=record_tuple)
+        assert reader.field_names == table.field_names, filename.name
+        for ours, theirs in ((list(reader), list(table)), (reader.deleted, list(table.deleted))):
+            assert ours == theirs, filename.name
+            assert [[type(value) for value in rec] for rec in ours] == \
+                   [[type(value) for value in rec] for rec in theirs], filename.name
+
+
+def test_errors_project_has_a_deleted_record(errors_project):
+    """So test_reader_matches_dbfread covers the deleted records"""
+    deleted = {filename.name: len(DbfReader(filename).deleted) for filename in dbf_files(errors_project)}
+    assert {name: count for name, count in deleted.items() if count} == {'synth_G.dbf': 1}
+
+
+def plain_convert(fields, fkeys, rec):
+    """The conversion record_converter compiles, written out plainly as it was before"""
+    names = [field.name for field in fields]
+    values = list(rec)
+    for col in fkeys or ():
+        if isinstance(col, str) and col in names and values[names.index(col)] == 0:
+            values[names.index(col)] = None
+    for num, field in enumerate(fields):
+        if values[num] is not None and field.type == 'D':
+            values[num] = values[num].strftime('%Y-%m-%d')
+        elif values[num] is not None and field.type in 'T@':
+            values[num] = values[num].strftime('%Y-%m-%d %H:%M:%S')
+    char_error = any(isinstance(values[num], str) and ERROR_CHAR in values[num]
+                     for num, field in enumerate(fields) if field.type in 'CMV')
+    return values, char_error
+
+
+# Values of each field type DbfReader reads, including the ones the converter changes
+FIELD_VALUES = {
+    'C': ['', 'Smith', 'Sm' + ERROR_CHAR + 'th'],
+    'M': [None, 'A memo', ERROR_CHAR, b'\x89PNG'],
+    'V': ['', 'var' + ERROR_CHAR],
+    'D': [None, datetime.date(1850, 2, 3), datetime.date(2024, 12, 31)],
+    'T': [None, datetime.datetime(1999, 12, 31, 23, 59, 58)],
+    '@': [datetime.datetime(2001, 1, 2, 3, 4, 5)],
+    'I': [0, 7, -1],
+    '+': [0, 12],
+    'N': [None, 0, 3, 2.5],
+    'F': [None, 0.0, 1.25],
+    'L': [None, True, False],
+    'B': [0.0, 1e10],
+    'O': [2.0],
+    'Y': [Decimal('0'), Decimal('1.2345')],
+    'G': [None, b'\x00\x01'],
+    'P': [b'GIF89a'],
+    '0': [b'\x00'],
+}
+
+
+def test_record_converter_matches_plain_conversion():
+    """The compiled converter gives the same values and character errors for every field type"""
+    fields = [DbfField(f'F{num}', ftype, 4, 0) for num, ftype in enumerate(FIELD_VALUES)]
+    keys = [field.name for field in fields if field.type in 'IN+'] + [('G', 'RECNO')]
+    for fkeys in (None, keys):
+        convert = record_converter(fields, fkeys)
+        for column in range(len(fields)):
+            # Each value of each column, with the first values of the other columns
+            for value in FIELD_VALUES[fields[column].type]:
+                rec = tuple(value if num == column else FIELD_VALUES[field.type][0]
+                            for num, field in enumerate(fields))
+                assert convert(rec) == plain_convert(fields, fkeys, rec), (fields[column], value)
+    # Several text columns with and without errors, reported once
+    fields = [DbfField('A', 'C', 10, 0), DbfField('B', 'M', 4, 0)]
+    convert = record_converter(fields, None)
+    for rec in product(FIELD_VALUES['C'], FIELD_VALUES['M']):
+        assert convert(rec) == plain_convert(fields, None, rec), rec
+
+
+@pytest.mark.parametrize('fixture', ['clean_project', 'errors_project'])
+def test_record_converter_on_the_projects(fixture, request):
+    """The compiled converter gives the same values as the plain conversion on every table"""
+    for filename in dbf_files(request.getfixturevalue(fixture)):
+        reader = DbfReader(filename)
+        fkeys = TMG2SQL.table_info.get(filename.stem.split('_', 1)[1].upper(), {}).get(TMG2SQL.FOREIGN)
+        convert = record_converter(reader.fields, fkeys)
+        for rec in reader:
+            assert convert(rec) == plain_convert(reader.fields, fkeys, rec), filename.name